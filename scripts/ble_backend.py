@@ -0,0 +1,487 @@
+"""
+Pluggable BLE backend: the real simplepyble stack or an in-process fake.
+
+Everything that talks BLE gets its adapters from get_adapters(). By default
+that is simplepyble.Adapter.get_adapters(); with ARRYTHMIX_BLE_BACKEND=fake:N
+(or use_backend(FakeBackend(...))) it is a simulated adapter that advertises N
+ECG peripherals with the same API surface the host code uses: scanning with
+callbacks, connect/disconnect/is_connected, services() and notify().
+
+Fake peripherals behave like src/main.c: a k_timer fires every 2.3 ms, 20 ticks
+take an ADC sample (12 bit, 0 while the leads are off) and the 21st sends the
+40-byte uint16[20] notification. Each device has its own crystal drift, and
+faults can be injected at configurable rates:
+
+    leads off     LEADS_OFF_S of zero samples
+    disconnects   the link drops; the device advertises again after RECONNECT_DELAY_S
+    jitter        notifications are delivered late by up to jitter_s, in order
+    connect       a share of connect() calls fail like a busy radio
+
+One "radio" thread delivers every device's notifications, so a slow callback
+delays all of them, just like the single BLE event thread of a real stack; the
+lag and callback time are measured. `python ble_backend.py loadtest` runs the
+daemon's discovery + ble_link + Session path against 100+ fake devices.
+"""
+import argparse
+import heapq
+import os
+import random
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from discovery import DEVICE_IDENTIFIER, FIRMWARE_SERVICE_UUID
+from ml.metrics import Histogram
+from ml.timing import FRAME_SAMPLES, TICKS_PER_FRAME, TIMER_PERIOD_S
+
+# === Configuration ===
+BACKEND_ENV = "ARRYTHMIX_BLE_BACKEND"      # "simplepyble" (default), "fake" or "fake:<devices>"
+ADC_BITS = 12                               # zephyr,resolution in the board overlay
+ADC_MIDSCALE = 1 << (ADC_BITS - 1)
+COUNTS_PER_MV = 114                         # AD8232 gain 100, 1/6 gain on the 0.6 V reference
+LEADS_OFF_S = 2.0
+RECONNECT_DELAY_S = 1.0                     # a dropped device needs this long before it accepts a connection
+ADVERTISING_INTERVAL_S = 0.1
+SIGNAL_SECONDS = 120                        # length of the looped synthetic / replayed signal per device
+FRAME_PERIOD_S = TICKS_PER_FRAME * TIMER_PERIOD_S
+
+
+class SimplePyBLEBackend():
+    """The real radio."""
+    name = "simplepyble"
+
+    def get_adapters(self):
+        import simplepyble
+        return simplepyble.Adapter.get_adapters()
+
+
+_backend = None
+
+
+def use_backend(backend):
+    """Selects the backend for every later get_adapters() call in this process."""
+    global _backend
+    _backend = backend
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        spec = os.environ.get(BACKEND_ENV, "simplepyble")
+        if spec.startswith("fake"):
+            _, _, devices = spec.partition(":")
+            _backend = FakeBackend(devices=int(devices or 1))
+        else:
+            _backend = SimplePyBLEBackend()
+    return _backend
+
+
+def get_adapters():
+    return get_backend().get_adapters()
+
+
+# --- Signals ---
+
+def synthetic_ecg(seconds, fs, heart_rate_bpm=72.0, seed=0):
+    """PQRST-shaped ADC counts with heart rate variability, baseline wander and noise."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * fs)
+    t = np.arange(n) / fs
+    signal = 0.15 * np.sin(2 * np.pi * 0.25 * t) + rng.normal(0.0, 0.02, n)        # mV
+    waves = ((-0.2, 0.025, 0.12), (-0.03, 0.01, -0.1), (0.0, 0.012, 1.2),           # P, Q, R
+             (0.03, 0.01, -0.25), (0.25, 0.04, 0.3))                                # S, T: (offset s, width s, mV)
+    beat = 0.5
+    while beat < seconds - 0.5:
+        for offset, width, amplitude in waves:
+            lo, hi = int((beat + offset - 4 * width) * fs), int((beat + offset + 4 * width) * fs)
+            window = t[max(lo, 0):min(hi, n)]
+            signal[max(lo, 0):min(hi, n)] += amplitude * np.exp(-0.5 * ((window - beat - offset) / width) ** 2)
+        beat += 60.0 / heart_rate_bpm * (1.0 + rng.normal(0.0, 0.03))
+    return np.clip(ADC_MIDSCALE + signal * COUNTS_PER_MV, 1, (1 << ADC_BITS) - 1).astype(np.uint16)
+
+
+def replayed_ecg(path, fs, channel=0, seconds=SIGNAL_SECONDS):
+    """A record (WFDB, EDF, .raw, .arxc) resampled to the device rate and scaled to ADC counts."""
+    from scipy.signal import resample_poly
+    from ml.readers import open_record
+    record = open_record(path)
+    source_hz = record.sample_rate(channel)
+    values = record.read(0, int(seconds * source_hz), channel)
+    if path.lower().endswith((".raw", ".arxc")):
+        millivolts = (values - np.median(values)) / COUNTS_PER_MV       # already device counts
+    else:
+        millivolts = record.to_physical(values, channel)
+    resampled = resample_poly(millivolts, int(round(fs * 10)), int(round(source_hz * 10)))
+    return np.clip(ADC_MIDSCALE + resampled * COUNTS_PER_MV, 1, (1 << ADC_BITS) - 1).astype(np.uint16)
+
+
+# --- Fake stack ---
+
+class _Service():
+    def __init__(self, uuid):
+        self._uuid = uuid
+
+    def uuid(self):
+        return self._uuid
+
+
+class FakePeripheral():
+    def __init__(self, backend, index, signal, drift_ppm):
+        self._backend = backend
+        self._index = index
+        self._address = f"FA:CE:00:00:{index >> 8:02X}:{index & 0xFF:02X}"
+        self._signal = signal
+        self._position = (index * 7919) % len(signal)         # devices are not in phase
+        self.frame_period_s = FRAME_PERIOD_S * (1.0 - drift_ppm * 1e-6)
+        self._connected = False
+        self._callback = None
+        self._leads_off_frames = 0
+        self._unavailable_until = 0.0
+        self._dropped_at = None
+        self._last_delivery = 0.0
+
+    # simplepyble.Peripheral API used by the host code
+
+    def identifier(self):
+        return DEVICE_IDENTIFIER
+
+    def address(self):
+        return self._address
+
+    def rssi(self):
+        return -60 - self._index % 30
+
+    def is_connectable(self):
+        return True
+
+    def services(self):
+        return [_Service(FIRMWARE_SERVICE_UUID)]
+
+    def mtu(self):
+        return 247
+
+    def connect(self):
+        backend = self._backend
+        with backend.lock:
+            if self._connected:
+                return
+            if time.monotonic() < self._unavailable_until or backend.rng.random() < backend.connect_failure:
+                backend.counters["connect_failures"] += 1
+                raise RuntimeError(f"Failed to connect to {self._address}")
+            self._connected = True
+            if self._dropped_at is not None:
+                backend.counters["reconnects"] += 1
+                backend.reconnect_times.append(time.monotonic() - self._dropped_at)
+                self._dropped_at = None
+
+    def disconnect(self):
+        with self._backend.lock:
+            self._connected = False
+            self._callback = None
+
+    def is_connected(self):
+        return self._connected
+
+    def notify(self, service, characteristic, callback):
+        with self._backend.lock:
+            if not self._connected:
+                raise RuntimeError(f"{self._address} is not connected")
+            self._callback = callback
+
+    def unsubscribe(self, service, characteristic):
+        with self._backend.lock:
+            self._callback = None
+
+    # firmware side
+
+    def _next_frame(self):
+        """One notification payload; the device keeps sampling whether or not anyone listens."""
+        backend = self._backend
+        if self._leads_off_frames == 0 and backend.rng.random() < backend.leads_off_probability:
+            self._leads_off_frames = int(LEADS_OFF_S / FRAME_PERIOD_S)
+            backend.counters["leads_off"] += 1
+        start = self._position
+        self._position = (self._position + FRAME_SAMPLES) % (len(self._signal) - FRAME_SAMPLES)
+        if self._leads_off_frames:
+            self._leads_off_frames -= 1
+            return bytes(2 * FRAME_SAMPLES)
+        return self._signal[start:start + FRAME_SAMPLES].astype("<u2").tobytes()
+
+    def _drop(self, now):
+        self._connected = False
+        self._callback = None
+        self._dropped_at = now
+        self._unavailable_until = now + RECONNECT_DELAY_S
+        self._backend.counters["disconnects"] += 1
+
+
+class FakeAdapter():
+    def __init__(self, backend):
+        self._backend = backend
+        self._on_found = lambda peripheral: None
+        self._on_start = lambda: None
+        self._on_stop = lambda: None
+        self._scanning = threading.Event()
+        self._results = {}
+
+    def identifier(self):
+        return "fake0"
+
+    def address(self):
+        return "FA:CE:FF:FF:FF:FF"
+
+    def set_callback_on_scan_found(self, callback):
+        self._on_found = callback
+
+    def set_callback_on_scan_start(self, callback):
+        self._on_start = callback
+
+    def set_callback_on_scan_stop(self, callback):
+        self._on_stop = callback
+
+    def scan_is_active(self):
+        return self._scanning.is_set()
+
+    def scan_start(self):
+        self._scanning.set()
+        self._on_start()
+        threading.Thread(target=self._advertise, daemon=True).start()
+
+    def scan_stop(self):
+        if self._scanning.is_set():
+            self._scanning.clear()
+            self._on_stop()
+
+    def scan_for(self, timeout_ms):
+        self.scan_start()
+        time.sleep(timeout_ms / 1000)
+        self.scan_stop()
+
+    def scan_get_results(self):
+        return list(self._results.values())
+
+    def get_paired_peripherals(self):
+        return []
+
+    def _advertise(self):
+        """Every advertising (unconnected) device is seen once per advertising interval, in random order."""
+        rng = random.Random(self._backend.seed)
+        while self._scanning.is_set():
+            now = time.monotonic()
+            visible = [p for p in self._backend.peripherals if not p.is_connected() and now >= p._unavailable_until]
+            rng.shuffle(visible)
+            for peripheral in visible:
+                if not self._scanning.is_set():
+                    return
+                self._results[peripheral.address()] = peripheral
+                self._on_found(peripheral)
+            time.sleep(ADVERTISING_INTERVAL_S)
+
+
+class FakeBackend():
+    """
+    N simulated ECG peripherals behind one fake adapter.
+
+    Args:
+        devices (int): Number of advertising peripherals.
+        signal_path (str | None): Record to replay (ml.readers formats); synthetic ECG otherwise.
+        leads_off_per_min, disconnects_per_min (float): Mean fault rates per device.
+        jitter_s (float): Maximum extra delivery delay of a notification.
+        drift_ppm (float): Device crystals are spread uniformly over +-drift_ppm.
+        connect_failure (float): Probability that a connect() attempt fails.
+        seed (int): Makes signals and faults reproducible.
+    """
+    name = "fake"
+
+    def __init__(self, devices=1, signal_path=None, leads_off_per_min=0.0, disconnects_per_min=0.0, jitter_s=0.0,
+                 drift_ppm=50.0, connect_failure=0.0, seed=0):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.leads_off_probability = leads_off_per_min / 60.0 * FRAME_PERIOD_S
+        self.disconnect_probability = disconnects_per_min / 60.0 * FRAME_PERIOD_S
+        self.jitter_s = jitter_s
+        self.connect_failure = connect_failure
+        self.counters = {"frames": 0, "delivered": 0, "leads_off": 0, "disconnects": 0, "reconnects": 0,
+                         "connect_failures": 0, "callback_errors": 0}
+        self.last_callback_error = None
+        self.reconnect_times = []
+        self.callback_time = Histogram()
+        self.radio_lag = Histogram()
+        device_hz = FRAME_SAMPLES / FRAME_PERIOD_S
+        if signal_path is not None:
+            shared = replayed_ecg(signal_path, device_hz)
+            signals = [shared] * devices
+        else:
+            # A handful of distinct patients is enough; devices start at different offsets.
+            patients = [synthetic_ecg(SIGNAL_SECONDS, device_hz, 60 + 8 * k, seed + k) for k in range(min(devices, 8))]
+            signals = [patients[i % len(patients)] for i in range(devices)]
+        self.peripherals = [FakePeripheral(self, i, signals[i], self.rng.uniform(-drift_ppm, drift_ppm))
+                            for i in range(devices)]
+        self._adapter = FakeAdapter(self)
+        self._stop = threading.Event()
+        self._radio = None
+        self.started = None
+
+    def get_adapters(self):
+        if self._radio is None:
+            self.started = time.monotonic()
+            self._radio = threading.Thread(target=self._run_radio, daemon=True)
+            self._radio.start()
+        return [self._adapter]
+
+    def _run_radio(self):
+        now = time.monotonic()
+        events = [(now + self.rng.uniform(0, FRAME_PERIOD_S), i, i) for i in range(len(self.peripherals))]
+        due = {i: t for t, i, _ in events}          # device clock: when its next frame is complete
+        heapq.heapify(events)
+        order = len(events)
+        while not self._stop.is_set():
+            delivery, _, i = events[0]
+            delay = delivery - time.monotonic()
+            if delay > 0:
+                time.sleep(min(delay, 0.05))
+                continue
+            heapq.heappop(events)
+            peripheral = self.peripherals[i]
+            self.radio_lag.observe(time.monotonic() - delivery)
+            payload = peripheral._next_frame()
+            self.counters["frames"] += 1
+            with self.lock:
+                if peripheral._connected and self.rng.random() < self.disconnect_probability:
+                    peripheral._drop(time.monotonic())
+                callback = peripheral._callback if peripheral._connected else None
+            if callback is not None:
+                start = time.perf_counter()
+                try:
+                    callback(payload)
+                except Exception as e:
+                    # Keep the radio running like a real stack, but a load test must not pass over it.
+                    self.counters["callback_errors"] += 1
+                    self.last_callback_error = f"{type(e).__name__}: {e}"
+                self.callback_time.observe(time.perf_counter() - start)
+                self.counters["delivered"] += 1
+            due[i] += peripheral.frame_period_s
+            delivery = due[i] + (self.rng.uniform(0, self.jitter_s) if self.jitter_s else 0.0)
+            delivery = max(delivery, peripheral._last_delivery)     # a link delivers in order
+            peripheral._last_delivery = delivery
+            order += 1
+            heapq.heappush(events, (delivery, order, i))
+
+    def reset_stats(self):
+        self.started = time.monotonic()
+        self.counters = dict.fromkeys(self.counters, 0)
+        self.last_callback_error = None
+        self.reconnect_times = []
+        self.callback_time = Histogram()
+        self.radio_lag = Histogram()
+
+    def stats(self):
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        callback, lag = self.callback_time.snapshot(), self.radio_lag.snapshot()
+        return dict(
+            self.counters,
+            elapsed_s=elapsed,
+            callbacks_per_s=self.counters["delivered"] / elapsed if elapsed else 0.0,
+            callback_mean_ms=callback["sum"] / callback["count"] * 1e3 if callback["count"] else 0.0,
+            callback_p99_ms=self.callback_time.quantile(0.99) * 1e3,
+            radio_lag_p99_ms=self.radio_lag.quantile(0.99) * 1e3,
+            reconnect_mean_s=float(np.mean(self.reconnect_times)) if self.reconnect_times else None,
+            last_callback_error=self.last_callback_error,
+        )
+
+    def close(self):
+        self._stop.set()
+        for peripheral in self.peripherals:
+            peripheral.disconnect()
+
+
+def load_test(devices, seconds, **fake_options):
+    """
+    Runs discovery, ble_link and ingest.Session (no inference) for `devices` fake peripherals.
+
+    Returns:
+        dict: Backend counters plus per-session delivery and rate-estimation figures.
+    """
+    from discovery import DeviceCache, Discovery
+    from ingest import Session, ble_link
+    from ml.metrics import METRICS
+
+    backend = FakeBackend(devices=devices, **fake_options)
+    use_backend(backend)
+    discovery = Discovery(get_adapters()[0], cache=DeviceCache(os.path.join(tempfile.mkdtemp(), "devices.json")))
+    start = time.monotonic()
+    found = discovery.find(count=devices, timeout=30)
+    scan_s = time.monotonic() - start
+    stop_event = threading.Event()
+    sessions, threads = [], []
+    for i, peripheral in enumerate(found):
+        session = Session(f"fake-{i}", trigger_samples=10 ** 9)
+        for attempt in range(5):
+            try:
+                peripheral.connect()
+                break
+            except RuntimeError:
+                time.sleep(0.1)
+        thread = threading.Thread(target=ble_link, args=(session, discovery, peripheral, stop_event), daemon=True)
+        thread.start()
+        sessions.append((session, peripheral))
+        threads.append(thread)
+    def samples():
+        return [METRICS.sessions.get(session.name, {}).get("samples", 0) for session, _ in sessions]
+
+    backend.reset_stats()               # measure the steady state, not the scan and connection setup
+    before = samples()
+    time.sleep(seconds)
+    received = [after - start for after, start in zip(samples(), before)]
+    stats = backend.stats()
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    backend.close()
+
+    expected = seconds * FRAME_SAMPLES / FRAME_PERIOD_S
+    rate_error = [abs(session.timing.clock.sample_rate_hz * peripheral.frame_period_s / FRAME_SAMPLES - 1.0) * 1e6
+                  for session, peripheral in sessions]
+    return dict(
+        stats,
+        devices_found=len(found),
+        scan_s=scan_s,
+        samples_per_device_expected=expected,
+        samples_per_device_min=min(received) if received else 0,
+        samples_per_device_mean=float(np.mean(received)) if received else 0.0,
+        gaps=sum(METRICS.sessions.get(session.name, {}).get("gaps", 0) for session, _ in sessions),
+        rate_error_ppm_median=float(np.median(rate_error)) if rate_error else None,
+        rate_error_ppm_max=max(rate_error) if rate_error else None,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hardware-free BLE load test against simulated ECG peripherals.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    test = sub.add_parser("loadtest")
+    test.add_argument("--devices", type=int, default=100)
+    test.add_argument("--seconds", type=float, default=30.0)
+    test.add_argument("--signal", help="Record to replay instead of synthetic ECG.")
+    test.add_argument("--leads-off-per-min", type=float, default=0.5)
+    test.add_argument("--disconnects-per-min", type=float, default=0.5)
+    test.add_argument("--jitter-ms", type=float, default=15.0)
+    test.add_argument("--connect-failure", type=float, default=0.05)
+    test.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    result = load_test(args.devices, args.seconds, signal_path=args.signal, leads_off_per_min=args.leads_off_per_min,
+                       disconnects_per_min=args.disconnects_per_min, jitter_s=args.jitter_ms / 1e3,
+                       connect_failure=args.connect_failure, seed=args.seed)
+    width = max(len(key) for key in result)
+    for key, value in result.items():
+        print(f"{key:<{width}}  {value:.3f}" if isinstance(value, float) else f"{key:<{width}}  {value}")
+    if result["callback_errors"]:
+        print(f"FAIL: {result['callback_errors']} notification callbacks raised (last: {result['last_callback_error']})")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
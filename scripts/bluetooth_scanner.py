@@ -1,32 +1,28 @@
-import simplepyble
+import ble_backend
 import time
 import serial
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from collections import deque
 
+from discovery import Discovery
+
 if __name__ == "__main__":
-    adapters = simplepyble.Adapter.get_adapters()
+    adapters = ble_backend.get_adapters()
     adapter = adapters[0]
     print(f"Selected adapter: {adapter.identifier()} [{adapter.address()}]")
 
     adapter.set_callback_on_scan_start(lambda: print("Scan started."))
     adapter.set_callback_on_scan_stop(lambda: print("Scan complete."))
 
-    adapter.scan_for(5000)
-    peripherals = adapter.scan_get_results()
-    ecg_device = ""
-    for i, peripheral in enumerate(peripherals):
-        print(f"{i}: {peripheral.identifier()} [{peripheral.address()}]")
-        if peripheral.identifier() == "ECG Data":
-            print (f"Found ECG Data {peripheral.identifier()}")
-            ecg_device = peripheral
-    if ecg_device == "":
+    discovery = Discovery(adapter, on_found=lambda p: print(f"Found ECG Data {p.identifier()} [{p.address()}]"))
+    print(f"Known devices: {sorted(discovery.cache.addresses) or 'none'}")
+    ecg_device = discovery.connect()
+    if ecg_device is None:
         print("Could not find an ECG device.")
         exit()
 
-    print(f"Connecting to: {ecg_device.identifier()} [{ecg_device.address()}]")
-    ecg_device.connect()
+    print(f"Connected to: {ecg_device.identifier()} [{ecg_device.address()}]")
 
     service_uuid, characteristic_uuid = "0000180d-0000-1000-8000-00805f9b34fb", "e2fd985e-ceb8-4ccb-9cd3-52563e4b5c62" #this is stupid
 
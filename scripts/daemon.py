@@ -0,0 +1,550 @@
+"""
+Headless multi-patient monitor.
+
+Runs ingest, buffering, inference and recording for every source listed in a
+JSON config file, and for every stream forwarded by edge gateways (gateway.py),
+without importing matplotlib, Tk or Gradio. Status is served
+on localhost:
+
+    GET /status   -> JSON per session (connection, rate, drift, last prediction)
+    GET /metrics  -> Prometheus text (stage latencies, gaps, queue depths)
+    GET /episodes?patient=bed-1&class=V&hours=24 -> arrhythmia episodes (needs "events")
+
+With "shm" configured every session is also published to a shared-memory
+stream (shm_stream.py) that UI processes map read-only, e.g.
+`python gui.py --shm bed-1`.
+
+Usage:
+    python daemon.py daemon.example.json
+"""
+import argparse
+import importlib
+import json
+import os
+import re
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from ingest import INFERENCE_WINDOW_SIZE, Session, ble_link
+from ml.beat_cache import CachedPredictor, PredictionCache
+from ml.cascade import CascadeClassifier, ScreeningModel
+from ml.ensemble import FoldEnsemble
+from ml.events import EventStore
+from ml.hrv import HRVEngine
+from ml.metrics import METRICS
+from ml.pipeline import BEAT_MIN_DISTANCE_S, ModelSpec, Pipeline
+from ml.readers import open_record
+from ml.recordings import Recorder, parse_data_from_file
+from ml.runner import predictor
+from ml.scheduler import InferenceScheduler
+from ml.threads import ThreadBudget, configure_thread, load_budget
+from ml import threads
+from ml.timing import FRAME_SAMPLES, NOMINAL_DEVICE_HZ, TARGET_HZ
+
+# === Defaults ===
+DEFAULT_CONFIG = {
+    "api": {"host": "127.0.0.1", "port": 8765},
+    "recordings_dir": "recordings",
+    "filter": {},               # ml.filters.design_filter_bank kwargs, null disables filtering
+    "inference": {"trigger_samples": 40, "queue_size": 64, "ensemble": False,
+                  "cascade": None,    # {"screen_model": "ml/screen_model.npz", "threshold": 0.97}
+                  "cache": None,      # {"size": 64, "threshold": 0.99}, per-session morphology cache
+                  "models": [],       # extra models run on every window: ["package.module:factory", ...]
+                  "hrv": None,        # {"emit_period_s": 60}, rolling RR/HRV features per session
+                  "scheduling": {}},  # ml.scheduler.InferenceScheduler kwargs, e.g. {"deadline_s": 0.5}
+    "sources": [],
+    "events": None,             # {"path": "recordings/events.sqlite"}: keep every classification and episode
+    "gateway": None,            # {"listen": "tcp://0.0.0.0:8766"}: accept streams from edge boxes (gateway.py)
+    "shm": None,                # {"capacity_s": 120}: publish samples and predictions for viewers (shm_stream.py)
+    "threads": None,            # ml.threads.ThreadBudget overrides, e.g. {"workers": 2, "intra_op": 2, "pin": true};
+                                # by default the budget tuned for this host (python -m ml.threads autotune) or planned
+}
+BEAT_EDGE_S = 0.1               # peaks this close to the end of a window are left for the next one
+BEAT_AMPLITUDE_SMOOTHING = 0.05 # EWMA weight of a window's range in the R-wave amplitude estimate
+CLASSIFIER_INPUT = "classifier-input"   # pipeline inputs prepared for the worker's own models, never run
+BEATS_INPUT = "hrv-beats"
+RECORD_EXTENSIONS = (".hea", ".dat", ".edf", ".rec", ".raw", ".arxc")  # replayed with ml.readers
+HEARTBEAT_S = 1.0               # shm streams are marked alive this often, frames or not (shm_stream.STALE_AFTER_S)
+
+
+def load_config(path):
+    with open(path, "r") as f:
+        user_config = json.load(f)
+    config = json.loads(json.dumps(DEFAULT_CONFIG))
+    for key, value in user_config.items():
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+    names = [source["name"] for source in config["sources"]]
+    if len(names) != len(set(names)):
+        raise ValueError("Source names must be unique.")
+    inference = config["inference"]
+    if inference["ensemble"] and (inference["cascade"] or inference["cache"]):
+        # The fold ensemble has no screening model or per-session cache wrapper.
+        raise ValueError('"ensemble" cannot be combined with "cascade" or "cache"; set them to null.')
+    return config
+
+
+def build_predictor(ensemble=False, cascade=None):
+    # The fold ensemble also reports how much the folds disagree on each window.
+    model = FoldEnsemble.load() if ensemble else predictor(None)
+    if cascade and not ensemble:
+        # Confidently normal windows are answered by the screening model alone.
+        model = CascadeClassifier(model, ScreeningModel.load(cascade["screen_model"]),
+                                  threshold=cascade.get("threshold", 0.97))
+    return model
+
+
+class InferenceWorker():
+    """
+    Runs the classifier on windows queued by the sessions, earliest deadline first.
+    Under overload the scheduler sheds windows of sessions in normal rhythm first.
+
+    The thread budget (ml.threads) sets the number of worker threads, their torch
+    threads and core pinning. Every worker has its own predictor, since predictors
+    keep per-call state (last_probabilities); a session's windows are classified
+    one at a time so its state and cache stay consistent.
+    """
+
+    def __init__(self, queue_size, ensemble=False, cascade=None, cache=None, models=(), hrv=None, events=None,
+                 scheduling=None, budget=None):
+        self.budget = budget if budget is not None else ThreadBudget()
+        self.predictors = [build_predictor(ensemble, cascade) for _ in range(self.budget.workers)]
+        self.predictor = self.predictors[0]
+        self.cache_config = cache if cache and not ensemble else None
+        self.session_caches = {}        # session -> PredictionCache, shared by the workers' wrappers
+        self.session_models = {}        # (session, worker) -> CachedPredictor around that worker's model
+        # One preprocessing pass per window feeds the classifier, the HRV beat detection and any
+        # additional models (e.g. a risk model). The classifier gets the window cropped / resampled
+        # but unfiltered; its own normalization (per fold for the ensemble) stays in the model.
+        self.pipeline = Pipeline(input_hz=TARGET_HZ)
+        self.pipeline.register(ModelSpec(CLASSIFIER_INPUT, None,
+                                         seq_length=getattr(self.predictor, "full", self.predictor).seq_length))
+        # Beats found in each window feed per-session RR/HRV statistics, labelled by the classifier.
+        # They are detected in the session's continuously filtered stream: a zero-phase filter run
+        # on each short window alone would put edge transients right where new beats appear.
+        self.hrv = HRVEngine(**hrv) if hrv else None
+        if self.hrv is not None:
+            self.pipeline.register(ModelSpec(BEATS_INPUT, None, seq_length=INFERENCE_WINDOW_SIZE,
+                                             sample_rate_hz=TARGET_HZ, beats=True))
+        for reference in models:
+            self.pipeline.register(load_model_spec(reference))
+        self.extra_models = bool(models)
+        self.last_beat_index = {}
+        self.beat_amplitude = {}
+        self.events = EventStore(**events) if events else None
+        self.codes = {meaning: code for code, meaning in self.predictor.meanings.items()}
+        self.scheduler = InferenceScheduler(queue_size=queue_size, workers=self.budget.workers, **(scheduling or {}))
+        self.dropped = 0
+        self._session_locks = {}
+        self._locks_lock = threading.Lock()
+        self._hrv_lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, args=(i,), daemon=True, name=f"inference-{i}")
+                         for i in range(self.budget.workers)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def model_for(self, session, worker=0):
+        """The worker's model, or the session's cache in front of it."""
+        if self.cache_config is None:
+            return self.predictors[worker]
+        model = self.session_models.get((session.name, worker))
+        if model is None:
+            # Misses run on this worker's own model; a session's windows are classified one at a
+            # time (_session_lock), so its cache is never used by two workers at once.
+            cache = self.session_caches.get(session.name)
+            if cache is None:
+                cache = self.session_caches[session.name] = PredictionCache(**self.cache_config)
+            model = CachedPredictor(self.predictors[worker], cache, session=session.name)
+            self.session_models[(session.name, worker)] = model
+        return model
+
+    def cascade_stats(self):
+        """Screening statistics summed over the workers' cascades, or None without a cascade."""
+        cascades = [model for model in self.predictors if isinstance(model, CascadeClassifier)]
+        if not cascades:
+            return None
+        windows = sum(model.windows for model in cascades)
+        escalated = sum(model.escalated for model in cascades)
+        return {"windows": windows, "escalated": escalated, "escalation_rate": escalated / windows if windows else 0.0,
+                "threshold": cascades[0].threshold}
+
+    def _session_lock(self, name):
+        lock = self._session_locks.get(name)
+        if lock is None:
+            with self._locks_lock:
+                lock = self._session_locks.setdefault(name, threading.Lock())
+        return lock
+
+    def submit(self, session, window, filtered):
+        recorded = session.recorder.samples_written if session.recorder is not None else None
+        if not self.scheduler.submit(session.name, (session, window, filtered, session.samples_out, recorded),
+                                     recovered_at=session.quality_recovered_at):
+            self.dropped += 1
+
+    def signal_lost(self, session):
+        """
+        Leads off, disconnect or end of a replay: the patient's open episode ends here, and
+        RR intervals start over (the stream's sample index does not count the gap). The
+        R-wave amplitude estimate is kept; re-learning it from the first windows after the
+        gap lets P and T waves through as beats.
+        """
+        if self.events is not None:
+            self.events.end_episode(session.name)
+        if self.hrv is not None:
+            with self._hrv_lock:
+                self.hrv.reset(session.name)
+                self.last_beat_index.pop(session.name, None)
+
+    def stop(self):
+        self.scheduler.close()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self.pipeline.close()
+        if self.events is not None:
+            self.events.close()
+
+    def _run(self, worker):
+        configure_thread(self.budget, worker)
+        while True:
+            job = self.scheduler.next()
+            if job is None:
+                return
+            session, window, filtered, end_index, recorded = job.payload
+            started = time.monotonic()
+            with self._session_lock(session.name):
+                self._classify(session, window, filtered, end_index, recorded, worker)
+            self.scheduler.complete(job, self.codes.get(session.last_prediction), started)
+
+    def _classify(self, session, window, filtered, end_index, recorded, worker):
+        model = self.model_for(session, worker)
+        prepared = None
+        try:
+            with METRICS.time("preprocess"):
+                prepared = self.pipeline.prepare(window, prefiltered=filtered,
+                                                 beat_prominence=lambda signal: self._beat_prominence(session, signal))
+            session.last_prediction = model.get_prediction(prepared[CLASSIFIER_INPUT].signal)
+            session.last_disagreement = getattr(self.predictors[worker], "last_disagreement", None)
+        except Exception as e:
+            session.last_prediction = f"Error: {e}"
+        if session.publisher is not None:
+            session.publisher.publish_prediction(self.codes.get(session.last_prediction),
+                                                 getattr(model, "last_probabilities", None), sample_index=end_index)
+        if self.events is not None and session.connected and not session.leads_off:
+            # A window still queued when the signal was lost must not reopen the closed episode.
+            self._record_event(session, window, recorded, model)
+        if self.hrv is not None and prepared is not None and session.connected and not session.leads_off:
+            with self._hrv_lock:                # the engine's arrays are shared by all sessions
+                self._track_beats(session, prepared[BEATS_INPUT].beats[0], end_index - len(window), end_index)
+        if self.extra_models and prepared is not None:
+            results = self.pipeline.run(window, prepared=prepared)
+            session.model_results = {name: f"Error: {result}" if isinstance(result, Exception)
+                                     else np.asarray(result).tolist() for name, result in results.items()}
+        session.last_prediction_time = time.time()
+
+    def _record_event(self, session, window, recorded, model):
+        """Stores the window's class with its sample range in the session's recording (device samples)."""
+        code = self.codes.get(session.last_prediction)
+        if code is None:
+            return
+        probabilities = getattr(model, "last_probabilities", None)
+        probability = float(max(probabilities)) if probabilities is not None else None
+        recording = start_offset = None
+        if recorded is not None:
+            recording = session.recorder.path
+            start_offset = max(0, recorded - int(round(len(window) * session.timing.clock.sample_rate_hz / TARGET_HZ)))
+        self.events.record(session.name, time.time(), code, probability, recording, start_offset, recorded)
+
+    def _beat_prominence(self, session, filtered):
+        """
+        R-peak prominence for the session's next (filtered) window. Short windows often hold
+        no beat at all, so the threshold follows a running amplitude rather than the window's range.
+        """
+        amplitude = self.beat_amplitude.get(session.name, np.ptp(filtered))
+        amplitude += BEAT_AMPLITUDE_SMOOTHING * (np.ptp(filtered) - amplitude)
+        self.beat_amplitude[session.name] = amplitude
+        return 0.5 * amplitude
+
+    def _track_beats(self, session, peaks, start_index, end_index):
+        """Adds the beats of a window (R-peak indices) not seen in the previous (overlapping) windows."""
+        label = self.codes.get(session.last_prediction)
+        last = self.last_beat_index.get(session.name, -np.inf)
+        for peak in peaks:
+            index = start_index + int(peak)
+            if index > end_index - BEAT_EDGE_S * TARGET_HZ or index < last + BEAT_MIN_DISTANCE_S * TARGET_HZ:
+                continue
+            self.hrv.add_beat(session.name, index / TARGET_HZ, label)
+            last = index
+        self.last_beat_index[session.name] = last
+        names, _ = self.hrv.emit_due(end_index / TARGET_HZ, [session.name])
+        if names:
+            session.hrv = self.hrv.as_dict(session.name)
+
+
+def load_model_spec(reference):
+    """Imports "package.module:factory" and calls factory() for an ml.pipeline.ModelSpec."""
+    module_name, _, attribute = reference.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+def _is_record(path):
+    return path.lower().endswith(RECORD_EXTENSIONS)
+
+
+def _replay_frames(spec):
+    """20-sample frames of the replayed file; record formats are decoded a chunk at a time."""
+    if _is_record(spec["path"]):
+        record = open_record(spec["path"])
+        for block in record.iter_blocks(spec.get("channel", 0)):
+            if block.size == FRAME_SAMPLES:
+                yield block.astype(np.float64)
+        return
+    data = np.asarray(parse_data_from_file(spec["path"]), dtype=np.float64)
+    for start in range(0, data.size - FRAME_SAMPLES + 1, FRAME_SAMPLES):
+        yield data[start:start + FRAME_SAMPLES]
+
+
+def replay_source(session, spec, stop_event):
+    """Feeds a recorded file into a session at its real rate, in 20-sample frames like the device."""
+    rate_hz = spec.get("rate_hz", NOMINAL_DEVICE_HZ)
+    session.connected = True
+    frame_period = FRAME_SAMPLES / rate_hz
+    next_due = time.monotonic()
+    while not stop_event.is_set():
+        replayed = 0
+        for frame in _replay_frames(spec):
+            if stop_event.is_set():
+                break
+            next_due += frame_period
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            session.on_frame(frame)
+            replayed += 1
+        if not replayed:
+            print(f"[{session.name}] nothing to replay in {spec['path']}")
+            break
+        if not spec.get("loop", True):
+            break
+    session.connected = False
+
+
+class Daemon():
+    def __init__(self, config):
+        self.config = config
+        self.stop_event = threading.Event()
+        self.sessions = {}
+        self.threads = []
+        self.started = None
+        self.worker = None
+        self.server = None
+        self.gateway = None
+        self._sessions_lock = threading.Lock()
+
+    def start(self):
+        self.started = time.time()
+        inference = self.config["inference"]
+        # Gateway streams are not known up front; the configured sources size the budget.
+        budget = load_budget(streams=max(1, len(self.config["sources"])), overrides=self.config["threads"])
+        threads.apply(budget)
+        print(f"Inference threads: {budget}")
+        self.worker = InferenceWorker(inference["queue_size"], inference["ensemble"], inference["cascade"],
+                                      inference["cache"], inference["models"], inference["hrv"], self.config["events"],
+                                      inference["scheduling"], budget)
+        self.worker.start()
+
+        ble_specs = []
+        for spec in self.config["sources"]:
+            if spec["type"] not in ("ble", "replay"):
+                raise ValueError(f"Unknown source type {spec['type']!r} for {spec['name']}.")
+            session = self._add_session(spec)
+            if spec["type"] == "ble":
+                ble_specs.append(spec)
+            else:
+                self._spawn(replay_source, session, spec, self.stop_event)
+        if ble_specs:
+            self._connect_ble(ble_specs)
+        if self.config.get("shm"):
+            self._spawn(self._heartbeat)
+        if self.config.get("gateway"):
+            from gateway import GatewayServer
+            self.gateway = GatewayServer(self.config["gateway"]["listen"], self._on_gateway_frame,
+                                         self._on_gateway_disconnect).start()
+            print(f"Gateway listening on {self.gateway.bound_address}")
+        self._serve_api()
+
+    def _add_session(self, spec):
+        if spec["type"] == "replay" and "rate_hz" not in spec and _is_record(spec["path"]):
+            spec["rate_hz"] = open_record(spec["path"]).sample_rate(spec.get("channel", 0))
+        recorder = None
+        if self.config.get("recordings_dir"):
+            directory = re.sub(r"[^A-Za-z0-9._-]", "_", spec["name"])    # gateway streams are "edge/AA:BB:..."
+            path = os.path.join(self.config["recordings_dir"], directory, time.strftime("%Y%m%d-%H%M%S") + ".raw")
+            recorder = Recorder(path, dtype=spec.get("dtype", "<f4" if spec["type"] == "replay" else "<u2"),
+                                sample_rate_hz=spec.get("rate_hz", NOMINAL_DEVICE_HZ), source=spec)
+        publisher = None
+        if self.config.get("shm"):
+            from shm_stream import StreamWriter
+            publisher = StreamWriter(spec["name"], classes=self.worker.predictor.classes, **self.config["shm"])
+        session = Session(
+            spec["name"],
+            nominal_hz=spec.get("rate_hz", NOMINAL_DEVICE_HZ),
+            recorder=recorder,
+            filter_config=self.config["filter"],
+            trigger_samples=self.config["inference"]["trigger_samples"],
+            on_window=self.worker.submit,
+            on_signal_lost=self.worker.signal_lost,
+            publisher=publisher,
+        )
+        self.sessions[spec["name"]] = session
+        return session
+
+    def _on_gateway_frame(self, stream, samples, arrival, leads_off):
+        """Frames from edge boxes; a session is created the first time a stream appears."""
+        session = self.sessions.get(stream)
+        if session is None:
+            with self._sessions_lock:
+                # Frames of legacy ASCII firmware arrive as float32 (FLAG_FLOAT), the rest as ADC counts.
+                session = self.sessions.get(stream) or self._add_session(
+                    {"name": stream, "type": "gateway", "dtype": "<f4" if samples.dtype.kind == "f" else "<u2"})
+        session.connected = True
+        session.on_frame(samples, arrival, leads_off=leads_off)
+
+    def _on_gateway_disconnect(self, stream):
+        """The edge lost the device, or the edge itself went away."""
+        session = self.sessions.get(stream)
+        if session is not None:
+            session.connected = False
+
+    def _heartbeat(self):
+        """
+        Keeps every shm stream's `updated` time current, so a viewer of a disconnected
+        device sees a live daemon waiting for it rather than a dead ingest process.
+        """
+        while not self.stop_event.wait(HEARTBEAT_S):
+            for session in list(self.sessions.values()):
+                if session.publisher is not None:
+                    session.publisher.set_status()
+
+    def _spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _connect_ble(self, specs):
+        from discovery import Discovery
+        discovery = Discovery()
+        pinned = {spec["address"]: spec for spec in specs if spec.get("address")}
+        unpinned = [spec for spec in specs if not spec.get("address")]
+        found = {}
+        if pinned:
+            found.update({p.address(): p for p in discovery.find(count=len(pinned), addresses=set(pinned))})
+        if unpinned:
+            for p in discovery.find(count=len(pinned) + len(unpinned)):
+                found.setdefault(p.address(), p)
+        free = [address for address in found if address not in pinned]
+        for spec in specs:
+            address = spec.get("address") or (free.pop(0) if free else None)
+            peripheral = found.get(address)
+            if peripheral is None:
+                print(f"[{spec['name']}] device not found")
+                continue
+            try:
+                peripheral.connect()
+            except Exception as e:
+                print(f"[{spec['name']}] connect failed: {e}")
+                continue
+            discovery.cache.remember(peripheral)
+            self._spawn(ble_link, self.sessions[spec["name"]], discovery, peripheral, self.stop_event)
+
+    def status(self):
+        return {
+            "uptime_s": time.time() - self.started,
+            "inference_queue": len(self.worker.scheduler),
+            "inference_dropped": self.worker.dropped,
+            "scheduler": self.worker.scheduler.snapshot(),
+            "threads": self.worker.budget.to_dict(),
+            "cascade": self.worker.cascade_stats(),
+            "prediction_cache": {name: cache.stats() for name, cache in self.worker.session_caches.items()},
+            "gateway": {"last_sequence": self.gateway.last_sequence, "gaps": self.gateway.gaps} if self.gateway else None,
+            "sessions": {name: session.status() for name, session in list(self.sessions.items())},
+        }
+
+    def _serve_api(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                path = url.path.rstrip("/")
+                if path == "/status":
+                    body = json.dumps(daemon.status(), default=float).encode("utf-8")
+                    content_type = "application/json"
+                elif path == "/episodes" and daemon.worker.events is not None:
+                    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                    since = time.time() - float(query.get("hours", 24)) * 3600
+                    episodes = daemon.worker.events.episodes(query.get("patient"), query.get("class"), since)
+                    body = json.dumps(episodes).encode("utf-8")
+                    content_type = "application/json"
+                elif path == "/metrics":
+                    body = METRICS.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        api = self.config["api"]
+        self.server = ThreadingHTTPServer((api["host"], api["port"]), Handler)
+        self.server.daemon_threads = True
+        self._spawn(self.server.serve_forever)
+        print(f"Status API on http://{api['host']}:{self.server.server_port}/status")
+
+    def stop(self):
+        self.stop_event.set()
+        if self.gateway is not None:
+            self.gateway.stop()
+        if self.server is not None:
+            self.server.shutdown()
+        for thread in self.threads:
+            thread.join(timeout=2)
+        self.worker.stop()
+        for session in self.sessions.values():
+            if session.recorder is not None:
+                session.recorder.close()
+            if session.publisher is not None:
+                session.publisher.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless ArrythmiX monitoring daemon.")
+    parser.add_argument("config", help="JSON config file (see daemon.example.json).")
+    args = parser.parse_args()
+
+    daemon = Daemon(load_config(args.config))
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    daemon.start()
+    stop.wait()
+    print("Stopping...")
+    daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
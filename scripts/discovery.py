@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+import time
+
+# === Configuration ===
+SERVICE_UUID = "0000180d-0000-1000-8000-00805f9b34fb"
+CHARACTERISTIC_UUID = "e2fd985e-ceb8-4ccb-9cd3-52563e4b5c62"
+FIRMWARE_SERVICE_UUID = "12345678-1234-5678-1234-56789abcdef0"  # ECG_SERVICE_UUID_VAL in src/main.c
+# Only the firmware's own service identifies our device: 0x180D (SERVICE_UUID, the standard Heart
+# Rate Service) is advertised by any chest strap or watch nearby.
+TARGET_SERVICE_UUIDS = (FIRMWARE_SERVICE_UUID,)
+DEVICE_IDENTIFIER = "ECG Data"
+SCAN_TIMEOUT = 5.0          # seconds; upper bound, the scan stops at the first match
+RECONNECT_ATTEMPTS = 3
+RECONNECT_BACKOFF = 0.5     # seconds, doubled after every failed attempt
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".arrythmix", "known_devices.json")
+
+
+class DeviceCache():
+    """Persistent set of ECG device addresses we have connected to before."""
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.devices = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r") as f:
+                self.devices = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.devices = {}
+
+    @property
+    def addresses(self):
+        return set(self.devices)
+
+    def remember(self, peripheral):
+        with self._lock:
+            self.devices[peripheral.address()] = {
+                "identifier": peripheral.identifier(),
+                "last_connected": time.time(),
+            }
+            self._save()
+
+    def forget(self, address):
+        with self._lock:
+            if self.devices.pop(address, None) is not None:
+                self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.devices, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def default_adapter():
+    import ble_backend
+    adapters = ble_backend.get_adapters()
+    if not adapters:
+        return None
+    return adapters[0]
+
+
+def _advertised_services(peripheral):
+    try:
+        return {service.uuid().lower() for service in peripheral.services()}
+    except Exception:
+        return set()
+
+
+class Discovery():
+    """
+    Finds ECG devices without waiting out a fixed scan window.
+
+    The scan runs in the background and stops as soon as enough peripherals
+    match: a previously connected address, the firmware's ECG service UUID or,
+    for older firmware, the "ECG Data" name. Known addresses live in a small
+    JSON cache so a restart finds the device on its first advertisement.
+    """
+
+    def __init__(self, adapter=None, service_uuids=TARGET_SERVICE_UUIDS, identifier=DEVICE_IDENTIFIER,
+                 cache=None, on_found=None):
+        self.adapter = adapter if adapter is not None else default_adapter()
+        self.service_uuids = {uuid.lower() for uuid in service_uuids}
+        self.identifier = identifier
+        self.cache = cache if cache is not None else DeviceCache()
+        self.on_found = on_found
+
+    def matches(self, peripheral, addresses=None):
+        known = self.cache.addresses if addresses is None else set(addresses)
+        if peripheral.address() in known:
+            return True
+        if self.service_uuids & _advertised_services(peripheral):
+            return True
+        return self.identifier is not None and peripheral.identifier() == self.identifier
+
+    def find(self, count=1, timeout=SCAN_TIMEOUT, addresses=None):
+        """
+        Scans until `count` matching peripherals are seen or `timeout` seconds pass.
+
+        Args:
+            count (int): Stop after this many distinct matches.
+            timeout (float): Upper bound on the scan time in seconds.
+            addresses (iterable[str] | None): Only accept these addresses (defaults to cache + UUID/name match).
+
+        Returns:
+            list: Matching peripherals, known addresses first.
+        """
+        if self.adapter is None:
+            return []
+        found = {}
+        done = threading.Event()
+        lock = threading.Lock()
+
+        def scan_found(peripheral):
+            if addresses is not None and peripheral.address() not in addresses:
+                return
+            if not self.matches(peripheral, addresses):
+                return
+            with lock:
+                found.setdefault(peripheral.address(), peripheral)
+                if len(found) >= count:
+                    done.set()
+            if self.on_found is not None:
+                self.on_found(peripheral)
+
+        self.adapter.set_callback_on_scan_found(scan_found)
+        self.adapter.scan_start()
+        try:
+            done.wait(timeout)
+        finally:
+            self.adapter.scan_stop()
+            self.adapter.set_callback_on_scan_found(lambda peripheral: None)
+
+        known = self.cache.addresses
+        return sorted(found.values(), key=lambda p: p.address() not in known)[:count]
+
+    def connect(self, timeout=SCAN_TIMEOUT):
+        """Finds and connects to the first ECG device. Returns the peripheral or None."""
+        for peripheral in self.find(count=1, timeout=timeout):
+            try:
+                peripheral.connect()
+            except Exception:
+                continue
+            self.cache.remember(peripheral)
+            return peripheral
+        return None
+
+    def reconnect(self, peripheral, attempts=RECONNECT_ATTEMPTS, timeout=SCAN_TIMEOUT):
+        """
+        Recovers a dropped link. The peripheral object is reused directly first, which
+        skips scanning entirely; only if that fails is its address scanned for again.
+        """
+        delay = RECONNECT_BACKOFF
+        for attempt in range(attempts):
+            try:
+                peripheral.connect()
+                self.cache.remember(peripheral)
+                return peripheral
+            except Exception:
+                pass
+            for candidate in self.find(count=1, timeout=timeout, addresses={peripheral.address()}):
+                try:
+                    candidate.connect()
+                    self.cache.remember(candidate)
+                    return candidate
+                except Exception:
+                    pass
+            time.sleep(delay)
+            delay *= 2
+        return None
@@ -0,0 +1,482 @@
+"""
+Edge-to-server ingest gateway.
+
+An edge box near the beds decodes the BLE notifications of all its devices and
+forwards them to one inference server over a persistent TCP or Unix socket.
+Frames are batched into messages:
+
+    magic "AG" | type (u8) | sequence (u64) | payload length (u32) | payload
+
+    HELLO   edge -> server   payload: "<edge id>\n<boot id>" (utf-8)
+    RESUME  server -> edge   sequence: last batch the server has for this edge run
+    BATCH   edge -> server   payload: records (see _pack_records)
+    ACK     server -> edge   sequence: last batch received in order
+
+A device that loses its BLE link is announced by a record with FLAG_DISCONNECTED
+(and no samples); an edge whose socket closes counts as all of its devices
+disconnecting. Batches wait in a bounded spool on the edge until acknowledged.
+After a reconnect the server says where it stopped and the edge resends from there;
+if the spool overflowed during a long outage the oldest batches are lost and
+the server counts the gap. The boot id changes whenever the edge process
+restarts (and its sequence numbers start over), which resets the server's
+position for that edge.
+
+Usage:
+    python gateway.py edge --server tcp://10.0.0.5:8766 --count 4
+    python gateway.py loopback        # in-process edge + server test
+The server side runs inside the daemon ("gateway": {"listen": "tcp://0.0.0.0:8766"}).
+"""
+import argparse
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+
+import numpy as np
+
+from ml.metrics import METRICS
+
+# === Configuration ===
+MAGIC = b"AG"
+HELLO, RESUME, BATCH, ACK = 1, 2, 3, 4
+_HEADER = struct.Struct("<2sBQI")
+_RECORD = struct.Struct("<BdBH")        # name length, arrival, flags, sample count
+FLAG_LEADS_OFF = 1
+FLAG_FLOAT = 2                          # samples are float32 (legacy ASCII firmware) instead of uint16
+FLAG_DISCONNECTED = 4                   # the edge lost the device's BLE link
+BATCH_INTERVAL = 0.05                   # seconds; frames are flushed at least this often
+BATCH_MAX_RECORDS = 256
+SPOOL_BATCHES = 12000                   # ~10 min of batches at BATCH_INTERVAL
+RECONNECT_BACKOFF = 0.5                 # seconds, doubled up to RECONNECT_BACKOFF_MAX
+RECONNECT_BACKOFF_MAX = 10.0
+MAX_PAYLOAD = 16 * 1024 * 1024
+
+
+class GatewayError(ConnectionError):
+    """Raised for malformed gateway messages."""
+
+
+def parse_address(address):
+    """"tcp://host:port" or "unix:///path" -> (socket family, address)."""
+    if address.startswith("unix://"):
+        return socket.AF_UNIX, address[len("unix://"):]
+    if address.startswith("tcp://"):
+        host, _, port = address[len("tcp://"):].rpartition(":")
+        return socket.AF_INET, (host or "0.0.0.0", int(port))
+    raise ValueError(f"Unsupported gateway address {address!r}; use tcp://host:port or unix:///path.")
+
+
+def _send(sock, kind, sequence=0, payload=b""):
+    sock.sendall(_HEADER.pack(MAGIC, kind, sequence, len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    chunks = bytearray()
+    while len(chunks) < size:
+        chunk = sock.recv(size - len(chunks))
+        if not chunk:
+            raise ConnectionError("Gateway peer closed the connection.")
+        chunks += chunk
+    return bytes(chunks)
+
+
+def _recv(sock):
+    magic, kind, sequence, length = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    if magic != MAGIC or length > MAX_PAYLOAD:
+        raise GatewayError("Malformed gateway message.")
+    return kind, sequence, _recv_exact(sock, length) if length else b""
+
+
+def _pack_records(records):
+    parts = [struct.pack("<H", len(records))]
+    for name, samples, arrival, leads_off, disconnected in records:
+        encoded = name.encode("utf-8")
+        is_float = samples.dtype.kind == "f"
+        data = samples.astype("<f4" if is_float else "<u2").tobytes()
+        flags = ((FLAG_LEADS_OFF if leads_off else 0) | (FLAG_FLOAT if is_float else 0)
+                 | (FLAG_DISCONNECTED if disconnected else 0))
+        parts.append(_RECORD.pack(len(encoded), arrival, flags, samples.size) + encoded + data)
+    return b"".join(parts)
+
+
+def _unpack_records(payload):
+    (count,), offset = struct.unpack_from("<H", payload), 2
+    records = []
+    for _ in range(count):
+        name_length, arrival, flags, n = _RECORD.unpack_from(payload, offset)
+        offset += _RECORD.size
+        name = payload[offset:offset + name_length].decode("utf-8")
+        offset += name_length
+        dtype = np.dtype("<f4" if flags & FLAG_FLOAT else "<u2")
+        samples = np.frombuffer(payload, dtype=dtype, count=n, offset=offset) if n else None
+        offset += n * dtype.itemsize
+        records.append((name, samples, arrival, bool(flags & FLAG_LEADS_OFF), bool(flags & FLAG_DISCONNECTED)))
+    return records
+
+
+class GatewayClient():
+    """
+    Edge side: batches frames, spools them and keeps them flowing to the server.
+
+    submit() never blocks on the network; if the server is unreachable for longer
+    than the spool holds, the oldest batches are dropped (counted in `spool_dropped`).
+    """
+
+    def __init__(self, address, edge_id=None, spool_batches=SPOOL_BATCHES, batch_interval=BATCH_INTERVAL):
+        self.address = address
+        self.edge_id = edge_id or socket.gethostname()
+        self.boot_id = uuid.uuid4().hex
+        self.batch_interval = batch_interval
+        self.spool = deque(maxlen=spool_batches)        # (sequence, payload), oldest first
+        self.spool_dropped = 0
+        self.sequence = 0
+        self.connected = False
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._sock = None
+        self._threads = [threading.Thread(target=self._flush_loop, daemon=True),
+                         threading.Thread(target=self._connection_loop, daemon=True)]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def submit(self, name, samples, arrival=None, leads_off=False, disconnected=False):
+        arrival = time.monotonic() if arrival is None else arrival
+        with self._lock:
+            self._pending.append((name, np.asarray(samples), arrival, leads_off, disconnected))
+            full = len(self._pending) >= BATCH_MAX_RECORDS
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Turns pending frames into one spooled batch and wakes the sender."""
+        with self._lock:
+            if not self._pending:
+                return
+            records, self._pending = self._pending, []
+            self.sequence += 1
+            if len(self.spool) == self.spool.maxlen:
+                self.spool_dropped += 1
+            self.spool.append((self.sequence, _pack_records(records)))
+        METRICS.set_queue_depth(f"gateway_spool:{self.edge_id}", len(self.spool))
+        self._wakeup.set()
+
+    def stop(self, drain_timeout=2.0):
+        """Flushes, waits up to drain_timeout for the spool to be acknowledged, then disconnects."""
+        self.flush()
+        deadline = time.monotonic() + drain_timeout
+        while self.spool and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self._stop.set()
+        self._wakeup.set()
+        self._close()
+        for thread in self._threads:
+            thread.join(timeout=2)
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.batch_interval):
+            self.flush()
+
+    def _close(self):
+        sock, self._sock = self._sock, None
+        self.connected = False
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)     # wakes the ack reader; close() alone leaves it blocked
+            except OSError:
+                pass
+            sock.close()
+
+    def _acknowledge(self, sequence):
+        with self._lock:
+            while self.spool and self.spool[0][0] <= sequence:
+                self.spool.popleft()
+
+    def _connection_loop(self):
+        backoff = RECONNECT_BACKOFF
+        while not self._stop.is_set():
+            family, address = parse_address(self.address)
+            try:
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.connect(address)
+                if family == socket.AF_INET:
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                _send(sock, HELLO, payload=f"{self.edge_id}\n{self.boot_id}".encode("utf-8"))
+                kind, resume_from, _ = _recv(sock)
+                if kind != RESUME:
+                    raise GatewayError("Expected RESUME after HELLO.")
+            except OSError as e:
+                print(f"[gateway] cannot reach {self.address}: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, RECONNECT_BACKOFF_MAX)
+                continue
+            self._sock = sock
+            self.connected = True
+            backoff = RECONNECT_BACKOFF
+            self._acknowledge(resume_from)
+            reader = threading.Thread(target=self._read_acks, args=(sock,), daemon=True)
+            reader.start()
+            try:
+                self._send_loop(sock, resume_from)
+            except OSError as e:
+                if not self._stop.is_set():
+                    print(f"[gateway] connection lost: {e}")
+            self._close()
+            reader.join(timeout=2)
+
+    def _send_loop(self, sock, sent_up_to):
+        while not self._stop.is_set() and self._sock is sock:
+            with self._lock:
+                unsent = [(seq, payload) for seq, payload in self.spool if seq > sent_up_to]
+            for sequence, payload in unsent:
+                _send(sock, BATCH, sequence, payload)
+                sent_up_to = sequence
+            self._wakeup.wait(self.batch_interval)
+            self._wakeup.clear()
+
+    def _read_acks(self, sock):
+        try:
+            while self._sock is sock:
+                kind, sequence, _ = _recv(sock)
+                if kind == ACK:
+                    self._acknowledge(sequence)
+                    METRICS.set_queue_depth(f"gateway_spool:{self.edge_id}", len(self.spool))
+        except OSError:
+            if self._sock is sock:
+                self._close()
+
+
+class GatewayServer():
+    """
+    Server side: accepts edge connections and hands every frame to
+    on_frame(stream, samples, arrival, leads_off), where stream is "<edge id>/<device name>"
+    and samples is None for a bare leads-off notice. Arrival times are on the edge's clock.
+    on_disconnect(stream) is called when the edge reports the device gone, and for every
+    stream of an edge whose connection drops. The last sequence per edge survives
+    reconnects so resent batches are delivered once.
+    """
+
+    def __init__(self, address, on_frame, on_disconnect=None):
+        self.address = address
+        self.on_frame = on_frame
+        self.on_disconnect = on_disconnect
+        self.streams = {}               # edge id -> streams it has sent
+        self.last_sequence = {}
+        self.boot_ids = {}
+        self.gaps = {}
+        self._stop = threading.Event()
+        family, bind_address = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(bind_address):
+            os.unlink(bind_address)
+        self._listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            self._listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._listener.bind(bind_address)
+        self._listener.listen()
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    @property
+    def bound_address(self):
+        """The listening address with the actual port (useful with tcp://127.0.0.1:0)."""
+        name = self._listener.getsockname()
+        if isinstance(name, tuple):
+            return f"tcp://{name[0]}:{name[1]}"
+        return f"unix://{name}"
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._listener.close()
+        with self._lock:
+            for sock in list(self._connections):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                sock, _ = self._listener.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._connections.add(sock)
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        edge_id = None
+        try:
+            kind, _, payload = _recv(sock)
+            if kind != HELLO:
+                raise GatewayError("Expected HELLO.")
+            edge_id, _, boot_id = payload.decode("utf-8").partition("\n")
+            if self.boot_ids.get(edge_id) != boot_id:
+                # A restarted edge numbers its batches from 1 again.
+                self.boot_ids[edge_id] = boot_id
+                self.last_sequence[edge_id] = 0
+            _send(sock, RESUME, self.last_sequence.get(edge_id, 0))
+            while not self._stop.is_set():
+                kind, sequence, payload = _recv(sock)
+                if kind != BATCH:
+                    continue
+                last = self.last_sequence.get(edge_id, 0)
+                if sequence > last:
+                    if sequence > last + 1 and last:
+                        self.gaps[edge_id] = self.gaps.get(edge_id, 0) + sequence - last - 1
+                        METRICS.record_gap(f"gateway:{edge_id}")
+                    with METRICS.time("decode"):
+                        records = _unpack_records(payload)
+                    streams = self.streams.setdefault(edge_id, set())
+                    for name, samples, arrival, leads_off, disconnected in records:
+                        stream = f"{edge_id}/{name}"
+                        if disconnected:
+                            streams.discard(stream)
+                            if self.on_disconnect is not None:
+                                self.on_disconnect(stream)
+                            continue
+                        streams.add(stream)
+                        self.on_frame(stream, samples, arrival, leads_off)
+                    self.last_sequence[edge_id] = sequence
+                _send(sock, ACK, self.last_sequence.get(edge_id, 0))
+        except (OSError, GatewayError, struct.error) as e:
+            if not self._stop.is_set():
+                print(f"[gateway] edge {edge_id or '?'} disconnected: {e}")
+        finally:
+            with self._lock:
+                self._connections.discard(sock)
+            sock.close()
+            if edge_id is not None and self.on_disconnect is not None and not self._stop.is_set():
+                for stream in self.streams.pop(edge_id, ()):
+                    self.on_disconnect(stream)
+
+
+class EdgeStream():
+    """Stands in for an ingest Session on the edge: decodes notifications and forwards them."""
+
+    def __init__(self, name, client):
+        self.name = name
+        self.client = client
+        self._connected = False
+        self.dtype = np.dtype("<u2")    # of the device's last samples; empty leads-off frames keep its float flag
+
+    @property
+    def connected(self):
+        return self._connected
+
+    @connected.setter
+    def connected(self, value):
+        if self._connected and not value:
+            self.client.submit(self.name, np.zeros(0, dtype=self.dtype), disconnected=True)
+        self._connected = value
+
+    def on_notification(self, payload):
+        from ingest import decode_notification
+        arrival = time.monotonic()
+        samples, leads_off = decode_notification(payload)
+        if samples is None and not leads_off:
+            return
+        if samples is None:
+            samples = np.zeros(0, dtype=self.dtype)
+        self.dtype = samples.dtype
+        self.client.submit(self.name, samples, arrival, leads_off)
+
+
+def run_edge(server, count, edge_id=None):
+    """Connects to up to `count` ECG devices and forwards them to `server` until interrupted."""
+    from discovery import Discovery
+    from ingest import ble_link
+
+    client = GatewayClient(server, edge_id).start()
+    discovery = Discovery()
+    stop_event = threading.Event()
+    threads = []
+    for peripheral in discovery.find(count=count):
+        try:
+            peripheral.connect()
+        except Exception as e:
+            print(f"[{peripheral.address()}] connect failed: {e}")
+            continue
+        discovery.cache.remember(peripheral)
+        stream = EdgeStream(peripheral.address(), client)
+        thread = threading.Thread(target=ble_link, args=(stream, discovery, peripheral, stop_event), daemon=True)
+        thread.start()
+        threads.append(thread)
+    if not threads:
+        print("No ECG devices found.")
+        client.stop(drain_timeout=0)
+        return
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=2)
+    client.stop()
+
+
+def run_loopback(seconds=3.0, streams=3):
+    """
+    In-process edge and server over a Unix socket (TCP where unavailable). The connection is
+    cut halfway through; every frame must still arrive exactly once and in order.
+    """
+    received = {}
+
+    def on_frame(stream, samples, arrival, leads_off):
+        received.setdefault(stream, []).append(int(samples[0]))
+
+    if hasattr(socket, "AF_UNIX"):
+        address = "unix://" + os.path.join(tempfile.mkdtemp(), "gateway.sock")
+    else:
+        address = "tcp://127.0.0.1:0"
+    server = GatewayServer(address, on_frame).start()
+    client = GatewayClient(server.bound_address, "loopback").start()
+    frame_period = 20 / 414.0
+    n_frames = int(seconds / frame_period)
+    for i in range(n_frames):
+        for s in range(streams):
+            client.submit(f"ecg-{s}", np.full(20, i, dtype="<u2"))
+        if i == n_frames // 2:
+            client._close()     # simulate a dropped link; batches stay spooled and are resent
+        time.sleep(frame_period)
+    client.stop(drain_timeout=5)
+    server.stop()
+    ok = all(received.get(f"loopback/ecg-{s}") == list(range(n_frames)) for s in range(streams))
+    print(f"{streams} streams x {n_frames} frames, batches={client.sequence}, "
+          f"gaps={server.gaps}, delivered exactly once in order: {ok}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ArrythmiX ingest gateway.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    edge = sub.add_parser("edge", help="Forward local BLE devices to an inference server.")
+    edge.add_argument("--server", required=True, help="tcp://host:port or unix:///path")
+    edge.add_argument("--count", type=int, default=1, help="Number of ECG devices to connect.")
+    edge.add_argument("--edge-id", default=None, help="Defaults to the host name.")
+    loopback = sub.add_parser("loopback", help="Run edge and server in-process and check delivery.")
+    loopback.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    if args.command == "edge":
+        run_edge(args.server, args.count, args.edge_id)
+    else:
+        raise SystemExit(0 if run_loopback(args.seconds) else 1)
+
+
+if __name__ == "__main__":
+    main()
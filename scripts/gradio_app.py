@@ -1,11 +1,12 @@
 import time
 
 import gradio as gr
-import simplepyble
+import ble_backend
 import matplotlib.pyplot as plt
 from collections import deque
 import threading
 import numpy as np
+from discovery import Discovery
 from ml.runner import predictor
 
 # === Configuration ===
@@ -46,7 +47,7 @@ def bluetooth_logic():
     """Scans for and connects to the ECG Bluetooth device."""
     global status_text, keep_running
     status_text = "Status: Searching for Bluetooth adapters..."
-    adapters = simplepyble.Adapter.get_adapters()
+    adapters = ble_backend.get_adapters()
     if not adapters:
         status_text = "Status: No Bluetooth adapters found."
         return
@@ -55,29 +56,25 @@ def bluetooth_logic():
     status_text = f"Status: Using adapter: {adapter.identifier()}"
 
     status_text = "Status: Scanning for devices..."
-    adapter.scan_for(SCAN_DURATION)
-    peripherals = adapter.scan_get_results()
-
-    ecg_device = None
-    for p in peripherals:
-        if p.identifier() == DEVICE_IDENTIFIER:
-            status_text = f"Status: Found device: {p.identifier()}"
-            ecg_device = p
-            break
+    discovery = Discovery(adapter, identifier=DEVICE_IDENTIFIER)
+    ecg_device = discovery.connect(timeout=SCAN_DURATION / 1000)
 
     if not ecg_device:
         status_text = "Status: Could not find device."
         return
 
     try:
-        status_text = f"Status: Connecting to {ecg_device.identifier()}..."
-        ecg_device.connect()
-        status_text = "Status: Connected! Subscribing to notifications..."
-        ecg_device.notify(SERVICE_UUID, CHARACTERISTIC_UUID, notification_callback)
-        status_text = "Status: Actively receiving ECG data."
-
-        while ecg_device.is_connected() and keep_running:
-            pass  # Keep thread alive
+        while ecg_device is not None and keep_running:
+            status_text = "Status: Connected! Subscribing to notifications..."
+            ecg_device.notify(SERVICE_UUID, CHARACTERISTIC_UUID, notification_callback)
+            status_text = "Status: Actively receiving ECG data."
+
+            while ecg_device.is_connected() and keep_running:
+                time.sleep(0.1)  # Keep thread alive
+
+            if keep_running:
+                status_text = "Status: Link lost, reconnecting..."
+                ecg_device = discovery.reconnect(ecg_device)
 
     except Exception as e:
         status_text = f"Status: Connection failed: {e}"
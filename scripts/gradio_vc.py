@@ -5,8 +5,12 @@ from collections import deque
 import matplotlib.pyplot as plt
 import numpy as np
 import gradio as gr
-import simplepyble
+import ble_backend
 from ml.runner import predictor  # your predictor class
+from ml.metrics import METRICS, serve_metrics
+from ml.beat_cache import CachedPredictor
+from ml import threads
+from discovery import Discovery
 import random
 
 # === Configuration ===
@@ -29,14 +33,19 @@ stop_event = threading.Event()
 plot_buffer = deque([0.0] * MAX_POINTS, maxlen=MAX_POINTS)
 inference_buffer = deque(maxlen=INFERENCE_WINDOW_SIZE)
 
-# Predictor (loads model inside its __init__)
-predictor_obj = predictor(INFERENCE_WINDOW_SIZE)
+# Predictor (loads model inside its __init__); repeated beat shapes are answered from the cache
+predictor_obj = CachedPredictor(predictor(INFERENCE_WINDOW_SIZE), session="live")
+
+# One stream; the reserved core keeps the feed and Gradio's workers responsive
+thread_budget = threads.load_budget(streams=1)
+threads.apply(thread_budget)
 
 # last prediction (protected by inference_lock)
 _last_prediction = "N/A"
 
 # Device handle
 ecg_device = None
+discovery = None
 
 
 # ---------------- BLE / Simulated Feed ----------------
@@ -48,25 +57,36 @@ def ble_notification_callback(received_bytes):
     try:
         if received_bytes == b"Leads Off":
             # optional: you could set a status variable
+            METRICS.record_gap("ble")
             return
-        adc_value = float(received_bytes.decode("utf-8").strip())
-        voltage = (adc_value / 1024.0) * REFERENCE_VOLTAGE
+        with METRICS.time("decode"):
+            adc_value = float(received_bytes.decode("utf-8").strip())
+            voltage = (adc_value / 1024.0) * REFERENCE_VOLTAGE
     except Exception:
         return
 
-    with plot_lock:
-        plot_buffer.append(voltage)
-    with inference_lock:
-        inference_buffer.append(voltage)
+    METRICS.record_samples("ble", 1)
+    with METRICS.time("buffer"):
+        with plot_lock:
+            plot_buffer.append(voltage)
+        with inference_lock:
+            inference_buffer.append(voltage)
+            METRICS.set_queue_depth("inference_buffer", len(inference_buffer))
 
 
 def ble_feed_thread_func(peripheral):
     """Keeps the BLE subscription alive. Notification callback appends data."""
+    global ecg_device
     try:
-        peripheral.notify(SERVICE_UUID, CHARACTERISTIC_UUID, ble_notification_callback)
-        # Keep thread alive while connected and not stopped
-        while not stop_event.is_set() and peripheral.is_connected():
-            time.sleep(0.2)
+        while peripheral is not None and not stop_event.is_set():
+            peripheral.notify(SERVICE_UUID, CHARACTERISTIC_UUID, ble_notification_callback)
+            # Keep thread alive while connected and not stopped
+            while not stop_event.is_set() and peripheral.is_connected():
+                time.sleep(0.2)
+            if not stop_event.is_set():
+                # Dropped link: reuse the peripheral handle instead of a full rescan.
+                METRICS.record_gap("ble")
+                peripheral = ecg_device = discovery.reconnect(peripheral)
     except Exception:
         pass
     finally:
@@ -79,28 +99,22 @@ def ble_feed_thread_func(peripheral):
 
 def scan_and_connect_device():
     """Scan for device and connect. Returns connected peripheral or None."""
-    adapters = simplepyble.Adapter.get_adapters()
+    global discovery
+    adapters = ble_backend.get_adapters()
     if not adapters:
         print("No Bluetooth adapters found.")
         return None
     adapter = adapters[0]
     print(f"Using adapter: {adapter.identifier()} [{adapter.address()}]")
-    print(f"Scanning for devices for {SCAN_DURATION} ms...")
-    adapter.scan_for(SCAN_DURATION)
-    peripherals = adapter.scan_get_results()
-    for p in peripherals:
-        print(f"Found: {p.identifier()} [{p.address()}]")
-        if p.identifier() == DEVICE_IDENTIFIER:
-            try:
-                print(f"Connecting to {p.identifier()}...")
-                p.connect()
-                print("Connected.")
-                return p
-            except Exception as e:
-                print(f"Failed to connect: {e}")
-                return None
-    print("Target device not found.")
-    return None
+    print(f"Scanning for devices (up to {SCAN_DURATION} ms, stops at the first match)...")
+    discovery = Discovery(adapter, identifier=DEVICE_IDENTIFIER,
+                          on_found=lambda p: print(f"Found: {p.identifier()} [{p.address()}]"))
+    p = discovery.connect(timeout=SCAN_DURATION / 1000)
+    if p is None:
+        print("Target device not found.")
+        return None
+    print("Connected.")
+    return p
 
 
 def simulated_feed_thread_func(rate_hz=20):
@@ -116,6 +130,7 @@ def simulated_feed_thread_func(rate_hz=20):
             qrs = 1.0 + 0.5 * random.random()
         noise = 0.05 * np.random.randn()
         voltage = float(np.clip(baseline + qrs + noise, 0.0, 4.0))
+        METRICS.record_samples("simulated", 1)
         with plot_lock:
             plot_buffer.append(voltage)
         with inference_lock:
@@ -124,10 +139,30 @@ def simulated_feed_thread_func(rate_hz=20):
         time.sleep(dt)
 
 
+def shm_feed_thread_func(stream):
+    """Viewer mode: samples and predictions come from a daemon's shared-memory stream (shm_stream.py)."""
+    global _last_prediction
+    from shm_stream import StreamReader
+    from ml.bundle import DEFAULT_MEANINGS
+    reader = StreamReader(stream)
+    since, predictions_since = 0, 0
+    while not stop_event.is_set():
+        samples, since, _ = reader.read(since, max_samples=MAX_POINTS)
+        predictions, predictions_since = reader.predictions(predictions_since)
+        with plot_lock:
+            plot_buffer.extend(samples.tolist())
+        if predictions and predictions[-1]["class"] is not None:
+            with inference_lock:
+                _last_prediction = DEFAULT_MEANINGS.get(predictions[-1]["class"], predictions[-1]["class"])
+        time.sleep(PLOT_UPDATE_INTERVAL / 2)
+    reader.close()
+
+
 # ---------------- Inference worker ----------------
 def inference_worker_func():
     """Runs in background. When enough data in inference_buffer, runs predictor.get_prediction on a copy."""
     global _last_prediction
+    threads.configure_thread(thread_budget)
     while not stop_event.is_set():
         # wait a tiny bit
         time.sleep(0.05)
@@ -159,15 +194,17 @@ def inference_worker_func():
 def make_ecg_figure():
     with plot_lock:
         y = list(plot_buffer)
-    fig, ax = plt.subplots(figsize=(8, 3))
-    ax.plot(range(len(y)), y, color="red")
-    ax.set_ylim(PLOT_RANGE)
-    ax.set_xlim(0, MAX_POINTS - 1)
-    ax.set_xlabel("Samples")
-    ax.set_ylabel("Voltage (V)")
-    ax.set_title(f"Live ECG (mean={np.mean(y):.2f} V)")
-    ax.grid(True)
-    fig.tight_layout()
+    with METRICS.time("render"):
+        fig, ax = plt.subplots(figsize=(8, 3))
+        ax.plot(range(len(y)), y, color="red")
+        if y and PLOT_RANGE[0] <= min(y) and max(y) <= PLOT_RANGE[1]:
+            ax.set_ylim(PLOT_RANGE)         # volts; streams from the daemon are ADC counts and autoscale
+        ax.set_xlim(0, MAX_POINTS - 1)
+        ax.set_xlabel("Samples")
+        ax.set_ylabel("Voltage (V)")
+        ax.set_title(f"Live ECG (mean={np.mean(y):.2f} V)")
+        ax.grid(True)
+        fig.tight_layout()
     return fig
 
 
@@ -194,7 +231,8 @@ def main():
     print("1) Use real BLE device (scan & connect before UI)")
     print("2) Use simulated ECG feed (start simulated feed before UI)")
     print("3) Skip data feed (UI preview only)")
-    choice = input("Enter 1/2/3: ").strip()
+    print("4) View a stream published by daemon.py (shared memory, no BLE or inference here)")
+    choice = input("Enter 1/2/3/4: ").strip()
 
     # Start appropriate feed
     feed_thread = None
@@ -215,12 +253,20 @@ def main():
         print("Starting simulated ECG feed...")
         feed_thread = threading.Thread(target=simulated_feed_thread_func, daemon=True)
         feed_thread.start()
+    elif choice == "4":
+        stream = input("Stream name: ").strip()
+        feed_thread = threading.Thread(target=shm_feed_thread_func, args=(stream,), daemon=True)
+        feed_thread.start()
     else:
         print("Skipping data feed. UI preview only (no data will arrive).")
 
-    # Start inference worker thread (always start; it will be idle if no data)
-    infer_thread = threading.Thread(target=inference_worker_func, daemon=True)
-    infer_thread.start()
+    # Prometheus-style stage latencies on http://127.0.0.1:9108/metrics
+    serve_metrics()
+
+    # Start inference worker thread (idle if no data); a stream viewer gets predictions from the daemon
+    if choice != "4":
+        infer_thread = threading.Thread(target=inference_worker_func, daemon=True)
+        infer_thread.start()
 
     # Build Gradio UI
     with gr.Blocks(title="Live ECG Monitor") as demo:
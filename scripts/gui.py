@@ -1,13 +1,18 @@
+import argparse
 import customtkinter
-import simplepyble
+import ble_backend
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from collections import deque
+import queue
 import threading
+import time
 import numpy as np
 
-from ml.runner import predictor
+from discovery import Discovery
+from ml.bundle import DEFAULT_MEANINGS
+from ml.metrics import METRICS
 
 # === Configuration ===
 MAX_POINTS = 200           # Number of points to show in the plot window
@@ -17,6 +22,8 @@ CHARACTERISTIC_UUID = "e2fd985e-ceb8-4ccb-9cd3-52563e4b5c62"
 DEVICE_IDENTIFIER = "ECG Data"
 REFERENCE_VOLTAGE = 3.7
 SCAN_DURATION = 5000       # milliseconds
+STREAM_POLL_MS = 50        # how often a --shm viewer reads the shared-memory stream
+UI_POLL_MS = 50            # how often the BLE mode applies label updates queued by its threads
 
 # --- Appearance ---
 customtkinter.set_appearance_mode("Dark")
@@ -24,24 +31,50 @@ customtkinter.set_default_color_theme("blue")
 plt.style.use('dark_background')
 
 class App(customtkinter.CTk):
-    def _init_(self):
-        super()._init_()
+    """
+    Live plot and prediction. With `stream` set the window is only a viewer of a
+    shared-memory stream published by the daemon (shm_stream.py): no BLE and no
+    inference in this process, so the UI can never stall acquisition.
+    """
+
+    def __init__(self, stream=None):
+        super().__init__()
 
         self.title("Live ECG Data")
         self.geometry("1000x700")
 
         self.data = deque([0.0] * MAX_POINTS, maxlen=MAX_POINTS)
-        self.predictor = predictor(MAX_POINTS)
         self.prediction_label_text = customtkinter.StringVar(value="Prediction: N/A")
 
         self.status_text = customtkinter.StringVar(value="Status: Initializing...")
         self.data_counter = 0
         self.is_predicting = False
+        self.leads_off = False
+        # Tk is not thread-safe: the BLE and prediction threads queue label updates for the main loop.
+        self.ui_updates = queue.SimpleQueue()
 
-        self._setup_ui()
-        self._start_bluetooth_thread()
+        self.reader = None
 
-        self.ani = FuncAnimation(self.fig, self.update_plot, interval=50, blit=True)
+        self._setup_ui()
+        if stream is not None:
+            from shm_stream import StreamReader
+            self.reader = StreamReader(stream)
+            self.stream_since = 0
+            self.predictions_since = 0
+            self._poll_stream()
+        else:
+            from ml.runner import predictor
+            from ml.beat_cache import CachedPredictor
+            from ml import threads
+            self.predictor = CachedPredictor(predictor(MAX_POINTS), session="ble")
+            # One stream; the reserved core keeps Tk and the BLE callbacks responsive.
+            self.thread_budget = threads.load_budget(streams=1)
+            threads.apply(self.thread_budget)
+            self._apply_ui_updates()
+            self._start_bluetooth_thread()
+
+        # A stream viewer rescales the y axis to the ADC counts, which needs full redraws.
+        self.ani = FuncAnimation(self.fig, self.update_plot, interval=50, blit=stream is None)
 
     def _setup_ui(self):
         """Configures the main UI layout."""
@@ -83,6 +116,21 @@ class App(customtkinter.CTk):
 
         name_label = customtkinter.CTkLabel(info_frame,text="ArrhythmiX - Prototype 1", font=("Roboto", 24, "bold", "italic"), text_color="yellow")
         name_label.place(relx=0.5, rely=0.5, anchor="center")
+
+    def _set_text(self, variable, text):
+        """StringVar.set for the BLE and prediction threads; applied by _apply_ui_updates."""
+        self.ui_updates.put((variable, text))
+
+    def _apply_ui_updates(self):
+        """Sets the label texts queued by the background threads (Tk main loop)."""
+        while True:
+            try:
+                variable, text = self.ui_updates.get_nowait()
+            except queue.Empty:
+                break
+            variable.set(text)
+        self.after(UI_POLL_MS, self._apply_ui_updates)
+
     def _start_bluetooth_thread(self):
         """Initializes and starts the Bluetooth connection thread."""
         self.bt_thread = threading.Thread(target=self.start_bluetooth, daemon=True)
@@ -91,26 +139,34 @@ class App(customtkinter.CTk):
     def _run_prediction_thread(self):
         """Runs prediction in a background thread to avoid blocking the UI."""
         self.is_predicting = True
+        from ml.threads import configure_thread
+        configure_thread(self.thread_budget)
         try:
             prediction = self.predictor.get_prediction(list(self.data))
-            self.prediction_label_text.set(f"Prediction: {prediction}")
+            self._set_text(self.prediction_label_text, f"Prediction: {prediction}")
             print("ran prediction")
         finally:
             self.is_predicting = False
 
     def notification_callback(self, received_bytes):
-        """Handles incoming data from the BLE characteristic."""z
+        """Handles incoming data from the BLE characteristic."""
         if received_bytes == b"Leads Off":
-            self.status_text.set("Status: Leads Off")
+            self.leads_off = True
+            self._set_text(self.status_text, "Status: Leads Off")
+            METRICS.record_gap("ble")
             return
         try:
-            adc_value = float(received_bytes.decode('utf-8').strip())
-            voltage = (adc_value / 1023) * REFERENCE_VOLTAGE
-            self.data.append(voltage)
-            self.data_counter += 1
-
-            if self.status_text.get() == "Leads Off":
-                self.status_text.set("Status: ECG Receiving")
+            with METRICS.time("decode"):
+                adc_value = float(received_bytes.decode('utf-8').strip())
+                voltage = (adc_value / 1023) * REFERENCE_VOLTAGE
+            METRICS.record_samples("ble", 1)
+            with METRICS.time("buffer"):
+                self.data.append(voltage)
+                self.data_counter += 1
+
+            if self.leads_off:
+                self.leads_off = False
+                self._set_text(self.status_text, "Status: ECG Receiving")
 
             # Predict every 40 data points
             if self.data_counter >= 40 and not self.is_predicting:
@@ -120,57 +176,77 @@ class App(customtkinter.CTk):
                     thread.start()
 
         except (ValueError, UnicodeDecodeError):
-            self.status_text.set(f"Status: Error decoding data")
+            self._set_text(self.status_text, "Status: Error decoding data")
+
+    def _poll_stream(self):
+        """Copies new samples and predictions from the shared-memory stream (Tk main loop)."""
+        samples, self.stream_since, _ = self.reader.read(self.stream_since, max_samples=MAX_POINTS)
+        self.data.extend(samples.tolist())
+        predictions, self.predictions_since = self.reader.predictions(self.predictions_since)
+        if predictions and predictions[-1]["class"] is not None:
+            self.prediction_label_text.set(f"Prediction: {DEFAULT_MEANINGS.get(predictions[-1]['class'], predictions[-1]['class'])}")
+        status = self.reader.status()
+        if status["stale"]:
+            self.status_text.set("Status: Ingest process not responding")
+        elif status["leads_off"]:
+            self.status_text.set("Status: Leads Off")
+        else:
+            self.status_text.set("Status: ECG Receiving" if status["connected"] else "Status: Waiting for device")
+        self.after(STREAM_POLL_MS, self._poll_stream)
 
     def update_plot(self, frame):
         """Updates the plot with new data."""
-        self.line.set_ydata(self.data)
+        with METRICS.time("render"):
+            self.line.set_ydata(self.data)
+            if self.reader is not None:
+                low, high = min(self.data), max(self.data)
+                margin = max((high - low) * 0.1, 1e-6)
+                self.ax.set_ylim(low - margin, high + margin)
         return self.line,
 
     def start_bluetooth(self):
         """Scans for and connects to the ECG Bluetooth device."""
-        self.status_text.set("Status: Searching for Bluetooth adapters...")
-        adapters = simplepyble.Adapter.get_adapters()
+        self._set_text(self.status_text, "Status: Searching for Bluetooth adapters...")
+        adapters = ble_backend.get_adapters()
         if not adapters:
-            self.status_text.set("Status: No Bluetooth adapters found.")
+            self._set_text(self.status_text, "Status: No Bluetooth adapters found.")
             return
 
         adapter = adapters[0]
-        self.status_text.set(f"Status: Using adapter: {adapter.identifier()}")
+        self._set_text(self.status_text, f"Status: Using adapter: {adapter.identifier()}")
 
-        self.status_text.set("Status: Scanning for devices...")
-        adapter.scan_for(SCAN_DURATION)
-        peripherals = adapter.scan_get_results()
-
-        ecg_device = None
-        for p in peripherals:
-            if p.identifier() == DEVICE_IDENTIFIER:
-                self.status_text.set(f"Status: Found device: {p.identifier()}")
-                ecg_device = p
-                break
+        self._set_text(self.status_text, "Status: Scanning for devices...")
+        discovery = Discovery(adapter, identifier=DEVICE_IDENTIFIER,
+                              on_found=lambda p: self._set_text(self.status_text, f"Status: Found device: {p.identifier()}"))
+        ecg_device = discovery.connect(timeout=SCAN_DURATION / 1000)
 
         if not ecg_device:
-            self.status_text.set(f"Status: Could not find device.")
+            self._set_text(self.status_text, f"Status: Could not find device.")
 
             return
 
         try:
-            self.status_text.set(f"Status: Connecting to {ecg_device.identifier()}...")
-            ecg_device.connect()
-            self.status_text.set("Status: Connected! Subscribing to notifications...")
-            ecg_device.notify(SERVICE_UUID, CHARACTERISTIC_UUID, self.notification_callback)
-            self.status_text.set("Status: Actively receiving ECG data.")
+            while ecg_device is not None:
+                self._set_text(self.status_text, "Status: Connected! Subscribing to notifications...")
+                ecg_device.notify(SERVICE_UUID, CHARACTERISTIC_UUID, self.notification_callback)
+                self._set_text(self.status_text, "Status: Actively receiving ECG data.")
+
+                while ecg_device.is_connected():
+                    time.sleep(0.1) # Keep thread alive
 
-            while ecg_device.is_connected():
-                pass # Keep thread alive
+                self._set_text(self.status_text, "Status: Link lost, reconnecting...")
+                ecg_device = discovery.reconnect(ecg_device)
 
         except Exception as e:
-            self.status_text.set(f"Status: Connection failed: {e}")
+            self._set_text(self.status_text, f"Status: Connection failed: {e}")
         finally:
             if ecg_device and ecg_device.is_connected():
                 ecg_device.disconnect()
-            self.status_text.set("Status: Disconnected.")
+            self._set_text(self.status_text, "Status: Disconnected.")
 
-if _name_ == "_main_":
-    app = App()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Live ECG viewer.")
+    parser.add_argument("--shm", metavar="STREAM", help="View a stream published by daemon.py instead of connecting over BLE.")
+    args = parser.parse_args()
+    app = App(stream=args.shm)
     app.mainloop()
\ No newline at end of file
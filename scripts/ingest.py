@@ -0,0 +1,235 @@
+import time
+from collections import deque
+
+import numpy as np
+
+from ml.filters import StreamingFilterBank
+from ml.metrics import METRICS
+from ml.timing import FRAME_SAMPLES, NOMINAL_DEVICE_HZ, TARGET_HZ, StreamTiming
+
+# === Configuration ===
+FRAME_BYTES = FRAME_SAMPLES * 2         # uint16 ecg_data[20] per notification
+LEGACY_LEADS_OFF = b"Leads Off"
+INFERENCE_WINDOW_SIZE = 171             # samples at TARGET_HZ handed to the classifier
+INFERENCE_TRIGGER_COUNT = 40            # run inference every N new samples
+LINK_POLL_INTERVAL = 0.2                # seconds between BLE link checks
+
+
+def decode_notification(payload):
+    """
+    Decodes one BLE notification.
+
+    The current firmware sends 20 little-endian uint16 ADC counts and writes 0
+    for every sample taken while the leads are off. Older firmware sent one
+    ASCII number per notification and the literal b"Leads Off".
+
+    Returns:
+        tuple[np.ndarray | None, bool]: (samples, leads_off). samples is None if the payload is garbage.
+    """
+    if payload == LEGACY_LEADS_OFF:
+        return None, True
+    if len(payload) == FRAME_BYTES:
+        samples = np.frombuffer(payload, dtype="<u2")
+        return samples, not samples.any()
+    try:
+        return np.array([float(payload.decode("utf-8").strip())]), False
+    except (ValueError, UnicodeDecodeError):
+        return None, False
+
+
+class Session():
+    """
+    Everything that happens to one device's stream before inference: timing and
+    resampling to TARGET_HZ, filtering, recording, windowing.
+
+    on_window(session, window, filtered) is called with copies of the latest
+    INFERENCE_WINDOW_SIZE samples every `trigger_samples` new samples. `window`
+    is unfiltered: the classifier normalizes with statistics of raw ADC counts,
+    and a high-passed window would reach it far out of distribution.
+    `filtered` is the same stretch of the continuously filtered stream (the
+    same array when filtering is off), for beat detection without per-window
+    filter transients. A publisher (shm_stream.StreamWriter) receives every
+    filtered output sample and the connection / leads-off state for
+    out-of-process viewers.
+    on_signal_lost(session) is called when the leads come off or the stream
+    disconnects, e.g. to close the patient's open arrhythmia episode.
+    """
+
+    def __init__(self, name, nominal_hz=NOMINAL_DEVICE_HZ, recorder=None, filter_config=None,
+                 window_size=INFERENCE_WINDOW_SIZE, trigger_samples=INFERENCE_TRIGGER_COUNT, on_window=None,
+                 publisher=None, on_signal_lost=None):
+        self.name = name
+        self.timing = StreamTiming(output_hz=TARGET_HZ, nominal_hz=nominal_hz)
+        self.filter = StreamingFilterBank(1, fs=TARGET_HZ, **filter_config) if filter_config is not None else None
+        self.recorder = recorder
+        self.window = deque(maxlen=window_size)             # unfiltered, for the classifier
+        self.filtered_window = deque(maxlen=window_size) if self.filter is not None else None
+        self.trigger_samples = trigger_samples
+        self.on_window = on_window
+        self.publisher = publisher
+        self.on_signal_lost = on_signal_lost
+        self.new_samples = 0
+        self.samples_out = 0                # samples delivered at TARGET_HZ, the session's stream clock
+        self.leads_off = False
+        self.quality_recovered_at = None
+        self._connected = False
+        self.last_prediction = None
+        self.last_prediction_time = None
+        self.last_disagreement = None
+        self.model_results = None
+        self.hrv = None
+
+    @property
+    def connected(self):
+        return self._connected
+
+    @connected.setter
+    def connected(self, value):
+        if value and not self._connected:
+            self.quality_recovered_at = time.monotonic()    # a reconnect counts as recovered signal
+        if value != self._connected and self.publisher is not None:
+            self.publisher.set_status(connected=value)
+        lost = self._connected and not value
+        self._connected = value
+        if lost and self.on_signal_lost is not None:
+            self.on_signal_lost(self)
+
+    def on_notification(self, payload, arrival=None):
+        arrival = time.monotonic() if arrival is None else arrival
+        with METRICS.time("decode"):
+            samples, leads_off = decode_notification(payload)
+        if samples is None and not leads_off:
+            return
+        self.on_frame(samples, arrival, leads_off=leads_off)
+
+    def on_frame(self, samples, arrival=None, leads_off=False):
+        arrival = time.monotonic() if arrival is None else arrival
+        if leads_off != self.leads_off:
+            self.leads_off = leads_off
+            if leads_off:
+                METRICS.record_gap(self.name)
+                self.window.clear()
+                if self.filtered_window is not None:
+                    self.filtered_window.clear()
+                self.new_samples = 0
+            else:
+                # Local clock, like the scheduler's; `arrival` may come from a gateway host's clock.
+                self.quality_recovered_at = time.monotonic()
+            if self.publisher is not None:
+                self.publisher.set_status(leads_off=leads_off)
+            if leads_off and self.on_signal_lost is not None:
+                self.on_signal_lost(self)
+        if samples is None:
+            return
+
+        METRICS.record_samples(self.name, samples.size, arrival)
+        if self.recorder is not None:
+            self.recorder.append(samples)
+        resampled, missing = self.timing.process(samples, arrival)
+        if missing:
+            METRICS.record_gap(self.name, missing)
+        if self.leads_off or resampled.size == 0:
+            return
+        self.samples_out += resampled.size
+        filtered = self.filter.process(resampled) if self.filter is not None else resampled
+        if self.publisher is not None:
+            self.publisher.write(filtered)
+
+        with METRICS.time("buffer"):
+            self.window.extend(resampled)
+            if self.filtered_window is not None:
+                self.filtered_window.extend(filtered)
+            self.new_samples += resampled.size
+            ready = self.new_samples >= self.trigger_samples and len(self.window) == self.window.maxlen
+            if ready:
+                self.new_samples = 0
+                window = np.array(self.window)
+                filtered_window = np.array(self.filtered_window) if self.filtered_window is not None else window
+        if ready and self.on_window is not None:
+            self.on_window(self, window, filtered_window)
+
+    def status(self):
+        return {
+            "connected": self.connected,
+            "leads_off": self.leads_off,
+            "sample_rate_hz": self.timing.clock.sample_rate_hz,
+            "drift_ppm": self.timing.clock.drift_ppm,
+            "dropped_frames": self.timing.clock.dropped_frames,
+            "samples_recorded": self.recorder.samples_written if self.recorder is not None else None,
+            "last_prediction": self.last_prediction,
+            "last_prediction_time": self.last_prediction_time,
+            "last_disagreement": self.last_disagreement,
+            "model_results": self.model_results,
+            "hrv": self.hrv,
+        }
+
+
+def ble_link(session, discovery, peripheral, stop_event):
+    """
+    Keeps one BLE device subscribed, reconnecting after drops, until stopped.
+
+    `session` is a Session or anything else with `name`, `connected` and `on_notification(payload)`.
+    """
+    from discovery import CHARACTERISTIC_UUID, SERVICE_UUID
+    while peripheral is not None and not stop_event.is_set():
+        try:
+            peripheral.notify(SERVICE_UUID, CHARACTERISTIC_UUID, session.on_notification)
+            session.connected = True
+            while peripheral.is_connected() and not stop_event.is_set():
+                time.sleep(LINK_POLL_INTERVAL)
+        except Exception as e:
+            print(f"[{session.name}] BLE error: {e}")
+        session.connected = False
+        if stop_event.is_set():
+            break
+        METRICS.record_gap(session.name)
+        peripheral = discovery.reconnect(peripheral)
+    try:
+        if peripheral is not None and peripheral.is_connected():
+            peripheral.disconnect()
+    except Exception:
+        pass
+
+
+def check_classifier_parity(samples, model, filter_config=None):
+    """
+    Feeds raw samples through a Session in device-sized frames and classifies every
+    window it hands out, next to the same raw samples given to the model directly.
+
+    The frames are timestamped at TARGET_HZ, so resampling is an identity up to its
+    anti-aliasing filter and the Session's window lines up with the raw one.
+
+    Returns:
+        tuple[int, int]: (windows with the same class, windows compared).
+    """
+    samples = np.asarray(samples, dtype=np.float64)
+    windows = []
+    session = Session("parity", nominal_hz=TARGET_HZ, filter_config=filter_config,
+                      on_window=lambda session, window, filtered: windows.append((session.samples_out, window)))
+    for start in range(0, samples.size - FRAME_SAMPLES + 1, FRAME_SAMPLES):
+        session.on_frame(samples[start:start + FRAME_SAMPLES], arrival=start / TARGET_HZ)
+    same = sum(model.get_prediction(window) == model.get_prediction(samples[end - len(window):end])
+               for end, window in windows)
+    return same, len(windows)
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Check that a Session hands the classifier the same class as raw windows.")
+    parser.add_argument("path", nargs="?", help="Text dump or record of raw ADC counts (default: a synthetic ECG).")
+    parser.add_argument("--seconds", type=float, default=60.0)
+    parser.add_argument("--no-filter", action="store_true", help="Run the Session without the default filter bank.")
+    args = parser.parse_args()
+
+    from ml.runner import predictor
+    if args.path is None:
+        from ble_backend import synthetic_ecg
+        raw = synthetic_ecg(args.seconds, TARGET_HZ)
+    else:
+        from ml.recordings import parse_data_from_file
+        raw = parse_data_from_file(args.path)
+    same, total = check_classifier_parity(raw, predictor(None), filter_config=None if args.no_filter else {})
+    print(f"{same}/{total} windows classified the same through Session and directly")
+    sys.exit(0 if total and same == total else 1)
@@ -1,9 +1,12 @@
-import simplepyble
+import ble_backend
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 from collections import deque
 from numpy import mean
 
+from discovery import Discovery
+from ml.metrics import METRICS, serve_metrics
+
 # === Configuration ===
 MAX_POINTS = 200           # Number of points to show in the plot window
 PLOT_RANGE = (0, 4)        # Y-axis range for voltage (V), adjust if necessary
@@ -23,43 +26,39 @@ ax.set_ylabel("Voltage (V)")
 def notification_callback(received_bytes):
     if received_bytes == b"Leads Off":
         print("Leads Off")
+        METRICS.record_gap("ble")
         return
     try:
-
-        adc_value = float(received_bytes.decode('utf-8').strip())
-        voltage = (adc_value / 1024) * REFERENCE_VOLTAGE
+        with METRICS.time("decode"):
+            adc_value = float(received_bytes.decode('utf-8').strip())
+            voltage = (adc_value / 1024) * REFERENCE_VOLTAGE
+        METRICS.record_samples("ble", 1)
         print(f"Voltage: {voltage:.2f}V, Mean: {mean(data):.2f}V")
-        data.append(voltage)
+        with METRICS.time("buffer"):
+            data.append(voltage)
     except (ValueError, UnicodeDecodeError):
         print(f"Could not decode or convert {received_bytes} to voltage.")
 
 # === Plot Update Function ===
 def update(frame):
-    line.set_ydata(data)
+    with METRICS.time("render"):
+        line.set_ydata(data)
     return line,
 
 # === Main Execution ===
 if __name__ == "__main__":
-    adapters = simplepyble.Adapter.get_adapters()
+    serve_metrics()
+    adapters = ble_backend.get_adapters()
 
     adapter = adapters[0]
     print(f"Using adapter: {adapter.identifier()} [{adapter.address()}]")
-    adapter.scan_for(5000)
-    peripherals = adapter.scan_get_results()
-
-    ecg_device = None
-    for peripheral in peripherals:
-        if peripheral.identifier() == DEVICE_IDENTIFIER:
-            print(f"Found device: {peripheral.identifier()} [{peripheral.address()}]")
-            ecg_device = peripheral
-            break
+    discovery = Discovery(adapter, on_found=lambda p: print(f"Found device: {p.identifier()} [{p.address()}]"))
 
+    print("Connecting...")
+    ecg_device = discovery.connect()
     if not ecg_device:
         print(f"Could not find ECG Device")
         exit()
-
-    print("Connecting...")
-    ecg_device.connect()
     ecg_device.notify(SERVICE_UUID, CHARACTERISTIC_UUID, notification_callback)
 
     ani = FuncAnimation(fig, update, interval=50, blit=True)
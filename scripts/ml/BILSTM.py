@@ -4,59 +4,85 @@ import torch
 
 
 class CNNBiLSTM(nn.Module):
-    def __init__(self, input_channels, seq_length, n_classes):
+    """
+    Conv feature extractor -> bidirectional LSTM -> self-attention -> MLP.
+
+    The defaults are the architecture the shipped weights were trained with. Smaller
+    variants (see ml/prune.py) change the widths and depths; the parameter names
+    (conv1.., bn1.., lstm, attention, fc1..) stay the same.
+
+    Args:
+        conv_channels (tuple[int]): Output channels of each conv block; each block halves the sequence.
+        conv_kernels (tuple[int] | None): Kernel size per block (default 7, 5, 3, then 3).
+        lstm_hidden (int): Hidden units per LSTM direction.
+        lstm_layers (int): Stacked LSTM layers.
+        attention_heads (int): Heads of the self-attention; must divide 2 * lstm_hidden.
+        fc_sizes (tuple[int]): Hidden fully connected layers before the output layer.
+    """
+
+    def __init__(self, input_channels, seq_length, n_classes, conv_channels=(64, 128, 256), conv_kernels=None,
+                 lstm_hidden=128, lstm_layers=2, attention_heads=8, fc_sizes=(128, 64)):
         super(CNNBiLSTM, self).__init__()
 
         # Store parameters
         self.input_channels = input_channels
         self.seq_length = seq_length
         self.n_classes = n_classes
+        self.conv_channels = tuple(conv_channels)
+        self.conv_kernels = tuple(conv_kernels or [(7, 5, 3)[i] if i < 3 else 3 for i in range(len(conv_channels))])
+        self.fc_sizes = tuple(fc_sizes)
 
         # Convolutional layers
-        self.conv1 = nn.Conv1d(input_channels, 64, kernel_size=7, padding=3)
-        self.bn1 = nn.BatchNorm1d(64)
-        self.pool1 = nn.MaxPool1d(2, stride=2)
-
-        self.conv2 = nn.Conv1d(64, 128, kernel_size=5, padding=2)
-        self.bn2 = nn.BatchNorm1d(128)
-        self.pool2 = nn.MaxPool1d(2, stride=2)
-
-        self.conv3 = nn.Conv1d(128, 256, kernel_size=3, padding=1)
-        self.bn3 = nn.BatchNorm1d(256)
-        self.pool3 = nn.MaxPool1d(2, stride=2)
+        in_channels = input_channels
+        for i, (channels, kernel) in enumerate(zip(self.conv_channels, self.conv_kernels), start=1):
+            setattr(self, f"conv{i}", nn.Conv1d(in_channels, channels, kernel_size=kernel, padding=kernel // 2))
+            setattr(self, f"bn{i}", nn.BatchNorm1d(channels))
+            setattr(self, f"pool{i}", nn.MaxPool1d(2, stride=2))
+            in_channels = channels
 
         # Calculate LSTM
-        self.lstm_input_size = 256
-        self.lstm_seq_length = seq_length // 8
+        self.lstm_input_size = in_channels
+        self.lstm_seq_length = seq_length // 2 ** len(self.conv_channels)
 
         # Bidirectional LSTM
         self.lstm = nn.LSTM(
             input_size=self.lstm_input_size,
-            hidden_size=128,
-            num_layers=2,
+            hidden_size=lstm_hidden,
+            num_layers=lstm_layers,
             bidirectional=True,
             batch_first=True,
-            dropout=0.3
+            dropout=0.3 if lstm_layers > 1 else 0.0
         )
 
         # Attention mechanism
         self.attention = nn.MultiheadAttention(
-            embed_dim=256,  # 128*2 for bidirectional
-            num_heads=8,
+            embed_dim=2 * lstm_hidden,  # bidirectional
+            num_heads=attention_heads,
             dropout=0.1,
             batch_first=True
         )
 
         # Fully connected layers
-        self.fc1 = nn.Linear(256, 128)  # 128*2 for bidirectional LSTM
-        self.dropout1 = nn.Dropout(0.5)
-        self.fc2 = nn.Linear(128, 64)
-        self.dropout2 = nn.Dropout(0.3)
-        self.fc3 = nn.Linear(64, n_classes)
+        sizes = [2 * lstm_hidden, *self.fc_sizes, n_classes]
+        dropouts = (0.5, 0.3)
+        for i in range(len(sizes) - 1):
+            setattr(self, f"fc{i + 1}", nn.Linear(sizes[i], sizes[i + 1]))
+            if i < len(self.fc_sizes):
+                setattr(self, f"dropout{i + 1}", nn.Dropout(dropouts[i] if i < len(dropouts) else dropouts[-1]))
 
         # Initialize weights
         self._initialize_weights()
 
+    @property
+    def config(self):
+        """Keyword arguments that rebuild this architecture (bundle model_config)."""
+        return {
+            "input_channels": self.input_channels, "seq_length": self.seq_length, "n_classes": self.n_classes,
+            "conv_channels": list(self.conv_channels), "conv_kernels": list(self.conv_kernels),
+            "lstm_hidden": self.lstm.hidden_size, "lstm_layers": self.lstm.num_layers,
+            "attention_heads": self.attention.num_heads, "fc_sizes": list(self.fc_sizes),
+        }
+
     def _initialize_weights(self):
         """Initialize model weights for better training stability"""
         for m in self.modules():
@@ -82,24 +108,12 @@ class CNNBiLSTM(nn.Module):
              x = x.permute(0, 2, 1) # Correct permutation to (batch_size, channels, seq_len)
 
 
-        # Convolutional
-        # First conv block
-        x = self.conv1(x)
-        x = self.bn1(x)
-        x = F.relu(x)
-        x = self.pool1(x)
-
-        # Second conv block
-        x = self.conv2(x)
-        x = self.bn2(x)
-        x = F.relu(x)
-        x = self.pool2(x)
-
-        # Third conv block
-        x = self.conv3(x)
-        x = self.bn3(x)
-        x = F.relu(x)
-        x = self.pool3(x)
+        # Convolutional blocks
+        for i in range(1, len(self.conv_channels) + 1):
+            x = getattr(self, f"conv{i}")(x)
+            x = getattr(self, f"bn{i}")(x)
+            x = F.relu(x)
+            x = getattr(self, f"pool{i}")(x)
 
         # for LSTM: (batch, seq_len, features)
         x = x.permute(0, 2, 1)
@@ -114,10 +128,9 @@ class CNNBiLSTM(nn.Module):
         x = torch.mean(attn_out, dim=1)  # (batch, features)
 
         # Fully connected
-        x = F.relu(self.fc1(x))
-        x = self.dropout1(x)
-        x = F.relu(self.fc2(x))
-        x = self.dropout2(x)
-        x = self.fc3(x)
+        for i in range(1, len(self.fc_sizes) + 1):
+            x = F.relu(getattr(self, f"fc{i}")(x))
+            x = getattr(self, f"dropout{i}")(x)
+        x = getattr(self, f"fc{len(self.fc_sizes) + 1}")(x)
 
         return x
@@ -0,0 +1,140 @@
+import threading
+
+import numpy as np
+
+from ml.metrics import METRICS
+
+# === Configuration ===
+SIGNATURE_LENGTH = 32           # bins the normalized window is averaged into
+SIMILARITY_THRESHOLD = 0.99     # Pearson correlation with a template needed for a hit
+LEVEL_TOLERANCE = 0.25          # allowed difference in window mean/std (normalized units)
+CACHE_SIZE = 64                 # templates kept per session
+
+
+def morphology_signature(window, length=SIGNATURE_LENGTH):
+    """
+    Compact shape descriptor of one normalized, resampled window.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (unit-norm zero-mean shape vector of `length` float32,
+        (mean, std) of the window). Dot products of shape vectors are Pearson correlations.
+    """
+    x = np.asarray(window, dtype=np.float64).ravel()
+    usable = x.size - x.size % length
+    bins = x[:usable].reshape(length, -1).mean(axis=1)
+    level = np.array([x.mean(), x.std()])
+    shape = bins - bins.mean()
+    norm = np.linalg.norm(shape)
+    if norm > 0:
+        shape /= norm
+    return shape.astype(np.float32), level
+
+
+class PredictionCache():
+    """
+    Per-session LRU cache of (template signature -> class probabilities).
+
+    A stable rhythm produces nearly identical consecutive windows; when a new
+    window correlates with a stored template above `threshold` (and has a
+    similar level and amplitude) the stored probabilities are reused instead of
+    running the model. Lookup is one (size x length) matrix-vector product.
+    """
+
+    def __init__(self, size=CACHE_SIZE, threshold=SIMILARITY_THRESHOLD, level_tolerance=LEVEL_TOLERANCE,
+                 length=SIGNATURE_LENGTH):
+        self.size = size
+        self.threshold = threshold
+        self.level_tolerance = level_tolerance
+        self.length = length
+        self.templates = np.zeros((size, length), dtype=np.float32)
+        self.levels = np.zeros((size, 2))
+        self.probabilities = [None] * size
+        self.last_used = np.full(size, -1, dtype=np.int64)  # -1 marks an empty slot
+        self.hits = 0
+        self.misses = 0
+        self._clock = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, window):
+        """Returns (cached probabilities or None, signature to pass to store() on a miss)."""
+        signature = morphology_signature(window, self.length)
+        shape, level = signature
+        with self._lock:
+            self._clock += 1
+            occupied = self.last_used >= 0
+            if occupied.any():
+                similarity = np.where(occupied, self.templates @ shape, -np.inf)
+                best = int(similarity.argmax())
+                close_level = np.all(np.abs(self.levels[best] - level) <= self.level_tolerance)
+                if similarity[best] >= self.threshold and close_level:
+                    self.last_used[best] = self._clock
+                    self.hits += 1
+                    return self.probabilities[best], signature
+            self.misses += 1
+        return None, signature
+
+    def store(self, signature, probabilities):
+        shape, level = signature
+        with self._lock:
+            slot = int(self.last_used.argmin())  # an empty slot (-1) or the least recently used one
+            self.templates[slot] = shape
+            self.levels[slot] = level
+            self.probabilities[slot] = probabilities
+            self._clock += 1
+            self.last_used[slot] = self._clock
+
+    def clear(self):
+        with self._lock:
+            self.last_used[:] = -1
+            self.probabilities = [None] * self.size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "templates": int((self.last_used >= 0).sum()),
+            "threshold": self.threshold,
+        }
+
+
+class CachedPredictor():
+    """
+    Wraps a predictor (or CascadeClassifier) with a PredictionCache.
+
+    Keep one instance per session: templates from one patient say nothing about another.
+    """
+
+    def __init__(self, model, cache=None, session=""):
+        self.model = model
+        self.cache = cache if cache is not None else PredictionCache()
+        self.session = session
+        self.last_hit = None
+        self.last_probabilities = None
+
+    @property
+    def classes(self):
+        return self.model.classes
+
+    @property
+    def meanings(self):
+        return self.model.meanings
+
+    def stats(self):
+        return self.cache.stats()
+
+    def get_prediction(self, data):
+        with METRICS.time("preprocess"):
+            x = self.model.preprocess(data)
+            probabilities, signature = self.cache.lookup(x[0, 0].cpu().numpy())
+        self.last_hit = probabilities is not None
+        if probabilities is None:
+            with METRICS.time("forward"):
+                probabilities = self.model.predict_proba(x[:1])[0]
+            self.cache.store(signature, probabilities)
+        METRICS.set_gauge("prediction_cache_hit_rate", self.cache.stats()["hit_rate"], self.session)
+        with METRICS.time("postprocess"):
+            self.last_probabilities = probabilities
+            predicted_class = self.classes[int(np.argmax(probabilities))]
+        return self.meanings[predicted_class]
@@ -0,0 +1,248 @@
+"""
+Self-describing model bundle (.arxb).
+
+One file holds everything a worker needs to run the classifier: the weights of
+one or more folds, the per-fold normalization constants, the class metadata and
+the input spec. Layout:
+
+    magic (8 bytes) | format version (u32) | header length (u32) | JSON header | tensor data
+
+Every tensor starts on a 64-byte boundary. The file is memory-mapped read-only
+and the model parameters point straight into the mapping, so N worker processes
+share one physical copy of the weights through the page cache.
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import warnings
+
+import numpy as np
+import torch
+
+from ml.BILSTM import CNNBiLSTM
+
+MAGIC = b"ARXBNDL\x00"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+_PREAMBLE = struct.Struct("<8sII")
+
+DEFAULT_BUNDLE_PATH = 'ml/arrythmix_model.arxb'
+DEFAULT_CLASSES = ['N', 'L', 'R', 'A', 'V', '/']
+DEFAULT_MEANINGS = {
+    "N": "Normal beat",
+    "L": "Left bundle branch block beat",
+    "R": "Right bundle branch block beat",
+    "A": "Atrial premature beat",
+    "V": "Premature ventricular contraction",
+    "/": "Paced beat"}
+DEFAULT_INPUT_SPEC = {"seq_length": 171, "sample_rate_hz": 360.0, "fold_index": 4}
+
+
+class BundleError(ValueError):
+    """Raised when a bundle is malformed or does not match the code loading it."""
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def pack_bundle(path, fold_weights, train_means, train_stds, classes=DEFAULT_CLASSES,
+                meanings=DEFAULT_MEANINGS, input_spec=DEFAULT_INPUT_SPEC, model_config=None):
+    """
+    Writes a bundle file.
+
+    Args:
+        path (str): Output file.
+        fold_weights (dict[int, dict]): Fold index -> CNNBiLSTM state dict.
+        train_means (np.ndarray): Per-fold normalization means, shape (n_folds,).
+        train_stds (np.ndarray): Per-fold normalization stds, shape (n_folds,).
+        classes (list[str]): Class labels in output-logit order.
+        meanings (dict[str, str]): Human readable description per class.
+        input_spec (dict): seq_length, sample_rate_hz and the default fold_index.
+        model_config (dict | None): Extra CNNBiLSTM keyword arguments.
+    """
+    model_config = dict(model_config or {})
+    model_config.setdefault("input_channels", 1)
+    model_config.setdefault("seq_length", input_spec["seq_length"])
+    model_config.setdefault("n_classes", len(classes))
+
+    arrays = {
+        "norm.train_means": np.asarray(train_means, dtype=np.float64),
+        "norm.train_stds": np.asarray(train_stds, dtype=np.float64),
+    }
+    for fold, state_dict in sorted(fold_weights.items()):
+        for key, tensor in state_dict.items():
+            arrays[f"fold{fold}.{key}"] = tensor.detach().cpu().contiguous().numpy()
+
+    tensors = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        tensors[name] = {"dtype": array.dtype.str, "shape": list(array.shape),
+                         "offset": offset, "nbytes": array.nbytes}
+        offset += array.nbytes
+    data = bytearray(offset)
+    for name, array in arrays.items():
+        spec = tensors[name]
+        data[spec["offset"]:spec["offset"] + spec["nbytes"]] = array.tobytes()
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "architecture": "CNNBiLSTM",
+        "model_config": model_config,
+        "classes": list(classes),
+        "meanings": dict(meanings),
+        "input": dict(input_spec),
+        "folds": sorted(int(f) for f in fold_weights),
+        "tensors": tensors,
+        "sha256": hashlib.sha256(data).hexdigest(),
+    }
+    header_bytes = json.dumps(header, sort_keys=True).encode("utf-8")
+    data_start = _align(_PREAMBLE.size + len(header_bytes))
+    header_bytes = header_bytes.ljust(data_start - _PREAMBLE.size, b" ")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ModelBundle():
+    """A loaded, validated bundle. Arrays and weights are read-only views into the mapped file."""
+
+    def __init__(self, path, verify=True):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._parse(verify)
+        except Exception:
+            self._mmap.close()
+            raise
+
+    def _parse(self, verify):
+        if len(self._mmap) < _PREAMBLE.size:
+            raise BundleError(f"{self.path}: file too short to be a model bundle.")
+        magic, version, header_length = _PREAMBLE.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise BundleError(f"{self.path}: not a model bundle (bad magic).")
+        if version != FORMAT_VERSION:
+            raise BundleError(f"{self.path}: bundle format {version} is not supported (expected {FORMAT_VERSION}).")
+        header = json.loads(bytes(self._mmap[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+        self.header = header
+        self.data_offset = _PREAMBLE.size + header_length
+
+        for name, spec in header["tensors"].items():
+            end = self.data_offset + spec["offset"] + spec["nbytes"]
+            if end > len(self._mmap):
+                raise BundleError(f"{self.path}: tensor {name} runs past the end of the file (truncated?).")
+        if verify:
+            digest = hashlib.sha256(memoryview(self._mmap)[self.data_offset:]).hexdigest()
+            if digest != header["sha256"]:
+                raise BundleError(f"{self.path}: checksum mismatch, the bundle is corrupted.")
+
+        self.classes = header["classes"]
+        self.meanings = header["meanings"]
+        self.input_spec = header["input"]
+        self.model_config = header["model_config"]
+        self.folds = header["folds"]
+        self.fold_index = self.input_spec["fold_index"]
+        self.seq_length = self.input_spec["seq_length"]
+        self.train_means = self.array("norm.train_means")
+        self.train_stds = self.array("norm.train_stds")
+
+        if header.get("architecture") != "CNNBiLSTM":
+            raise BundleError(f"{self.path}: unknown architecture {header.get('architecture')!r}.")
+        if len(self.classes) != self.model_config["n_classes"]:
+            raise BundleError(f"{self.path}: {len(self.classes)} classes but the model has {self.model_config['n_classes']} outputs.")
+        missing = [c for c in self.classes if c not in self.meanings]
+        if missing:
+            raise BundleError(f"{self.path}: no meaning given for classes {missing}.")
+        if self.model_config["seq_length"] != self.seq_length:
+            raise BundleError(f"{self.path}: model seq_length differs from the input spec.")
+        if self.train_means.shape != self.train_stds.shape or self.train_means.ndim != 1:
+            raise BundleError(f"{self.path}: normalization arrays must be 1-D and of equal length.")
+        if not np.all(self.train_stds > 0):
+            raise BundleError(f"{self.path}: normalization stds must be positive.")
+        if self.fold_index not in self.folds or self.fold_index >= len(self.train_means):
+            raise BundleError(f"{self.path}: default fold {self.fold_index} has no weights or statistics.")
+
+    def array(self, name):
+        spec = self.header["tensors"][name]
+        dtype = np.dtype(spec["dtype"])
+        count = spec["nbytes"] // dtype.itemsize
+        array = np.frombuffer(self._mmap, dtype=dtype, count=count, offset=self.data_offset + spec["offset"])
+        return array.reshape(spec["shape"])
+
+    def state_dict(self, fold=None):
+        """Weights of one fold as tensors sharing memory with the mapped file."""
+        fold = self.fold_index if fold is None else fold
+        prefix = f"fold{fold}."
+        state = {}
+        with warnings.catch_warnings():
+            # The mapping is read-only on purpose; inference never writes to weights.
+            warnings.simplefilter("ignore", UserWarning)
+            for name in self.header["tensors"]:
+                if name.startswith(prefix):
+                    state[name[len(prefix):]] = torch.from_numpy(self.array(name))
+        if not state:
+            raise BundleError(f"{self.path}: no weights stored for fold {fold}.")
+        return state
+
+    def build_model(self, fold=None, device=torch.device("cpu")):
+        """Instantiates CNNBiLSTM for a fold. On CPU the parameters stay backed by the shared mapping."""
+        model = CNNBiLSTM(**self.model_config)
+        state = self.state_dict(fold)
+        expected = model.state_dict()
+        if set(state) != set(expected):
+            raise BundleError(f"{self.path}: weights do not match CNNBiLSTM "
+                              f"(missing {sorted(set(expected) - set(state))}, unexpected {sorted(set(state) - set(expected))}).")
+        for key, tensor in state.items():
+            if tuple(tensor.shape) != tuple(expected[key].shape):
+                raise BundleError(f"{self.path}: {key} has shape {tuple(tensor.shape)}, expected {tuple(expected[key].shape)}.")
+        model.load_state_dict(state, assign=True)
+        return model.to(device).eval()
+
+
+def load_bundle(path=DEFAULT_BUNDLE_PATH, verify=True):
+    return ModelBundle(path, verify=verify)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack or inspect ArrythmiX model bundles.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    pack = sub.add_parser("pack", help="Pack weights and normalization stats into one bundle.")
+    pack.add_argument("--weights", default="ml/best_model{fold}.pth", help="Path pattern, {fold} is replaced by the fold index.")
+    pack.add_argument("--folds", type=int, nargs="+", default=[DEFAULT_INPUT_SPEC["fold_index"]])
+    pack.add_argument("--default-fold", type=int, default=None)
+    pack.add_argument("--means", default="ml/train_means.npy")
+    pack.add_argument("--stds", default="ml/train_stds.npy")
+    pack.add_argument("--sample-rate", type=float, default=DEFAULT_INPUT_SPEC["sample_rate_hz"])
+    pack.add_argument("--seq-length", type=int, default=DEFAULT_INPUT_SPEC["seq_length"])
+    pack.add_argument("--out", default=DEFAULT_BUNDLE_PATH)
+
+    inspect = sub.add_parser("inspect", help="Validate a bundle and print its metadata.")
+    inspect.add_argument("path", nargs="?", default=DEFAULT_BUNDLE_PATH)
+
+    args = parser.parse_args()
+    if args.command == "pack":
+        fold_weights = {fold: torch.load(args.weights.format(fold=fold), map_location="cpu") for fold in args.folds}
+        default_fold = args.default_fold if args.default_fold is not None else args.folds[-1]
+        input_spec = {"seq_length": args.seq_length, "sample_rate_hz": args.sample_rate, "fold_index": default_fold}
+        pack_bundle(args.out, fold_weights, np.load(args.means), np.load(args.stds), input_spec=input_spec)
+        load_bundle(args.out).build_model()  # refuse to leave a bundle behind that would not load
+        print(f"Wrote {args.out} (folds {args.folds}, default fold {default_fold}).")
+    else:
+        bundle = load_bundle(args.path)
+        bundle.build_model()
+        print(json.dumps({k: v for k, v in bundle.header.items() if k != "tensors"}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
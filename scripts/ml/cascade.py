@@ -0,0 +1,224 @@
+import argparse
+import json
+
+import numpy as np
+
+from ml.metrics import METRICS
+
+DEFAULT_SCREEN_PATH = 'ml/screen_model.npz'
+NORMAL_CLASS = 'N'
+DEFAULT_THRESHOLD = 0.97     # P(normal) needed to skip the full network
+THRESHOLD_SWEEP = (0.8, 0.9, 0.95, 0.97, 0.98, 0.99, 0.995)
+
+
+def window_features(windows):
+    """
+    Handcrafted morphology features of normalized, resampled windows.
+
+    Args:
+        windows (np.ndarray): (batch, seq_length) windows as fed to CNNBiLSTM.
+
+    Returns:
+        np.ndarray: (batch, n_features) float64.
+    """
+    x = np.asarray(windows, dtype=np.float64)
+    if x.ndim == 1:
+        x = x[np.newaxis, :]
+    n = x.shape[1]
+    mean = x.mean(axis=1)
+    std = x.std(axis=1) + 1e-9
+    z = (x - mean[:, None]) / std[:, None]
+    diff = np.diff(x, axis=1)
+    peak = x.argmax(axis=1)
+    # Width of the main deflection: samples above half of the peak height.
+    half = mean + 0.5 * (x.max(axis=1) - mean)
+    thirds = np.array_split(x - mean[:, None], 3, axis=1)
+    return np.column_stack([
+        mean, std,
+        x.min(axis=1), x.max(axis=1), np.ptp(x, axis=1),
+        peak / n, x.argmin(axis=1) / n,
+        (z ** 3).mean(axis=1), (z ** 4).mean(axis=1),
+        np.abs(diff).mean(axis=1), np.abs(diff).max(axis=1),
+        (x > half[:, None]).mean(axis=1),
+        np.mean(np.diff(np.sign(diff), axis=1) != 0, axis=1),
+        *[(part ** 2).mean(axis=1) for part in thirds],
+    ])
+
+
+class ScreeningModel():
+    """Logistic regression on window_features() estimating P(window is a normal beat)."""
+
+    def __init__(self, feature_mean=None, feature_std=None, weights=None, bias=0.0):
+        self.feature_mean = feature_mean
+        self.feature_std = feature_std
+        self.weights = weights
+        self.bias = bias
+
+    def fit(self, features, is_normal, l2=1e-3, iterations=25):
+        """Fits by iteratively reweighted least squares (Newton's method); a few dozen features converge in ~10 steps."""
+        self.feature_mean = features.mean(axis=0)
+        self.feature_std = features.std(axis=0) + 1e-9
+        f = (features - self.feature_mean) / self.feature_std
+        design = np.column_stack([f, np.ones(len(f))])
+        y = np.asarray(is_normal, dtype=np.float64)
+        theta = np.zeros(design.shape[1])
+        penalty = l2 * np.eye(design.shape[1])
+        penalty[-1, -1] = 0.0
+        for _ in range(iterations):
+            p = 1.0 / (1.0 + np.exp(-design @ theta))
+            w = p * (1.0 - p) + 1e-9
+            gradient = design.T @ (p - y) + penalty @ theta
+            hessian = (design * w[:, None]).T @ design + penalty
+            step = np.linalg.solve(hessian, gradient)
+            theta -= step
+            if np.abs(step).max() < 1e-8:
+                break
+        self.weights, self.bias = theta[:-1], float(theta[-1])
+        return self
+
+    def normal_probability(self, features):
+        f = (features - self.feature_mean) / self.feature_std
+        return 1.0 / (1.0 + np.exp(-(f @ self.weights + self.bias)))
+
+    def save(self, path=DEFAULT_SCREEN_PATH):
+        np.savez(path, feature_mean=self.feature_mean, feature_std=self.feature_std,
+                 weights=self.weights, bias=np.array(self.bias))
+
+    @classmethod
+    def load(cls, path=DEFAULT_SCREEN_PATH):
+        with np.load(path) as data:
+            return cls(data["feature_mean"], data["feature_std"], data["weights"], float(data["bias"]))
+
+
+class CascadeClassifier():
+    """
+    Two-stage classifier: the screening model answers for windows it is confident
+    are normal beats, everything else (uncertain or abnormal) goes to the full
+    CNNBiLSTM. Same interface as predictor (preprocess / predict_proba / get_prediction).
+    """
+
+    def __init__(self, full_predictor, screen, threshold=DEFAULT_THRESHOLD):
+        self.full = full_predictor
+        self.screen = screen
+        self.threshold = threshold
+        self.normal_index = full_predictor.classes.index(NORMAL_CLASS)
+        self.windows = 0
+        self.escalated = 0
+        self.last_escalated = None
+        self.last_probabilities = None
+
+    @property
+    def escalation_rate(self):
+        return self.escalated / self.windows if self.windows else 0.0
+
+    def stats(self):
+        return {"windows": self.windows, "escalated": self.escalated,
+                "escalation_rate": self.escalation_rate, "threshold": self.threshold}
+
+    @property
+    def classes(self):
+        return self.full.classes
+
+    @property
+    def meanings(self):
+        return self.full.meanings
+
+    def preprocess(self, data):
+        return self.full.preprocess(data)
+
+    def predict_proba(self, preprocessed_chunk):
+        """
+        Class probabilities (batch, n_classes) for preprocessed windows. Screened windows get
+        P(normal) from the screening model and share the rest evenly; self.last_escalated
+        holds the mask of windows that went to the full network.
+        """
+        x = preprocessed_chunk
+        p_normal = self.screen.normal_probability(window_features(x[:, 0, :].cpu().numpy()))
+        escalate = p_normal < self.threshold
+        n_classes = len(self.full.classes)
+        probabilities = np.repeat(((1.0 - p_normal) / (n_classes - 1))[:, None], n_classes, axis=1)
+        probabilities[:, self.normal_index] = p_normal
+        if escalate.any():
+            probabilities[escalate] = self.full.predict_proba(x[escalate])
+        self.windows += len(escalate)
+        self.escalated += int(escalate.sum())
+        self.last_escalated = escalate
+        return probabilities
+
+    def get_prediction(self, data):
+        with METRICS.time("preprocess"):
+            x = self.preprocess(data)
+        with METRICS.time("forward"):
+            probabilities = self.predict_proba(x)
+        with METRICS.time("postprocess"):
+            self.last_probabilities = probabilities[0]
+            predicted_class = self.classes[int(probabilities[0].argmax())]
+        return self.meanings[predicted_class]
+
+
+def cascade_report(full_predictor, screen, windows, labels=None, thresholds=THRESHOLD_SWEEP):
+    """
+    Escalation rate and accuracy parity of the cascade at several thresholds.
+
+    Args:
+        full_predictor: ml.runner.predictor.
+        screen (ScreeningModel): Fitted screening model.
+        windows (np.ndarray): (batch, n) raw windows.
+        labels (np.ndarray | None): True class indices; without them parity is measured
+            against the full model's own predictions.
+
+    Returns:
+        list[dict]: One row per threshold.
+    """
+    x = full_predictor.preprocess(windows)
+    full_pred = full_predictor.predict_proba(x).argmax(axis=1)
+    p_normal = screen.normal_probability(window_features(x[:, 0, :].cpu().numpy()))
+    normal_index = full_predictor.classes.index(NORMAL_CLASS)
+    rows = []
+    for threshold in thresholds:
+        escalate = p_normal < threshold
+        pred = np.where(escalate, full_pred, normal_index)
+        row = {
+            "threshold": threshold,
+            "escalation_rate": float(escalate.mean()),
+            "agreement_with_full": float((pred == full_pred).mean()),
+            "expected_cost_vs_full": float(escalate.mean()),  # screening cost is negligible next to the network
+        }
+        if labels is not None:
+            row["accuracy_cascade"] = float((pred == labels).mean())
+            row["accuracy_full"] = float((full_pred == labels).mean())
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fit the cascade screening model and report escalation / parity.")
+    parser.add_argument("windows", help=".npy file of raw windows, shape (n_windows, window_length).")
+    parser.add_argument("--labels", help="Optional .npy of true class indices; otherwise the full model's predictions are the targets.")
+    parser.add_argument("--out", default=DEFAULT_SCREEN_PATH)
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of windows kept out of fitting for the report.")
+    args = parser.parse_args()
+
+    from ml.runner import predictor
+    full = predictor(None)
+    windows = np.load(args.windows)
+    labels = np.load(args.labels) if args.labels else None
+
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(windows))
+    split = int(len(windows) * (1.0 - args.holdout))
+    fit_idx, test_idx = order[:split], order[split:]
+
+    x = full.preprocess(windows[fit_idx])
+    targets = labels[fit_idx] if labels is not None else full.predict_proba(x).argmax(axis=1)
+    features = window_features(x[:, 0, :].cpu().numpy())
+    screen = ScreeningModel().fit(features, targets == full.classes.index(NORMAL_CLASS))
+    screen.save(args.out)
+    print(f"Wrote {args.out}")
+
+    report = cascade_report(full, screen, windows[test_idx], labels[test_idx] if labels is not None else None)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""
+Lossless block codec for ADC-count streams (.arxc).
+
+Samples are split into fixed-size blocks. Each block stores its first sample
+verbatim and the rest as prediction residuals, either first order
+(x[n] - x[n-1]) or second order (x[n] - 2x[n-1] + x[n-2]), whichever needs
+fewer bits. Residuals are zigzag-mapped to unsigned values and bit-packed at
+the block's width. Every block decodes on its own, so any sample range can be
+read by decoding only the blocks that cover it. Layout:
+
+    magic (8 bytes) | format version (u32) | header length (u32) | JSON header
+    | block table (n_blocks x BLOCK_RECORD) | packed payload
+
+Encoding and decoding are vectorized over all blocks with the same bit width.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b"ARXECG\x00\x00"
+FORMAT_VERSION = 1
+BLOCK_SIZE = 128                # samples per block; smaller adapts the width faster, larger amortizes the table
+_PREAMBLE = struct.Struct("<8sII")
+BLOCK_RECORD = np.dtype([("first", "<i8"), ("order", "u1"), ("width", "u1")])
+EXTENSION = ".arxc"
+MAX_MAGNITUDE = 2 ** 60         # second-order residuals reach 4x the sample range and must fit int64
+
+
+class CodecError(ValueError):
+    """Raised for data the codec cannot represent losslessly or a malformed .arxc file."""
+
+
+def _zigzag(r):
+    return ((r << 1) ^ (r >> 63)).astype(np.uint64)
+
+
+def _unzigzag(z):
+    return (z >> np.uint64(1)).astype(np.int64) ^ -(z & np.uint64(1)).astype(np.int64)
+
+
+def _bit_width(values):
+    """Bits needed for the largest value of each row."""
+    peak = values.max(axis=1)
+    widths = np.zeros(len(peak), dtype=np.uint8)
+    nonzero = peak > 0
+    widths[nonzero] = np.floor(np.log2(peak[nonzero].astype(np.float64))).astype(np.uint8) + 1
+    # log2 rounds up just below powers of two for very large values; correct exactly.
+    too_small = nonzero & ((peak >> widths.astype(np.uint64)) > 0)
+    widths[too_small] += 1
+    return widths
+
+
+def _pack(values, width):
+    """(k, m) uint64 -> (k, ceil(m * width / 8)) uint8, little-endian bit order."""
+    k, m = values.shape
+    if width == 0:
+        return np.zeros((k, 0), dtype=np.uint8)
+    n_bytes = (width + 7) // 8
+    raw = values.astype("<u8").view(np.uint8).reshape(k, m, 8)[:, :, :n_bytes]
+    bits = np.unpackbits(raw, axis=2, bitorder="little")[:, :, :width]
+    return np.packbits(bits.reshape(k, m * width), axis=1, bitorder="little")
+
+
+def _unpack(packed, m, width):
+    """Inverse of _pack: (k, n_bytes) uint8 -> (k, m) uint64."""
+    k = packed.shape[0]
+    if width == 0:
+        return np.zeros((k, m), dtype=np.uint64)
+    bits = np.unpackbits(packed, axis=1, count=m * width, bitorder="little").reshape(k, m, width)
+    n_bytes = (width + 7) // 8
+    if width < n_bytes * 8:
+        bits = np.concatenate([bits, np.zeros((k, m, n_bytes * 8 - width), dtype=np.uint8)], axis=2)
+    raw = np.zeros((k, m, 8), dtype=np.uint8)
+    raw[:, :, :n_bytes] = np.packbits(bits, axis=2, bitorder="little")
+    return raw.view("<u8")[:, :, 0]
+
+
+def _payload_bytes(m, widths):
+    return (m * widths.astype(np.int64) + 7) // 8
+
+
+def block_offsets(table, block_size):
+    """Payload offset of every block; derived from the widths so the table stays small."""
+    sizes = _payload_bytes(block_size - 1, table["width"])
+    offsets = np.zeros(len(table), dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)[:-1]
+    return offsets
+
+
+def encode(samples, block_size=BLOCK_SIZE):
+    """
+    Encodes an integer sample stream.
+
+    Args:
+        samples (np.ndarray): 1-D integer samples (e.g. uint16 ADC counts).
+        block_size (int): Samples per independently decodable block.
+
+    Returns:
+        tuple[np.ndarray, bytes]: (block table with BLOCK_RECORD dtype, packed payload).
+    """
+    x = np.asarray(samples)
+    if x.ndim != 1 or x.dtype.kind not in "iu":
+        raise CodecError(f"Only 1-D integer samples can be coded losslessly, got {x.dtype} with shape {x.shape}.")
+    n = x.size
+    if n and (x.max() > MAX_MAGNITUDE or x.min() < -MAX_MAGNITUDE):
+        raise CodecError(f"Samples must lie within +-2**60 so their residuals fit int64, got {x.min()}..{x.max()}.")
+    n_blocks = -(-n // block_size)
+    blocks = np.empty(n_blocks * block_size, dtype=np.int64)
+    blocks[:n] = x
+    blocks[n:] = x[-1] if n else 0      # repeat the last sample: zero residuals
+    blocks = blocks.reshape(n_blocks, block_size)
+
+    d1 = np.diff(blocks, axis=1)
+    d2 = d1.copy()
+    d2[:, 1:] = np.diff(d1, axis=1)     # the first residual of every block is first order
+    z1, z2 = _zigzag(d1), _zigzag(d2)
+    w1, w2 = _bit_width(z1), _bit_width(z2)
+    use_second = w2 < w1
+    residuals = np.where(use_second[:, None], z2, z1)
+    widths = np.where(use_second, w2, w1)
+
+    table = np.zeros(n_blocks, dtype=BLOCK_RECORD)
+    table["first"] = blocks[:, 0]
+    table["order"] = np.where(use_second, 2, 1)
+    table["width"] = widths
+    offsets = block_offsets(table, block_size)
+    payload = np.empty(int(_payload_bytes(block_size - 1, widths).sum()), dtype=np.uint8)
+    for width in np.unique(widths):
+        rows = np.flatnonzero(widths == width)
+        packed = _pack(residuals[rows], int(width))
+        if packed.shape[1]:
+            index = offsets[rows][:, None] + np.arange(packed.shape[1])
+            payload[index] = packed
+    return table, payload.tobytes()
+
+
+def decode_blocks(table, payload, block_size, rows=None, offsets=None):
+    """Decodes the given blocks (all by default) into a (len(rows), block_size) int64 array."""
+    offsets = block_offsets(table, block_size) if offsets is None else offsets
+    rows = np.arange(len(table)) if rows is None else np.asarray(rows)
+    buffer = np.frombuffer(payload, dtype=np.uint8)
+    m = block_size - 1
+    residuals = np.empty((len(rows), m), dtype=np.uint64)
+    widths = table["width"][rows]
+    for width in np.unique(widths):
+        selected = np.flatnonzero(widths == width)
+        n_bytes = int(_payload_bytes(m, np.array([width]))[0])
+        index = offsets[rows[selected]][:, None] + np.arange(n_bytes)
+        residuals[selected] = _unpack(buffer[index], m, int(width))
+    r = _unzigzag(residuals)
+    second = table["order"][rows] == 2
+    r[second] = np.cumsum(r[second], axis=1)     # second-order residuals -> first differences
+    out = np.empty((len(rows), block_size), dtype=np.int64)
+    out[:, 0] = table["first"][rows]
+    out[:, 1:] = r
+    return np.cumsum(out, axis=1)
+
+
+def write_compressed(path, samples, meta=None, block_size=BLOCK_SIZE):
+    """Writes samples (plus Recorder-style metadata) to an .arxc file. Returns the file size."""
+    samples = np.asarray(samples)
+    table, payload = encode(samples, block_size)
+    header = dict(meta or {})
+    header.update({"dtype": samples.dtype.str, "n_samples": int(samples.size),
+                   "block_size": block_size, "n_blocks": len(table)})
+    header_bytes = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        f.write(header_bytes)
+        f.write(table.tobytes())
+        f.write(payload)
+        return f.tell()
+
+
+class CompressedRecording():
+    """
+    Read access to an .arxc file. Slicing decodes only the blocks that cover the range.
+
+    Usage:
+        rec = CompressedRecording("bed-1.arxc")
+        segment = rec[360 * 3600: 360 * 3660]   # one minute, one hour in
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < _PREAMBLE.size:
+            raise CodecError(f"{path} is too short to be a compressed recording.")
+        magic, version, header_length = _PREAMBLE.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise CodecError(f"{path} is not a compressed recording.")
+        if version != FORMAT_VERSION:
+            raise CodecError(f"{path} has format version {version}, expected {FORMAT_VERSION}.")
+        start = _PREAMBLE.size
+        self.meta = json.loads(self._map[start:start + header_length].decode("utf-8"))
+        self.dtype = np.dtype(self.meta["dtype"])
+        self.block_size = self.meta["block_size"]
+        table_start = start + header_length
+        table_end = table_start + self.meta["n_blocks"] * BLOCK_RECORD.itemsize
+        self.table = np.frombuffer(self._map, dtype=BLOCK_RECORD, count=self.meta["n_blocks"], offset=table_start)
+        self.payload = memoryview(self._map)[table_end:]
+        self.offsets = block_offsets(self.table, self.block_size)
+
+    def __len__(self):
+        return self.meta["n_samples"]
+
+    def read(self, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        if start >= stop:
+            return np.zeros(0, dtype=self.dtype)
+        first, last = start // self.block_size, (stop - 1) // self.block_size
+        blocks = decode_blocks(self.table, self.payload, self.block_size, np.arange(first, last + 1), self.offsets)
+        offset = first * self.block_size
+        return blocks.ravel()[start - offset:stop - offset].astype(self.dtype)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("CompressedRecording supports contiguous slices only.")
+        start, stop, _ = key.indices(len(self))
+        return self.read(start, stop)
+
+    def close(self):
+        self.payload.release()
+        self.table = None
+        self._map.close()
+
+
+def benchmark(samples, block_size=BLOCK_SIZE, repeats=5):
+    """Compression ratio and encode/decode throughput (MB/s of raw samples) for one stream."""
+    samples = np.asarray(samples)
+    raw_bytes = samples.nbytes
+    start = time.perf_counter()
+    for _ in range(repeats):
+        table, payload = encode(samples, block_size)
+    encode_s = (time.perf_counter() - start) / repeats
+    start = time.perf_counter()
+    for _ in range(repeats):
+        decoded = decode_blocks(table, payload, block_size).ravel()[:samples.size]
+    decode_s = (time.perf_counter() - start) / repeats
+    if not np.array_equal(decoded, samples.astype(np.int64)):
+        raise CodecError("Round trip mismatch.")
+    compressed = len(payload) + table.nbytes
+    return {
+        "samples": int(samples.size),
+        "raw_bytes": raw_bytes,
+        "compressed_bytes": compressed,
+        "ratio": raw_bytes / compressed if compressed else float("inf"),
+        "bits_per_sample": 8 * compressed / max(samples.size, 1),
+        "encode_mb_s": raw_bytes / encode_s / 1e6,
+        "decode_mb_s": raw_bytes / decode_s / 1e6,
+    }
+
+
+def main():
+    from ml.recordings import open_recording
+
+    parser = argparse.ArgumentParser(description="Lossless compression of raw ADC recordings.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compress = sub.add_parser("compress", help="Recorder .raw file -> .arxc")
+    compress.add_argument("path")
+    compress.add_argument("--out")
+    compress.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    decompress = sub.add_parser("decompress", help=".arxc -> Recorder .raw file (+ .json)")
+    decompress.add_argument("path")
+    decompress.add_argument("--out")
+    decompress.add_argument("--force", action="store_true", help="Overwrite an existing .raw / .json at the default path.")
+    bench = sub.add_parser("bench", help="Report ratio and throughput for a .raw recording.")
+    bench.add_argument("path")
+    bench.add_argument("--block-size", type=int, default=BLOCK_SIZE)
+    args = parser.parse_args()
+
+    if args.command == "compress":
+        samples, meta = open_recording(args.path)
+        out = args.out or os.path.splitext(args.path)[0] + EXTENSION
+        size = write_compressed(out, samples, meta, args.block_size)
+        print(f"Wrote {out}: {samples.nbytes} -> {size} bytes ({samples.nbytes / max(size, 1):.2f}x)")
+    elif args.command == "decompress":
+        out = args.out or os.path.splitext(args.path)[0] + ".raw"
+        existing = [path for path in (out, out + ".json") if os.path.exists(path)]
+        if existing and not (args.out or args.force):
+            # The default target is the recording the .arxc was made from.
+            raise SystemExit(f"Refusing to overwrite {', '.join(existing)}; pass --out or --force.")
+        recording = CompressedRecording(args.path)
+        recording.read().tofile(out)
+        meta = {k: v for k, v in recording.meta.items() if k not in ("n_samples", "block_size", "n_blocks")}
+        with open(out + ".json", "w") as f:
+            json.dump(meta, f, indent=2)
+        print(f"Wrote {out} ({len(recording)} samples)")
+        recording.close()
+    else:
+        samples, _ = open_recording(args.path)
+        print(json.dumps(benchmark(np.asarray(samples), args.block_size), indent=2))
+
+
+if __name__ == "__main__":
+    main()
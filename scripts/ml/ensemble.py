@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from scipy.signal import resample_poly
+from torch.func import stack_module_state
+
+from ml.BILSTM import CNNBiLSTM
+from ml.bundle import DEFAULT_BUNDLE_PATH, DEFAULT_CLASSES, DEFAULT_MEANINGS, load_bundle
+from ml.metrics import METRICS
+
+DEFAULT_WEIGHTS_PATTERN = 'ml/best_model{fold}.pth'
+SERIAL_MIN_BATCH = 2            # from this batch size up the fold models run one by one; live inference is
+                                # batch 1, and where the stacked path stops paying varies by CPU (`bench`)
+
+
+def _conv_block(x, params, buffers, name, k):
+    """Grouped conv + eval-mode batch norm + relu + pool for K folds at once. x: (B, K*C_in, L)."""
+    weight = params[f"conv{name}.weight"]            # (K, C_out, C_in, W)
+    x = F.conv1d(x, weight.flatten(0, 1), params[f"conv{name}.bias"].flatten(),
+                 padding=weight.shape[-1] // 2, groups=k)
+    x = F.batch_norm(x, buffers[f"bn{name}.running_mean"].flatten(), buffers[f"bn{name}.running_var"].flatten(),
+                     params[f"bn{name}.weight"].flatten(), params[f"bn{name}.bias"].flatten(), training=False)
+    return F.max_pool1d(F.relu(x), 2, stride=2)
+
+
+def _fold_lstms(x, lstms):
+    """
+    Each fold's own nn.LSTM on its slice of the stack. x: (K, B, T, I) -> (K, B, T, 2H)
+
+    The recurrence stays in the fused ATen kernel per fold: a Python loop over time
+    steps with the folds batched, or one block-diagonal LSTM over all folds, both
+    measured no faster than K fused calls on CPU. Each fold has its own weights, so
+    stacking saves no weight traffic, which is what the small recurrence is bound by.
+    """
+    return torch.stack([lstm(fold)[0] for lstm, fold in zip(lstms, x)])
+
+
+def _stacked_attention(x, params, num_heads):
+    """Self-attention of nn.MultiheadAttention (eval) for K folds. x: (K, B, T, E)."""
+    k, b, t, e = x.shape
+    qkv = torch.einsum("kbte,kfe->kbtf", x, params["attention.in_proj_weight"]) + params["attention.in_proj_bias"][:, None, None, :]
+    q, key, v = (part.reshape(k, b, t, num_heads, e // num_heads).transpose(2, 3) for part in qkv.chunk(3, dim=-1))
+    attn = F.scaled_dot_product_attention(q, key, v)                          # (K, B, heads, T, d)
+    attn = attn.transpose(2, 3).reshape(k, b, t, e)
+    return torch.einsum("kbte,kfe->kbtf", attn, params["attention.out_proj.weight"]) + params["attention.out_proj.bias"][:, None, None, :]
+
+
+def _linear(x, params, name):
+    return torch.einsum("kbi,koi->kbo", x, params[f"{name}.weight"]) + params[f"{name}.bias"][:, None, :]
+
+
+class FoldEnsemble():
+    """
+    All cross-validation folds of CNNBiLSTM evaluated as one batched computation.
+
+    Parameters of the K fold models are stacked with torch.func.stack_module_state
+    and run through grouped convolutions and batched attention; the LSTM runs
+    per fold in its fused kernel. That saves per-kernel overhead for the single
+    windows of live inference; from SERIAL_MIN_BATCH windows up the fold models
+    simply run one after another. Each fold gets its own normalization in the
+    same vectorized preprocessing step. Exposes the same get_prediction() as
+    predictor. `python -m ml.ensemble bench` compares the two per batch size.
+    """
+
+    def __init__(self, models, train_means, train_stds, folds, classes=DEFAULT_CLASSES,
+                 meanings=DEFAULT_MEANINGS, device=torch.device("cpu")):
+        if len(models) != len(folds):
+            raise ValueError("Need one model per fold.")
+        for model in models:
+            model.eval()
+        reference = models[0]
+        self.seq_length = reference.seq_length
+        self.num_heads = reference.attention.num_heads
+        self.n_conv = len(reference.conv_channels)
+        self.n_fc = len(reference.fc_sizes) + 1
+        self.folds = list(folds)
+        self.classes = list(classes)
+        self.meanings = dict(meanings)
+        self.device = device
+        params, buffers = stack_module_state(models)
+        self.params = {name: p.detach().to(device) for name, p in params.items()}
+        self.buffers = {name: b.to(device) for name, b in buffers.items()}
+        self.models = [model.to(device) for model in models]
+        self.lstms = [model.lstm for model in self.models]
+        self.means = torch.tensor(np.asarray(train_means, dtype=np.float64)[self.folds], dtype=torch.float32, device=device)
+        self.stds = torch.tensor(np.asarray(train_stds, dtype=np.float64)[self.folds], dtype=torch.float32, device=device)
+        self.last_disagreement = None
+        self.last_probabilities = None
+
+    @classmethod
+    def from_bundle(cls, bundle, device=torch.device("cpu")):
+        models = [bundle.build_model(fold) for fold in bundle.folds]
+        return cls(models, bundle.train_means, bundle.train_stds, bundle.folds,
+                   bundle.classes, bundle.meanings, device=device)
+
+    @classmethod
+    def from_files(cls, weights_pattern=DEFAULT_WEIGHTS_PATTERN, means_path="ml/train_means.npy",
+                   stds_path="ml/train_stds.npy", folds=None, device=torch.device("cpu")):
+        train_means, train_stds = np.load(means_path), np.load(stds_path)
+        if folds is None:
+            folds = [fold for fold in range(len(train_means)) if os.path.exists(weights_pattern.format(fold=fold))]
+        models = []
+        for fold in folds:
+            model = CNNBiLSTM(input_channels=1, seq_length=171, n_classes=len(DEFAULT_CLASSES))
+            model.load_state_dict(torch.load(weights_pattern.format(fold=fold), map_location="cpu"))
+            models.append(model)
+        return cls(models, train_means, train_stds, folds, device=device)
+
+    @classmethod
+    def load(cls, device=torch.device("cpu")):
+        """The bundle when it holds several folds, else every ml/best_model{k}.pth that exists."""
+        if os.path.exists(DEFAULT_BUNDLE_PATH):
+            bundle = load_bundle(DEFAULT_BUNDLE_PATH)
+            if len(bundle.folds) > 1:
+                return cls.from_bundle(bundle, device=device)
+        return cls.from_files(device=device)
+
+    def preprocess(self, chunk):
+        """(B, n) or (n,) raw windows -> (K, B, 1, seq_length), each fold with its own normalization."""
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.ndim == 1:
+            chunk = chunk[np.newaxis, :]
+        if chunk.shape[-1] != self.seq_length:
+            chunk = resample_poly(chunk, up=self.seq_length, down=chunk.shape[-1], axis=-1)
+        x = torch.as_tensor(chunk, dtype=torch.float32, device=self.device)
+        x = (x[np.newaxis] - self.means[:, None, None]) / self.stds[:, None, None]
+        return x[:, :, np.newaxis, :]
+
+    def forward(self, x):
+        """(K, B, 1, L) normalized windows -> (K, B, n_classes) logits."""
+        if x.shape[1] >= SERIAL_MIN_BATCH:
+            # Larger batches already fill the kernels; stacking the folds only adds copies.
+            return self.forward_serial(x)
+        return self.forward_stacked(x)
+
+    def forward_stacked(self, x):
+        """Same as forward(), the folds stacked into grouped / batched kernels."""
+        k, b = x.shape[0], x.shape[1]
+        p, buf = self.params, self.buffers
+        h = x.permute(1, 0, 2, 3).reshape(b, k, -1)                          # (B, K*1, L)
+        for i in range(1, self.n_conv + 1):
+            h = _conv_block(h, p, buf, str(i), k)
+        h = h.reshape(b, k, -1, h.shape[-1]).permute(1, 0, 3, 2)             # (K, B, T, C)
+        h = _fold_lstms(h, self.lstms)
+        h = _stacked_attention(h, p, self.num_heads).mean(dim=2)             # (K, B, E)
+        for i in range(1, self.n_fc):
+            h = F.relu(_linear(h, p, f"fc{i}"))
+        return _linear(h, p, f"fc{self.n_fc}")
+
+    def forward_serial(self, x):
+        """Same as forward(), one fold model after another."""
+        return torch.stack([model(fold) for model, fold in zip(self.models, x)])
+
+    def predict_proba(self, data):
+        """
+        Returns:
+            tuple[np.ndarray, dict]: averaged probabilities (B, n_classes) and per-window
+            disagreement scores: `vote` (share of folds not voting for the ensemble class),
+            `js` (Jensen-Shannon divergence of the fold distributions, in nats) and
+            `spread` (std of the winning class probability across folds).
+        """
+        with METRICS.time("preprocess"):
+            x = self.preprocess(data)
+        with METRICS.time("forward"), torch.no_grad():
+            fold_probs = torch.softmax(self.forward(x), dim=-1)              # (K, B, C)
+        with METRICS.time("postprocess"):
+            mean = fold_probs.mean(dim=0)
+            winner = mean.argmax(dim=-1)
+            votes = fold_probs.argmax(dim=-1)
+            vote = 1.0 - (votes == winner[None]).float().mean(dim=0)
+            entropy = lambda q: -(q * torch.log(q.clamp_min(1e-12))).sum(dim=-1)
+            js = entropy(mean) - entropy(fold_probs).mean(dim=0)
+            spread = fold_probs.gather(-1, winner[None, :, None].expand(fold_probs.shape[0], -1, 1)).squeeze(-1).std(dim=0, unbiased=False)
+            disagreement = {"vote": vote.cpu().numpy(), "js": js.cpu().numpy(), "spread": spread.cpu().numpy()}
+        return mean.cpu().numpy(), disagreement
+
+    def get_prediction(self, data):
+        probs, disagreement = self.predict_proba(data)
+        self.last_disagreement = {key: float(value[0]) for key, value in disagreement.items()}
+        self.last_probabilities = probs[0]
+        return self.meanings[self.classes[int(probs[0].argmax())]]
+
+
+def benchmark(ensemble, batch_sizes=(1, 64), repeats=20):
+    """
+    Median forward latency (ms) of the stacked folds against running the fold models
+    one after another on the same preprocessed input, per batch size. The two are
+    timed alternately so neither gets the warmer caches. Raises ValueError if they
+    disagree; with identical fold weights the comparison says nothing, so that too
+    raises.
+    """
+    if len(ensemble.models) > 1 and all(torch.equal(weight[0], other) for weight in ensemble.params.values()
+                                        for other in weight[1:]):
+        raise ValueError("All folds have the same weights; benchmark with the trained folds.")
+    results = []
+    for batch in batch_sizes:
+        x = ensemble.preprocess(np.random.default_rng(0).normal(1000.0, 100.0, (batch, ensemble.seq_length)))
+        runs = {"serial_ms": lambda: ensemble.forward_serial(x), "stacked_ms": lambda: ensemble.forward_stacked(x)}
+        timings = {name: [] for name in runs}
+        with torch.no_grad():
+            if not torch.allclose(runs["stacked_ms"](), runs["serial_ms"](), atol=1e-4):
+                raise ValueError("Stacked and serial fold outputs differ.")
+            for i in range(repeats):
+                for name in (list(runs) if i % 2 else list(runs)[::-1]):
+                    start = time.perf_counter()
+                    runs[name]()
+                    timings[name].append((time.perf_counter() - start) * 1e3)
+        timings = {name: float(np.median(values)) for name, values in timings.items()}
+        results.append({"batch": batch, "folds": len(ensemble.folds), **timings,
+                        "speedup": timings["serial_ms"] / timings["stacked_ms"]})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-fold ensemble inference.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bench = sub.add_parser("bench", help="Stacked fold forward pass vs. the fold models run one by one.")
+    bench.add_argument("--batch", type=int, nargs="+", default=[1, 64])
+    bench.add_argument("--repeats", type=int, default=20)
+    bench.add_argument("--threads", type=int, help="torch intra-op threads (default: torch's)")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    print(json.dumps(benchmark(FoldEnsemble.load(), args.batch, args.repeats), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,363 @@
+"""
+Accuracy evaluation and regression gate for the deployed classifier.
+
+Runs an inference backend over a labelled reference set (the window cache of
+ml.train, built once from WFDB / EDF records and their beat annotations) in
+large batches across worker processes, and scores it with ml.scores:
+confusion matrix, per-class precision / recall / F1 for N, L, R, A, V, / and
+macro / weighted F1.
+
+Backends go through the same preprocess + predict_proba the live path uses:
+
+    runner                  ml.runner.predictor (bundle or best_model{k}.pth)
+    ensemble                ml.ensemble.FoldEnsemble
+    cascade:<screen.npz>    ml.cascade.CascadeClassifier in front of runner
+    package.module:factory  anything else (quantized, exported, ...); factory()
+                            returns an object with classes, preprocess() and predict_proba()
+
+With --live the reference windows are first played back to back as one stream
+at the device rate through ingest.Session (timing, resampling to TARGET_HZ,
+filter bank), and the windows the Session hands out are scored, so changes to
+the live ingest chain are gated too.
+
+A run can be stored as a baseline (scores, confusion matrix and every window's
+prediction) and later runs are compared against it with TOLERANCES; any drop
+beyond them, or a changed reference set, exits with status 1. A change to
+preprocessing or the inference backend ships only if this passes.
+
+Usage:
+    python -m ml.evaluate data/mitdb --update-baseline
+    python -m ml.evaluate data/mitdb --backend mypkg.quant:build --processes 8
+    python -m ml.evaluate ml/window_cache --plot images/confmatrix.png
+    python -m ml.evaluate ml/window_cache --live --device-hz 414.1
+"""
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import time
+from multiprocessing import get_context
+
+import numpy as np
+
+from ml.scores import confusion_matrix, format_confusion, format_scores, per_class_scores
+from ml.timing import FRAME_SAMPLES, NOMINAL_DEVICE_HZ, TARGET_HZ
+
+# === Configuration ===
+DEFAULT_BASELINE_PATH = "ml/eval_baseline.json"
+TASK_WINDOWS = 8192             # windows per task handed to a worker process
+BATCH_WINDOWS = 1024            # windows per predict_proba call inside a task
+MIN_SUPPORT = 50                # classes with fewer reference beats are reported but not gated
+TOLERANCES = {
+    "accuracy": 0.002,          # absolute drops allowed against the baseline
+    "macro_f1": 0.005,
+    "class_f1": 0.02,
+    "changed": 0.01,            # share of windows whose predicted class differs from the baseline
+}
+
+
+def load_backend(spec):
+    """Builds the backend named by `spec` (see the module docstring)."""
+    name, _, argument = spec.partition(":")
+    if name == "runner":
+        from ml.runner import predictor
+        return predictor(None)
+    if name == "ensemble":
+        from ml.ensemble import FoldEnsemble
+        return FoldEnsemble.load()
+    if name == "cascade":
+        from ml.cascade import CascadeClassifier, ScreeningModel
+        from ml.runner import predictor
+        return CascadeClassifier(predictor(None), ScreeningModel.load(argument) if argument else ScreeningModel.load())
+    if not argument:
+        raise ValueError(f"Unknown backend {spec!r}; use runner, ensemble, cascade[:path] or package.module:factory.")
+    return getattr(importlib.import_module(name), argument)()
+
+
+def predict_proba(backend, windows):
+    """(B, n_classes) probabilities for raw windows."""
+    from ml.ensemble import FoldEnsemble
+    if isinstance(backend, FoldEnsemble):
+        return backend.predict_proba(windows)[0]      # preprocesses itself and adds disagreement scores
+    return np.asarray(backend.predict_proba(backend.preprocess(windows)))
+
+
+def replay_through_session(windows, device_hz=NOMINAL_DEVICE_HZ, filter_config=None):
+    """
+    The windows as the live path sees them. They are concatenated into one stream at
+    TARGET_HZ, resampled to `device_hz`, fed to an ingest.Session in device-sized frames
+    timestamped at that rate, and the Session's output is cut back at the same positions.
+
+    Args:
+        windows (np.ndarray): (B, n) windows at TARGET_HZ.
+        device_hz (float): Rate the stream is played at, like the device's ADC.
+        filter_config (dict | None): The Session's filter bank (the daemon's "filter").
+
+    Returns:
+        np.ndarray: (B, n) windows from the Session.
+    """
+    from fractions import Fraction
+    from scipy.signal import resample_poly
+    from ingest import Session
+
+    windows = np.asarray(windows, dtype=np.float64)
+    n_windows, length = windows.shape
+    ratio = Fraction(device_hz / TARGET_HZ).limit_denominator(1000)
+    stream = resample_poly(windows.ravel(), ratio.numerator, ratio.denominator)
+    # Hold the last value for a few frames so the resampler's look-ahead covers the last window.
+    stream = np.concatenate([stream, np.full(4 * FRAME_SAMPLES, stream[-1])])
+    session = Session("evaluate", nominal_hz=device_hz, filter_config=filter_config,
+                      window_size=int(np.ceil(stream.size * TARGET_HZ / device_hz)) + FRAME_SAMPLES,
+                      trigger_samples=len(stream))
+    for start in range(0, stream.size - FRAME_SAMPLES + 1, FRAME_SAMPLES):
+        session.on_frame(stream[start:start + FRAME_SAMPLES], arrival=start / device_hz)
+    output = np.array(session.window)
+    if output.size < n_windows * length:
+        raise ValueError(f"Session produced {output.size} samples for {n_windows * length}.")
+    return output[:n_windows * length].reshape(n_windows, length)
+
+
+# --- Worker processes ---
+
+_worker = {}
+
+
+def _init_worker(spec, cache, classes, threads, bundle, live):
+    import torch
+    torch.set_num_threads(threads)
+    if bundle:
+        os.environ["ARRYTHMIX_BUNDLE"] = bundle       # read by ml.runner at import
+    backend = load_backend(spec)
+    missing = [cls for cls in backend.classes if cls not in classes]
+    if missing:
+        raise ValueError(f"Backend classes {missing} are not in the reference set {classes}.")
+    _worker.update(backend=backend, cache=cache, live=live,
+                   lookup=np.array([classes.index(cls) for cls in backend.classes], dtype=np.int8))
+
+
+def _predict_task(rows):
+    backend, cache, lookup = _worker["backend"], _worker["cache"], _worker["lookup"]
+    predicted = np.empty(len(rows), dtype=np.int8)
+    for i in range(0, len(rows), BATCH_WINDOWS):
+        windows = np.asarray(cache.windows[rows[i:i + BATCH_WINDOWS]], dtype=np.float64)
+        if _worker["live"] is not None:
+            windows = replay_through_session(windows, **_worker["live"])
+        predicted[i:i + BATCH_WINDOWS] = lookup[predict_proba(backend, windows).argmax(axis=1)]
+    return predicted
+
+
+def run_backend(cache, rows, spec="runner", processes=None, threads=1, bundle=None, live=None):
+    """
+    Predicted class indices (in the cache's class order) for `rows` of the cache.
+
+    Args:
+        cache (ml.train.WindowCache): Reference windows and labels.
+        rows (np.ndarray): Sorted window indices to evaluate.
+        spec (str): Backend (see load_backend).
+        processes (int | None): Worker processes (default: one per core, see ml.threads).
+        threads (int): torch intra-op threads per process.
+        bundle (str | None): Model bundle for the runner backends.
+        live (dict | None): replay_through_session kwargs to score the live Session's windows.
+    """
+    from ml.threads import available_cores
+    processes = processes or max(1, len(available_cores()) // threads)
+    tasks = [rows[i:i + TASK_WINDOWS] for i in range(0, len(rows), TASK_WINDOWS)]
+    processes = min(processes, len(tasks)) or 1
+    # spawn: the workers build torch models, which must not inherit a forked OpenMP state
+    with get_context("spawn").Pool(processes, _init_worker, (spec, cache, list(cache.classes), threads, bundle, live)) as pool:
+        return np.concatenate(list(pool.imap(_predict_task, tasks))) if tasks else np.zeros(0, dtype=np.int8)
+
+
+# --- Baseline ---
+
+def reference_description(cache, rows, fold=None):
+    """What was evaluated; a baseline only applies to the same reference windows."""
+    digest = hashlib.sha1()
+    for record in cache.meta["records"]:
+        digest.update(f"{os.path.basename(record['path'])}:{record['size']}".encode("utf-8"))
+    digest.update(rows.tobytes())
+    return {"classes": list(cache.classes), "windows": int(len(rows)), "records": len(cache.meta["records"]),
+            "seq_length": cache.seq_length, "fold": fold, "digest": digest.hexdigest()}
+
+
+def _predictions_path(path):
+    return os.path.splitext(path)[0] + ".predictions.npy"
+
+
+def save_baseline(path, result, predictions):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(result, f, indent=2)
+    np.save(_predictions_path(path), predictions)
+
+
+def load_baseline(path):
+    with open(path, "r") as f:
+        baseline = json.load(f)
+    predictions_path = _predictions_path(path)
+    predictions = np.load(predictions_path) if os.path.exists(predictions_path) else None
+    return baseline, predictions
+
+
+def compare(result, baseline, predictions=None, baseline_predictions=None, tolerances=TOLERANCES,
+            min_support=MIN_SUPPORT):
+    """
+    Checks a run against a baseline.
+
+    Returns:
+        tuple[list[str], list[str]]: (regressions, notes). Any regression fails the gate.
+    """
+    regressions, notes = [], []
+    if result["reference"] != baseline["reference"]:
+        regressions.append("reference set differs from the baseline's; rebuild the baseline on purpose "
+                           "(--update-baseline) if the change is intended")
+        return regressions, notes
+    scores, base = result["scores"], baseline["scores"]
+    for key in ("accuracy", "macro_f1"):
+        delta = scores[key] - base[key]
+        line = f"{key} {base[key]:.4f} -> {scores[key]:.4f} ({delta:+.4f}, tolerance -{tolerances[key]})"
+        (regressions if delta < -tolerances[key] else notes).append(line)
+    for cls, row in scores["classes"].items():
+        before = base["classes"][cls]
+        delta = row["f1"] - before["f1"]
+        if before["support"] < min_support:
+            if delta:
+                notes.append(f"class {cls} F1 {delta:+.4f} (support {before['support']} < {min_support}, not gated)")
+            continue
+        if delta < -tolerances["class_f1"]:
+            regressions.append(f"class {cls} F1 {before['f1']:.4f} -> {row['f1']:.4f} ({delta:+.4f}, "
+                               f"tolerance -{tolerances['class_f1']})")
+    if predictions is not None and baseline_predictions is not None:
+        changed = float((predictions != baseline_predictions).mean()) if len(predictions) else 0.0
+        line = f"{changed:.4%} of windows changed class (tolerance {tolerances['changed']:.2%})"
+        (regressions if changed > tolerances["changed"] else notes).append(line)
+    return regressions, notes
+
+
+def plot_confusion(matrix, classes, path, title=None):
+    """Row-normalized confusion matrix heatmap with counts, like images/confmatrix.png."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    matrix = np.asarray(matrix)
+    rates = matrix / np.maximum(matrix.sum(axis=1, keepdims=True), 1)
+    fig, ax = plt.subplots(figsize=(7, 6))
+    image = ax.imshow(rates, cmap="Blues", vmin=0.0, vmax=1.0)
+    fig.colorbar(image, ax=ax)
+    ax.set_xticks(range(len(classes)), classes)
+    ax.set_yticks(range(len(classes)), classes)
+    ax.set_xlabel("Predicted")
+    ax.set_ylabel("True")
+    for i in range(len(classes)):
+        for j in range(len(classes)):
+            ax.text(j, i, f"{matrix[i, j]}\n{rates[i, j]:.2f}", ha="center", va="center", fontsize=8,
+                    color="white" if rates[i, j] > 0.5 else "black")
+    if title:
+        ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+def evaluate(cache, rows, spec="runner", processes=None, threads=1, bundle=None, fold=None, live=None):
+    """
+    Returns:
+        tuple[dict, np.ndarray]: The run (backend, reference, scores, confusion matrix, throughput)
+        and the predicted class index of every evaluated window.
+    """
+    start = time.perf_counter()
+    predictions = run_backend(cache, rows, spec, processes, threads, bundle, live)
+    elapsed = time.perf_counter() - start
+    matrix = confusion_matrix(cache.labels[rows], predictions, len(cache.classes))
+    result = {
+        "backend": spec,
+        "bundle": bundle,
+        "live": live,
+        "reference": reference_description(cache, rows, fold),
+        "scores": per_class_scores(matrix, cache.classes),
+        "confusion": matrix.tolist(),
+        "seconds": elapsed,
+        "windows_per_s": len(rows) / elapsed if elapsed else 0.0,
+    }
+    return result, predictions
+
+
+def _parse_tolerances(values):
+    tolerances = dict(TOLERANCES)
+    for value in values or []:
+        key, _, number = value.partition("=")
+        if key not in tolerances:
+            raise ValueError(f"Unknown tolerance {key!r}; choose from {sorted(tolerances)}.")
+        tolerances[key] = float(number)
+    return tolerances
+
+
+def main():
+    from ml.train import DEFAULT_CACHE_DIR, N_FOLDS, WindowCache, assign_folds, build_cache
+
+    parser = argparse.ArgumentParser(description="Score a classifier backend on a labelled reference set and gate regressions.")
+    parser.add_argument("reference", nargs="+", help="Labelled records / directories (see ml.train) or an existing window cache directory.")
+    parser.add_argument("--backend", default="runner", help="runner, ensemble, cascade[:screen.npz] or package.module:factory.")
+    parser.add_argument("--bundle", help="Model bundle for the runner backends (default: ARRYTHMIX_BUNDLE / ml/arrythmix_model.arxb).")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--fold", type=int, help="Only evaluate this held-out fold (same split as ml.train).")
+    parser.add_argument("--n-folds", type=int, default=N_FOLDS)
+    parser.add_argument("--by-record", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: one per core).")
+    parser.add_argument("--threads", type=int, default=1, help="torch threads per worker process.")
+    parser.add_argument("--live", action="store_true",
+                        help="Score the windows an ingest.Session makes of the reference stream (see replay_through_session).")
+    parser.add_argument("--device-hz", type=float, default=NOMINAL_DEVICE_HZ, help="Rate the stream is played at with --live.")
+    parser.add_argument("--filter", type=json.loads, default={},
+                        help='Session filter bank with --live, as JSON like the daemon\'s "filter" (null disables).')
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline.")
+    parser.add_argument("--tolerance", action="append", metavar="KEY=VALUE",
+                        help=f"Override a tolerance, e.g. macro_f1=0.01 (defaults {TOLERANCES}).")
+    parser.add_argument("--plot", help="Also write the confusion matrix as an image.")
+    parser.add_argument("--out", help="Write the run as JSON.")
+    args = parser.parse_args()
+
+    tolerances = _parse_tolerances(args.tolerance)
+    if len(args.reference) == 1 and os.path.exists(os.path.join(args.reference[0], "meta.json")):
+        cache = WindowCache(args.reference[0])
+    else:
+        cache = build_cache(args.reference, args.cache_dir)
+    rows = np.arange(len(cache))
+    if args.fold is not None:
+        rows = np.flatnonzero(assign_folds(cache, args.n_folds, args.by_record, args.seed) == args.fold)
+
+    live = {"device_hz": args.device_hz, "filter_config": args.filter} if args.live else None
+    result, predictions = evaluate(cache, rows, args.backend, args.processes, args.threads, args.bundle, args.fold, live)
+    print(f"{args.backend}{' (live Session)' if live else ''}: {len(rows)} windows in {result['seconds']:.1f} s ({result['windows_per_s']:.0f}/s)")
+    print(format_scores(result["scores"]))
+    print(format_confusion(result["confusion"], cache.classes))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.plot:
+        plot_confusion(result["confusion"], cache.classes, args.plot,
+                       title=f"{args.backend}, macro F1 {result['scores']['macro_f1']:.4f}")
+
+    if args.update_baseline:
+        save_baseline(args.baseline, result, predictions)
+        print(f"Baseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+        return
+    baseline, baseline_predictions = load_baseline(args.baseline)
+    regressions, notes = compare(result, baseline, predictions, baseline_predictions, tolerances)
+    for line in notes:
+        print(f"  ok    {line}")
+    for line in regressions:
+        print(f"  FAIL  {line}")
+    if regressions:
+        raise SystemExit(1)
+    print(f"No regression against {args.baseline} ({baseline['backend']}).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Persistent store for per-window classifications and arrhythmia episodes.
+
+An embedded SQLite database (WAL mode, so queries never wait for the writer)
+with two tables:
+
+    windows   one row per classified window: patient, wall time, class,
+              probability, and the sample range in the patient's recording
+    episodes  consecutive windows of the same class merged into one row with
+              start/end time and the sample range of the whole run
+
+Both are indexed by (patient, time) and (class, time). record() only appends
+to a queue; a writer thread inserts in batches, one transaction per batch.
+Episodes still in progress live in the writing process until they close, so
+only that process's queries (e.g. the daemon's /episodes) include them.
+"""
+import argparse
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+from ml.metrics import METRICS
+
+# === Configuration ===
+DEFAULT_EVENTS_PATH = "recordings/events.sqlite"
+MERGE_GAP_S = 5.0           # windows of the same class closer than this belong to one episode
+BATCH_SIZE = 2000           # rows per transaction
+FLUSH_INTERVAL = 1.0        # seconds; pending rows are written at least this often
+QUEUE_SIZE = 100000         # rows buffered before record() starts dropping
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS windows (
+    id INTEGER PRIMARY KEY,
+    patient TEXT NOT NULL,
+    time REAL NOT NULL,
+    class TEXT NOT NULL,
+    probability REAL,
+    recording TEXT,
+    start_offset INTEGER,
+    end_offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS windows_patient_time ON windows (patient, time);
+CREATE INDEX IF NOT EXISTS windows_class_time ON windows (class, time);
+CREATE TABLE IF NOT EXISTS episodes (
+    id INTEGER PRIMARY KEY,
+    patient TEXT NOT NULL,
+    class TEXT NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL,
+    windows INTEGER NOT NULL,
+    max_probability REAL,
+    recording TEXT,
+    start_offset INTEGER,
+    end_offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS episodes_patient_class_time ON episodes (patient, class, start_time);
+CREATE INDEX IF NOT EXISTS episodes_class_time ON episodes (class, start_time);
+-- episodes(since=...) selects on end_time: an episode that started earlier may still overlap.
+CREATE INDEX IF NOT EXISTS episodes_patient_end_time ON episodes (patient, end_time);
+CREATE INDEX IF NOT EXISTS episodes_class_end_time ON episodes (class, end_time);
+CREATE INDEX IF NOT EXISTS episodes_end_time ON episodes (end_time);
+"""
+_EPISODE_COLUMNS = ("patient", "class", "start_time", "end_time", "windows", "max_probability",
+                    "recording", "start_offset", "end_offset")
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class EventStore():
+    """
+    Usage:
+        store = EventStore("recordings/events.sqlite")
+        store.record("bed-1", time.time(), "V", 0.93, recording="bed-1/....raw", start_offset=s, end_offset=e)
+        store.episodes(patient="bed-1", cls="V", since=time.time() - 86400)
+        store.close()
+    """
+
+    def __init__(self, path=DEFAULT_EVENTS_PATH, merge_gap_s=MERGE_GAP_S, batch_size=BATCH_SIZE,
+                 flush_interval=FLUSH_INTERVAL, queue_size=QUEUE_SIZE):
+        self.path = path
+        self.merge_gap_s = merge_gap_s
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.open_episodes = {}         # patient -> episode dict still being extended
+        self.dropped = 0
+        self.written = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with _connect(path) as connection:
+            connection.executescript(_SCHEMA)
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    # --- writing ---
+
+    def record(self, patient, timestamp, cls, probability=None, recording=None, start_offset=None, end_offset=None):
+        """Queues one window classification and extends or closes the patient's open episode. Never blocks."""
+        window = (patient, timestamp, cls, probability, recording, start_offset, end_offset)
+        self._enqueue(("window", window))
+        with self._lock:
+            episode = self.open_episodes.get(patient)
+            if (episode is not None and episode["class"] == cls and episode["recording"] == recording
+                    and timestamp - episode["end_time"] <= self.merge_gap_s):
+                episode["end_time"] = timestamp
+                episode["windows"] += 1
+                episode["end_offset"] = end_offset
+                if probability is not None:
+                    episode["max_probability"] = max(episode["max_probability"] or 0.0, probability)
+                return
+            if episode is not None:
+                self._enqueue(("episode", tuple(episode[c] for c in _EPISODE_COLUMNS)))
+            self.open_episodes[patient] = {
+                "patient": patient, "class": cls, "start_time": timestamp, "end_time": timestamp,
+                "windows": 1, "max_probability": probability, "recording": recording,
+                "start_offset": start_offset, "end_offset": end_offset,
+            }
+
+    def end_episode(self, patient):
+        """Closes the patient's open episode (leads off, disconnect, end of recording)."""
+        with self._lock:
+            episode = self.open_episodes.pop(patient, None)
+        if episode is not None:
+            self._enqueue(("episode", tuple(episode[c] for c in _EPISODE_COLUMNS)))
+
+    def _enqueue(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+        METRICS.set_queue_depth("events", self._queue.qsize())
+
+    def _writer(self):
+        connection = _connect(self.path)
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            if batch:
+                self._write(connection, batch)
+                for _ in batch:
+                    self._queue.task_done()
+        connection.close()
+
+    def _write(self, connection, batch):
+        windows = [row for kind, row in batch if kind == "window"]
+        episodes = [row for kind, row in batch if kind == "episode"]
+        with connection:
+            if windows:
+                connection.executemany(
+                    "INSERT INTO windows (patient, time, class, probability, recording, start_offset, end_offset) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", windows)
+            if episodes:
+                connection.executemany(
+                    f"INSERT INTO episodes ({', '.join(_EPISODE_COLUMNS)}) VALUES ({', '.join('?' * len(_EPISODE_COLUMNS))})",
+                    episodes)
+        self.written += len(batch)
+        METRICS.set_queue_depth("events", self._queue.qsize())
+
+    def flush(self, timeout=10.0):
+        """Waits until everything queued so far is on disk (open episodes stay open)."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def close(self):
+        """Closes all open episodes, writes everything and stops the writer."""
+        for patient in list(self.open_episodes):
+            self.end_episode(patient)
+        self._queue.put(None)
+        self._thread.join()
+
+    # --- queries ---
+
+    def _reader(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = _connect(self.path)
+            connection.row_factory = sqlite3.Row
+        return connection
+
+    @staticmethod
+    def _where(patient, cls, since, until, time_column, end_column=None):
+        clauses, params = [], []
+        if patient is not None:
+            clauses.append("patient = ?")
+            params.append(patient)
+        if cls is not None:
+            clauses.append("class = ?")
+            params.append(cls)
+        if since is not None:
+            # Episodes that started earlier but were still running at `since` count as well.
+            clauses.append(f"{end_column or time_column} >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"{time_column} < ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def episodes(self, patient=None, cls=None, since=None, until=None, min_windows=1, include_open=True):
+        """
+        Episodes overlapping [since, until), oldest first, including ones still in progress.
+
+        Returns:
+            list[dict]: Rows with the episode columns plus "open" (still being extended).
+        """
+        where, params = self._where(patient, cls, since, until, "start_time", "end_time")
+        where += (" AND" if where else " WHERE") + " windows >= ?"
+        params.append(min_windows)
+        rows = self._reader().execute(
+            f"SELECT {', '.join(_EPISODE_COLUMNS)} FROM episodes{where} ORDER BY start_time", params).fetchall()
+        result = [dict(row, open=False) for row in rows]
+        if include_open:
+            with self._lock:
+                pending = [dict(e) for e in self.open_episodes.values()]
+            for episode in pending:
+                if ((patient is None or episode["patient"] == patient) and (cls is None or episode["class"] == cls)
+                        and (since is None or episode["end_time"] >= since)
+                        and (until is None or episode["start_time"] < until)
+                        and episode["windows"] >= min_windows):
+                    result.append(dict(episode, open=True))
+            result.sort(key=lambda e: e["start_time"])
+        return result
+
+    def windows(self, patient=None, cls=None, since=None, until=None, limit=10000):
+        where, params = self._where(patient, cls, since, until, "time")
+        rows = self._reader().execute(
+            f"SELECT patient, time, class, probability, recording, start_offset, end_offset FROM windows{where} "
+            f"ORDER BY time LIMIT ?", params + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def class_counts(self, patient=None, since=None, until=None):
+        """Number of windows per class."""
+        where, params = self._where(patient, None, since, until, "time")
+        rows = self._reader().execute(f"SELECT class, COUNT(*) FROM windows{where} GROUP BY class", params).fetchall()
+        return {row[0]: row[1] for row in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the ArrythmiX event store.")
+    parser.add_argument("--db", default=DEFAULT_EVENTS_PATH)
+    parser.add_argument("--patient")
+    parser.add_argument("--class", dest="cls", help="Class code, e.g. V.")
+    parser.add_argument("--hours", type=float, default=24.0)
+    parser.add_argument("--windows", action="store_true", help="List windows instead of episodes.")
+    args = parser.parse_args()
+
+    store = EventStore(args.db)
+    since = time.time() - args.hours * 3600
+    start = time.perf_counter()
+    if args.windows:
+        rows = store.windows(args.patient, args.cls, since)
+    else:
+        rows = store.episodes(args.patient, args.cls, since)
+    elapsed = time.perf_counter() - start
+    print(json.dumps(rows, indent=2))
+    print(f"{len(rows)} rows in {elapsed * 1e3:.1f} ms")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import numpy as np
+from scipy.signal import butter, iirnotch, tf2sos, sosfilt, sosfilt_zi, sosfiltfilt
+
+# === Defaults ===
+ECG_HZ = 360.0
+BASELINE_CUTOFF_HZ = 0.5    # removes respiration / electrode baseline wander
+POWERLINE_HZ = 50.0         # use 60.0 for the Americas
+NOTCH_Q = 30.0
+
+
+def design_filter_bank(fs=ECG_HZ, highpass_hz=BASELINE_CUTOFF_HZ, powerline_hz=POWERLINE_HZ,
+                       notch_q=NOTCH_Q, lowpass_hz=None, order=2):
+    """
+    Designs the ECG cleaning filter as one cascade of second-order sections.
+
+    Args:
+        fs (float): Sample rate of the stream in Hz.
+        highpass_hz (float | None): Baseline wander cutoff, None to disable.
+        powerline_hz (float | None): Mains frequency to notch out, None to disable.
+        notch_q (float): Quality factor of the notch.
+        lowpass_hz (float | None): Optional anti-noise lowpass cutoff.
+        order (int): Butterworth order of the highpass/lowpass stages.
+
+    Returns:
+        np.ndarray: SOS coefficients with shape (n_sections, 6).
+    """
+    stages = []
+    if highpass_hz:
+        stages.append(butter(order, highpass_hz, btype='highpass', fs=fs, output='sos'))
+    if powerline_hz and powerline_hz < fs / 2:
+        b, a = iirnotch(powerline_hz, notch_q, fs=fs)
+        stages.append(tf2sos(b, a))
+    if lowpass_hz and lowpass_hz < fs / 2:
+        stages.append(butter(order, lowpass_hz, btype='lowpass', fs=fs, output='sos'))
+    if not stages:
+        raise ValueError("Filter bank needs at least one stage.")
+    return np.vstack(stages)
+
+
+class StreamingFilterBank():
+    """
+    Causal SOS filter that keeps its state between incoming frames.
+
+    Every row of a block is one channel (a lead or a patient), so a whole ward
+    is filtered with a single sosfilt call per frame. Because the state carries
+    over, feeding 20-sample frames gives exactly the same output as filtering
+    the concatenated recording in one go, with no edge transients.
+    """
+
+    def __init__(self, n_channels=1, sos=None, **design_kwargs):
+        self.sos = design_filter_bank(**design_kwargs) if sos is None else np.asarray(sos, dtype=np.float64)
+        self.n_channels = n_channels
+        self._zi_unit = sosfilt_zi(self.sos)  # (n_sections, 2) steady state for a unit step
+        self.zi = np.zeros((self.sos.shape[0], n_channels, 2))
+        self._primed = np.zeros(n_channels, dtype=bool)
+
+    def reset(self, channel=None):
+        """Forgets the filter state of one channel (e.g. after a reconnect) or of all of them."""
+        if channel is None:
+            self.zi[:] = 0.0
+            self._primed[:] = False
+        else:
+            self.zi[:, channel, :] = 0.0
+            self._primed[channel] = False
+
+    def add_channels(self, count=1):
+        """Grows the bank for newly connected patients. Returns the index of the first new channel."""
+        first = self.n_channels
+        self.zi = np.concatenate([self.zi, np.zeros((self.sos.shape[0], count, 2))], axis=1)
+        self._primed = np.concatenate([self._primed, np.zeros(count, dtype=bool)])
+        self.n_channels += count
+        return first
+
+    def process(self, block):
+        """
+        Filters the next frame of every channel (online, causal).
+
+        Args:
+            block (np.ndarray): Shape (n_channels, n_samples), or (n_samples,) for a single channel.
+
+        Returns:
+            np.ndarray: Filtered samples in the same shape as the input.
+        """
+        block = np.asarray(block, dtype=np.float64)
+        squeeze = block.ndim == 1
+        if squeeze:
+            block = block[np.newaxis, :]
+        if block.shape[0] != self.n_channels:
+            raise ValueError(f"Expected {self.n_channels} channels, got {block.shape[0]}.")
+
+        # Start each fresh channel at steady state for its first sample so the
+        # DC offset of the electrode does not ring through the highpass.
+        fresh = ~self._primed
+        if fresh.any():
+            self.zi[:, fresh, :] = self._zi_unit[:, np.newaxis, :] * block[fresh, 0][np.newaxis, :, np.newaxis]
+            self._primed[fresh] = True
+
+        out, self.zi = sosfilt(self.sos, block, axis=-1, zi=self.zi)
+        return out[0] if squeeze else out
+
+    def filtfilt(self, data):
+        """Zero-phase offline variant using the same coefficients (for recordings and training data)."""
+        data = np.asarray(data, dtype=np.float64)
+        return sosfiltfilt(self.sos, data, axis=-1)
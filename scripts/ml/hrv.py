@@ -0,0 +1,277 @@
+import numpy as np
+
+# === Configuration ===
+WINDOW_BEATS = 300              # NN intervals in the time-domain window (~5 min at rest)
+MIN_RR_S = 0.3                  # intervals outside this range are treated as artifacts
+MAX_RR_S = 2.0
+PNN_THRESHOLD_MS = 50.0
+TACHOGRAM_HZ = 4.0              # evenly resampled RR series used for the spectrum
+SPECTRUM_SAMPLES = 256          # sliding DFT length (64 s at 4 Hz, 1/64 Hz resolution)
+LF_BAND_HZ = (0.04, 0.15)
+HF_BAND_HZ = (0.15, 0.40)
+RESYNC_INTERVAL = 1024          # updates between exact recomputations of the running sums
+ECTOPIC_CLASSES = ('A', 'V')    # premature atrial / ventricular beats
+EMIT_PERIOD_S = 60.0
+FEATURE_NAMES = (
+    "mean_rr_ms", "sdnn_ms", "rmssd_ms", "pnn50", "heart_rate_bpm",
+    "lf_power", "hf_power", "lf_hf", "ectopic_count", "ectopic_fraction", "nn_count",
+)
+
+
+class HRVEngine():
+    """
+    Streaming RR-interval / HRV features for many patients.
+
+    Each patient keeps a ring of the last WINDOW_BEATS normal-to-normal (NN) intervals
+    with running sums (mean, SDNN, RMSSD, pNN50), so add_beat() is O(1) no matter how
+    long the recording is. The frequency domain uses a sliding DFT of the 4 Hz RR
+    tachogram restricted to the LF and HF bins, also O(1) per tachogram sample; a Hann
+    window is applied in the frequency domain. Running sums are recomputed exactly every
+    RESYNC_INTERVAL updates so float error cannot accumulate over 24 h.
+
+    Intervals next to a beat labelled ectopic are counted but kept out of the NN series.
+
+    Usage:
+        engine = HRVEngine()
+        engine.add_beat("bed-1", t_seconds, label="N")
+        names, features = engine.emit_due(now)   # (n_due, len(FEATURE_NAMES))
+    """
+
+    def __init__(self, window_beats=WINDOW_BEATS, spectrum_samples=SPECTRUM_SAMPLES,
+                 tachogram_hz=TACHOGRAM_HZ, emit_period_s=EMIT_PERIOD_S, capacity=8):
+        self.window_beats = window_beats
+        self.spectrum_samples = spectrum_samples
+        self.tachogram_hz = tachogram_hz
+        self.emit_period_s = emit_period_s
+        self.slots = {}
+
+        freqs = np.arange(spectrum_samples) * tachogram_hz / spectrum_samples
+        self.lf_bins = np.flatnonzero((freqs >= LF_BAND_HZ[0]) & (freqs < LF_BAND_HZ[1]))
+        self.hf_bins = np.flatnonzero((freqs >= HF_BAND_HZ[0]) & (freqs < HF_BAND_HZ[1]))
+        # Hann windowing in the frequency domain needs each band's neighbouring bins as well.
+        self.bins = np.arange(self.lf_bins[0] - 1, self.hf_bins[-1] + 2)
+        self.twiddle = np.exp(2j * np.pi * self.bins / spectrum_samples)
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.rr = np.zeros((capacity, self.window_beats))
+        self.rr_head = np.zeros(capacity, dtype=np.int64)
+        self.rr_count = np.zeros(capacity, dtype=np.int64)
+        self.sum = np.zeros(capacity)
+        self.sum_sq = np.zeros(capacity)
+        self.diff_sq = np.zeros(capacity)       # sum of squared successive differences in the ring
+        self.nn50 = np.zeros(capacity, dtype=np.int64)
+        self.updates = np.zeros(capacity, dtype=np.int64)
+        self.tachogram = np.zeros((capacity, self.spectrum_samples))
+        self.tach_head = np.zeros(capacity, dtype=np.int64)
+        self.tach_count = np.zeros(capacity, dtype=np.int64)
+        self.tach_updates = np.zeros(capacity, dtype=np.int64)
+        self.dft = np.zeros((capacity, self.bins.size), dtype=np.complex128)
+        self.last_beat_time = np.full(capacity, np.nan)
+        self.last_rr = np.full(capacity, np.nan)
+        self.last_ectopic = np.zeros(capacity, dtype=bool)
+        self.next_tach_time = np.full(capacity, np.nan)
+        self.ectopic_ring = np.zeros((capacity, self.window_beats), dtype=bool)
+        self.beat_head = np.zeros(capacity, dtype=np.int64)
+        self.beat_count = np.zeros(capacity, dtype=np.int64)
+        self.ectopic_count = np.zeros(capacity, dtype=np.int64)
+        self.next_emit = np.full(capacity, np.nan)
+
+    def _grow(self):
+        old = {name: value for name, value in vars(self).items()
+               if isinstance(value, np.ndarray) and value.shape[:1] == (self.capacity,)}
+        self._allocate(self.capacity * 2)
+        for name, value in old.items():
+            getattr(self, name)[:value.shape[0]] = value
+
+    def add_patient(self, name):
+        """Returns the slot of `name`, creating it if needed."""
+        slot = self.slots.get(name)
+        if slot is None:
+            if len(self.slots) == self.capacity:
+                self._grow()
+            slot = self.slots[name] = len(self.slots)
+        return slot
+
+    def reset(self, name):
+        """Forgets a patient's history (e.g. after leads off or a long disconnect)."""
+        slot = self.slots.get(name)
+        if slot is None:
+            return
+        for attribute, value in vars(self).items():
+            if isinstance(value, np.ndarray) and value.shape[:1] == (self.capacity,):
+                value[slot] = np.nan if value.dtype.kind == "f" and attribute in (
+                    "last_beat_time", "last_rr", "next_tach_time", "next_emit") else 0
+
+    # --- time domain ---
+
+    def add_beat(self, name, time_s, label=None):
+        """
+        Adds one detected beat.
+
+        Args:
+            name (str): Patient / session.
+            time_s (float): R-peak time in seconds on a monotonic clock.
+            label (str | None): Classifier class of the beat (ml.bundle.DEFAULT_CLASSES).
+        """
+        slot = self.add_patient(name)
+        ectopic = label in ECTOPIC_CLASSES
+        self._push_beat_label(slot, ectopic)
+        if np.isnan(self.next_emit[slot]):
+            self.next_emit[slot] = time_s + self.emit_period_s
+
+        previous_time = self.last_beat_time[slot]
+        previous_ectopic = self.last_ectopic[slot]
+        self.last_beat_time[slot] = time_s
+        self.last_ectopic[slot] = ectopic
+        if np.isnan(previous_time):
+            return
+        rr = time_s - previous_time
+        if ectopic or previous_ectopic or not MIN_RR_S <= rr <= MAX_RR_S:
+            return
+        self._push_rr(slot, rr * 1000.0)
+        self._extend_tachogram(slot, previous_time, time_s, rr * 1000.0)
+
+    def _push_beat_label(self, slot, ectopic):
+        head = self.beat_head[slot]
+        if self.beat_count[slot] == self.window_beats:
+            self.ectopic_count[slot] -= self.ectopic_ring[slot, head]
+        else:
+            self.beat_count[slot] += 1
+        self.ectopic_ring[slot, head] = ectopic
+        self.ectopic_count[slot] += ectopic
+        self.beat_head[slot] = (head + 1) % self.window_beats
+
+    def _push_rr(self, slot, rr_ms):
+        n, head, size = self.rr_count[slot], self.rr_head[slot], self.window_beats
+        if n > 0:
+            newest = self.rr[slot, (head - 1) % size]
+            self.diff_sq[slot] += (rr_ms - newest) ** 2
+            self.nn50[slot] += abs(rr_ms - newest) > PNN_THRESHOLD_MS
+        if n == size:
+            oldest = self.rr[slot, head]
+            second = self.rr[slot, (head + 1) % size]
+            self.sum[slot] -= oldest
+            self.sum_sq[slot] -= oldest * oldest
+            self.diff_sq[slot] -= (second - oldest) ** 2
+            self.nn50[slot] -= abs(second - oldest) > PNN_THRESHOLD_MS
+        else:
+            self.rr_count[slot] = n + 1
+        self.rr[slot, head] = rr_ms
+        self.sum[slot] += rr_ms
+        self.sum_sq[slot] += rr_ms * rr_ms
+        self.rr_head[slot] = (head + 1) % size
+        self.updates[slot] += 1
+        if self.updates[slot] % RESYNC_INTERVAL == 0:
+            self._resync_time_domain(slot)
+
+    def _ordered_rr(self, slot):
+        n, head = self.rr_count[slot], self.rr_head[slot]
+        return np.roll(self.rr[slot], -head)[self.window_beats - n:]
+
+    def _resync_time_domain(self, slot):
+        rr = self._ordered_rr(slot)
+        diffs = np.diff(rr)
+        self.sum[slot] = rr.sum()
+        self.sum_sq[slot] = (rr * rr).sum()
+        self.diff_sq[slot] = (diffs * diffs).sum()
+        self.nn50[slot] = int((np.abs(diffs) > PNN_THRESHOLD_MS).sum())
+
+    # --- frequency domain ---
+
+    def _extend_tachogram(self, slot, previous_time, time_s, rr_ms):
+        """Linearly interpolates the RR series onto the tachogram grid up to time_s."""
+        step = 1.0 / self.tachogram_hz
+        if np.isnan(self.next_tach_time[slot]) or np.isnan(self.last_rr[slot]):
+            self.last_rr[slot] = rr_ms
+            self.next_tach_time[slot] = time_s
+            return
+        t = self.next_tach_time[slot]
+        start_rr = self.last_rr[slot]
+        if t < previous_time:
+            # The NN series was interrupted (ectopic beat or artifact): restart the grid here.
+            t, start_rr = previous_time, rr_ms
+        while t <= time_s:
+            fraction = (t - previous_time) / (time_s - previous_time)
+            self._push_tachogram(slot, start_rr + fraction * (rr_ms - start_rr))
+            t += step
+        self.next_tach_time[slot] = t
+        self.last_rr[slot] = rr_ms
+
+    def _push_tachogram(self, slot, value):
+        head = self.tach_head[slot]
+        oldest = self.tachogram[slot, head]
+        self.tachogram[slot, head] = value
+        self.tach_head[slot] = (head + 1) % self.spectrum_samples
+        self.tach_count[slot] = min(self.tach_count[slot] + 1, self.spectrum_samples)
+        # Sliding DFT: drop the oldest sample, add the newest, rotate the phase by one sample.
+        self.dft[slot] = (self.dft[slot] + value - oldest) * self.twiddle
+        self.tach_updates[slot] += 1
+        if self.tach_updates[slot] % RESYNC_INTERVAL == 0:
+            ordered = np.roll(self.tachogram[slot], -self.tach_head[slot])
+            self.dft[slot] = np.fft.fft(ordered)[self.bins]
+
+    def _band_powers(self):
+        """LF and HF power (ms^2) per patient from the Hann-windowed sliding DFT."""
+        hann = 0.5 * self.dft[:, 1:-1] - 0.25 * (self.dft[:, :-2] + self.dft[:, 2:])
+        scale = 2.0 / (self.tachogram_hz * self.spectrum_samples * 0.375)  # one-sided PSD, Hann power gain
+        psd = np.abs(hann) ** 2 * scale
+        resolution = self.tachogram_hz / self.spectrum_samples
+        inner = self.bins[1:-1]
+        lf = psd[:, np.isin(inner, self.lf_bins)].sum(axis=1) * resolution
+        hf = psd[:, np.isin(inner, self.hf_bins)].sum(axis=1) * resolution
+        return lf, hf
+
+    # --- output ---
+
+    def features(self, names=None):
+        """
+        Feature vectors (see FEATURE_NAMES) for the given patients, all of them by default.
+
+        Returns:
+            tuple[list[str], np.ndarray]: (names, (n, len(FEATURE_NAMES)) float64). Statistics
+            that need more data than is available are NaN.
+        """
+        names = list(self.slots) if names is None else list(names)
+        idx = np.array([self.slots[name] for name in names], dtype=np.int64)
+        n = self.rr_count[idx].astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            pairs = np.where(n > 1, n - 1, np.nan)
+            mean = self.sum[idx] / n
+            sdnn = np.sqrt(np.maximum(self.sum_sq[idx] / n - mean * mean, 0.0) * n / pairs)
+            rmssd = np.sqrt(self.diff_sq[idx] / pairs)
+            pnn50 = self.nn50[idx] / pairs
+            lf, hf = self._band_powers()
+            lf, hf = lf[idx], hf[idx]
+            full_spectrum = self.tach_count[idx] == self.spectrum_samples
+            lf = np.where(full_spectrum, lf, np.nan)
+            hf = np.where(full_spectrum, hf, np.nan)
+            beats = self.beat_count[idx]
+            ectopic = self.ectopic_count[idx]
+            matrix = np.column_stack([
+                mean, sdnn, rmssd, pnn50, 60000.0 / mean,
+                lf, hf, lf / hf,
+                ectopic, ectopic / beats, n,
+            ])
+        return names, matrix
+
+    def emit_due(self, now_s, names=None):
+        """
+        Feature vectors of the patients whose emission period has elapsed at `now_s`
+        (same clock as the beat times), rescheduling them. `names` restricts the check to
+        patients sharing that clock.
+        """
+        candidates = self.slots if names is None else [name for name in names if name in self.slots]
+        due = [name for name in candidates
+               if not np.isnan(self.next_emit[self.slots[name]]) and self.next_emit[self.slots[name]] <= now_s]
+        if not due:
+            return [], np.empty((0, len(FEATURE_NAMES)))
+        for name in due:
+            slot = self.slots[name]
+            self.next_emit[slot] += self.emit_period_s * max(1, np.ceil((now_s - self.next_emit[slot]) / self.emit_period_s))
+        return self.features(due)
+
+    def as_dict(self, name):
+        _, matrix = self.features([name])
+        return {key: (None if np.isnan(value) else float(value)) for key, value in zip(FEATURE_NAMES, matrix[0])}
@@ -0,0 +1,236 @@
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# === Configuration ===
+STAGES = ("decode", "buffer", "preprocess", "forward", "postprocess", "render")
+LATENCY_BUCKETS = (
+    50e-6, 100e-6, 250e-6, 500e-6,
+    1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3,
+    100e-3, 250e-3, 500e-3, 1.0, 2.5,
+)  # seconds, upper bounds; the last bucket is +Inf
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+RATE_SMOOTHING = 0.1        # EWMA weight of the newest inter-arrival rate
+
+
+def _label(value):
+    """Escapes a label value for the Prometheus text format (backslash, double quote, newline)."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram():
+    """Fixed-bucket latency histogram. observe() is a bisect and two adds."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimates a quantile by interpolating inside the bucket that contains it."""
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if count == 0:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c > 0:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.total, self.count
+        return {"counts": counts, "sum": total, "count": count}
+
+
+class _StageTimer():
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Metrics():
+    """
+    Process-wide registry for stage latencies, per-session stream counters and queue depths.
+
+    Usage:
+        with METRICS.time("forward"):
+            outputs = model(x)
+        METRICS.record_samples("patient-1", 20)
+        METRICS.set_queue_depth("inference_buffer", len(buffer))
+    """
+
+    def __init__(self, stages=STAGES):
+        self.histograms = {stage: Histogram() for stage in stages}
+        self.sessions = {}
+        self.queue_depths = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def _histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(stage, Histogram())
+        return histogram
+
+    def time(self, stage):
+        """Context manager that records the wall time of the enclosed block under `stage`."""
+        return _StageTimer(self._histogram(stage))
+
+    def observe(self, stage, seconds):
+        self._histogram(stage).observe(seconds)
+
+    def _session(self, session):
+        state = self.sessions.get(session)
+        if state is None:
+            with self._lock:
+                state = self.sessions.setdefault(session, {
+                    "samples": 0, "frames": 0, "gaps": 0, "missing_samples": 0,
+                    "sample_rate_hz": 0.0, "last_arrival": None,
+                })
+        return state
+
+    def record_samples(self, session, n_samples, arrival=None):
+        """Counts a received frame and updates the smoothed sample rate of the session."""
+        arrival = time.perf_counter() if arrival is None else arrival
+        state = self._session(session)
+        with self._lock:
+            last = state["last_arrival"]
+            if last is not None and arrival > last:
+                rate = n_samples / (arrival - last)
+                if state["sample_rate_hz"] == 0.0:
+                    state["sample_rate_hz"] = rate
+                else:
+                    state["sample_rate_hz"] += RATE_SMOOTHING * (rate - state["sample_rate_hz"])
+            state["last_arrival"] = arrival
+            state["samples"] += n_samples
+            state["frames"] += 1
+
+    def record_gap(self, session, missing_samples=0):
+        """Counts a detected stream gap (dropped notification, reconnect, leads off)."""
+        state = self._session(session)
+        with self._lock:
+            state["gaps"] += 1
+            state["missing_samples"] += missing_samples
+
+    def set_queue_depth(self, queue, depth):
+        self.queue_depths[queue] = depth
+
+    def set_gauge(self, name, value, session=""):
+        """Free-form gauge, exported as arrythmix_<name>{session="..."}."""
+        self.gauges[(name, session)] = value
+
+    def snapshot(self):
+        """Plain-dict view for in-process consumers (status pages, logs, tests)."""
+        stages = {}
+        for stage, histogram in list(self.histograms.items()):
+            data = histogram.snapshot()
+            data.update({f"p{int(q * 100)}": histogram.quantile(q) for q in (0.5, 0.9, 0.99)})
+            stages[stage] = data
+        with self._lock:
+            sessions = {name: {k: v for k, v in state.items() if k != "last_arrival"}
+                        for name, state in self.sessions.items()}
+        gauges = {}
+        for (name, session), value in list(self.gauges.items()):
+            gauges.setdefault(name, {})[session] = value
+        return {"stages": stages, "sessions": sessions, "queues": dict(self.queue_depths), "gauges": gauges}
+
+    def render_prometheus(self):
+        """Renders all metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP arrythmix_stage_seconds Latency of each pipeline stage.",
+            "# TYPE arrythmix_stage_seconds histogram",
+        ]
+        for stage, histogram in list(self.histograms.items()):
+            data = histogram.snapshot()
+            cumulative = 0
+            for bound, c in zip(histogram.buckets, data["counts"]):
+                cumulative += c
+                lines.append(f'arrythmix_stage_seconds_bucket{{stage="{_label(stage)}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'arrythmix_stage_seconds_bucket{{stage="{_label(stage)}",le="+Inf"}} {data["count"]}')
+            lines.append(f'arrythmix_stage_seconds_sum{{stage="{_label(stage)}"}} {data["sum"]:.9f}')
+            lines.append(f'arrythmix_stage_seconds_count{{stage="{_label(stage)}"}} {data["count"]}')
+
+        snapshot = self.snapshot()
+        session_metrics = (
+            ("samples", "counter", "Samples received per session."),
+            ("frames", "counter", "Notifications received per session."),
+            ("gaps", "counter", "Detected gaps in the sample stream."),
+            ("missing_samples", "counter", "Samples lost in detected gaps."),
+            ("sample_rate_hz", "gauge", "Smoothed arrival sample rate."),
+        )
+        for key, kind, help_text in session_metrics:
+            name = f"arrythmix_session_{key}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for session, state in snapshot["sessions"].items():
+                lines.append(f'{name}{{session="{_label(session)}"}} {state[key]}')
+
+        lines.append("# HELP arrythmix_queue_depth Items waiting in each queue.")
+        lines.append("# TYPE arrythmix_queue_depth gauge")
+        for queue, depth in snapshot["queues"].items():
+            lines.append(f'arrythmix_queue_depth{{queue="{_label(queue)}"}} {depth}')
+
+        for name, values in snapshot["gauges"].items():
+            lines.append(f"# TYPE arrythmix_{name} gauge")
+            for session, value in values.items():
+                lines.append(f'arrythmix_{name}{{session="{_label(session)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics = METRICS
+
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # keep scrapes out of the console
+
+
+def serve_metrics(metrics=METRICS, host=METRICS_HOST, port=METRICS_PORT):
+    """Starts the /metrics endpoint on a daemon thread and returns the server (call shutdown() to stop)."""
+    handler = type("MetricsHandler", (_MetricsHandler,), {"metrics": metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
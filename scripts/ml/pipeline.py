@@ -0,0 +1,267 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+
+import numpy as np
+from scipy.signal import find_peaks, resample_poly, sosfiltfilt
+
+from ml.filters import design_filter_bank
+from ml.metrics import METRICS
+from ml.timing import TARGET_HZ
+
+# === Configuration ===
+BEAT_MIN_DISTANCE_S = 0.25      # refractory period between detected R peaks
+BEAT_PROMINENCE = 0.35          # required peak prominence, fraction of the window's peak-to-peak range
+MAX_RATE_DENOMINATOR = 1000     # resample ratios are approximated by fractions up to this denominator
+
+
+class ModelSpec():
+    """
+    One model registered with a Pipeline and the input it expects.
+
+    Args:
+        name (str): Key of the model's result in Pipeline.run().
+        run (callable | None): run(prepared: PreparedInput) -> result, called on a worker thread.
+            None registers an input only: prepare() computes it, run() skips it.
+        seq_length (int): Samples the model takes.
+        sample_rate_hz (float | None): Rate the model was trained at. The window is cropped to
+            the most recent seq_length / sample_rate_hz seconds and resampled. None stretches the
+            whole window to seq_length like ml.runner.preprocess_live_chunk.
+        normalization (tuple[float, float] | None): (mean, std) subtracted/divided after resampling.
+        filter_config (dict | None): ml.filters.design_filter_bank kwargs applied zero-phase at the
+            input rate; None feeds the window as it is.
+        beats (bool): Whether the model needs R-peak positions.
+    """
+
+    def __init__(self, name, run, seq_length=171, sample_rate_hz=None, normalization=None,
+                 filter_config=None, beats=False):
+        self.name = name
+        self.run = run
+        self.seq_length = seq_length
+        self.sample_rate_hz = sample_rate_hz
+        self.normalization = tuple(float(v) for v in normalization) if normalization is not None else None
+        self.filter_config = filter_config
+        self.beats = beats
+
+    @property
+    def filter_key(self):
+        return tuple(sorted(self.filter_config.items())) if self.filter_config is not None else None
+
+
+class PreparedInput():
+    """What a model's run() receives. signal is (batch, seq_length) float32."""
+
+    __slots__ = ("signal", "beats", "input_hz")
+
+    def __init__(self, signal, beats, input_hz):
+        self.signal = signal
+        self.beats = beats          # per window: R-peak sample indices at input_hz, or None
+        self.input_hz = input_hz
+
+    def rr_intervals(self):
+        """Per window: RR intervals in seconds."""
+        return [np.diff(peaks) / self.input_hz for peaks in self.beats]
+
+
+def detect_beats(windows, fs, prominence=None):
+    """
+    R-peak indices of each window in a (batch, n) array. Without an absolute `prominence`
+    the threshold is relative to each window's range, which assumes a beat is in the window.
+    """
+    peaks = []
+    for signal in windows:
+        if prominence is None:
+            threshold = BEAT_PROMINENCE * max(np.ptp(signal), 1e-12)
+        else:
+            threshold = prominence
+        found, _ = find_peaks(signal, distance=max(1, int(BEAT_MIN_DISTANCE_S * fs)), prominence=threshold)
+        peaks.append(found)
+    return peaks
+
+
+class Pipeline():
+    """
+    Runs several models on the same windows with one preprocessing pass.
+
+    Filtering, beat detection, cropping/resampling and normalization are computed once per
+    distinct configuration among the registered models and shared; the models then run in
+    parallel on a thread pool (torch and numpy release the GIL in their kernels).
+
+    Usage:
+        pipeline = Pipeline(input_hz=360.0)
+        pipeline.register(classifier_spec(predictor(None)))
+        pipeline.register(ModelSpec("risk", risk_model, seq_length=3600, sample_rate_hz=250.0, beats=True))
+        results = pipeline.run(window)   # {"arrhythmia": probabilities, "risk": ...}
+    """
+
+    def __init__(self, input_hz=TARGET_HZ, max_workers=None):
+        self.input_hz = input_hz
+        self.specs = {}
+        self._sos = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline")
+        self.stage_runs = {"filter": 0, "beats": 0, "resample": 0, "normalize": 0}
+        self._stats_lock = threading.Lock()     # prepare() is called from several inference threads
+
+    def register(self, spec):
+        if spec.name in self.specs:
+            raise ValueError(f"A model named {spec.name!r} is already registered.")
+        if spec.filter_key is not None and spec.filter_key not in self._sos:
+            self._sos[spec.filter_key] = design_filter_bank(fs=self.input_hz, **spec.filter_config)
+        self.specs[spec.name] = spec
+        return spec
+
+    def unregister(self, name):
+        self.specs.pop(name, None)
+
+    def _resample(self, signal, spec):
+        if spec.sample_rate_hz is None:
+            return resample_poly(signal, up=spec.seq_length, down=signal.shape[-1], axis=-1)
+        ratio = Fraction(spec.sample_rate_hz / self.input_hz).limit_denominator(MAX_RATE_DENOMINATOR)
+        needed = int(np.ceil(spec.seq_length / ratio))
+        if signal.shape[-1] < needed:
+            raise ValueError(f"{spec.name} needs {needed} samples at {self.input_hz} Hz, got {signal.shape[-1]}.")
+        cropped = signal[:, -needed:]
+        if ratio == 1:
+            return cropped[:, -spec.seq_length:]
+        return resample_poly(cropped, up=ratio.numerator, down=ratio.denominator, axis=-1)[:, -spec.seq_length:]
+
+    def prepare(self, windows, beat_prominence=None, prefiltered=None):
+        """
+        Runs the shared stages for every registered model.
+
+        Args:
+            windows (np.ndarray): (n,) or (batch, n) samples at input_hz.
+            beat_prominence (float | callable | None): Absolute R-peak prominence, or
+                beat_prominence(filtered (batch, n)) -> prominence. None is relative to each window's range.
+            prefiltered (np.ndarray | None): The same windows, already filtered upstream (e.g. by a
+                continuous streaming filter, free of per-window edge transients). Beats of models
+                without their own filter_config are found in these instead of the raw windows.
+
+        Returns:
+            dict[str, PreparedInput]: Model name -> its input.
+        """
+        x = np.asarray(windows, dtype=np.float64)
+        if x.ndim == 1:
+            x = x[np.newaxis, :]
+        filtered, beats, resampled, normalized = {None: x}, {}, {}, {}
+        prepared = {}
+        runs = dict.fromkeys(self.stage_runs, 0)
+        for name, spec in self.specs.items():
+            fkey = spec.filter_key
+            if fkey not in filtered:
+                filtered[fkey] = sosfiltfilt(self._sos[fkey], x, axis=-1)
+                runs["filter"] += 1
+            if spec.beats and fkey not in beats:
+                source = filtered[fkey]
+                if fkey is None and prefiltered is not None:
+                    source = np.asarray(prefiltered, dtype=np.float64).reshape(x.shape)
+                prominence = beat_prominence(source) if callable(beat_prominence) else beat_prominence
+                beats[fkey] = detect_beats(source, self.input_hz, prominence=prominence)
+                runs["beats"] += 1
+            rkey = (fkey, spec.seq_length, spec.sample_rate_hz)
+            if rkey not in resampled:
+                resampled[rkey] = self._resample(filtered[fkey], spec)
+                runs["resample"] += 1
+            nkey = (rkey, spec.normalization)
+            if nkey not in normalized:
+                signal = resampled[rkey]
+                if spec.normalization is not None:
+                    mean, std = spec.normalization
+                    signal = (signal - mean) / std
+                    runs["normalize"] += 1
+                normalized[nkey] = signal.astype(np.float32)
+            prepared[name] = PreparedInput(normalized[nkey], beats.get(fkey) if spec.beats else None, self.input_hz)
+        with self._stats_lock:
+            for stage, count in runs.items():
+                self.stage_runs[stage] += count
+        return prepared
+
+    def run(self, windows, prepared=None):
+        """
+        Preprocesses once and runs all registered models in parallel.
+
+        Args:
+            windows (np.ndarray): (n,) or (batch, n) samples at input_hz.
+            prepared (dict | None): prepare() of the same windows, if the caller already has it.
+
+        Returns:
+            dict[str, object]: Model name -> result. A model that raised maps to the exception.
+        """
+        if prepared is None:
+            with METRICS.time("preprocess"):
+                prepared = self.prepare(windows)
+        with METRICS.time("forward"):
+            futures = {name: self._executor.submit(self._run_one, self.specs[name], inputs)
+                       for name, inputs in prepared.items() if self.specs[name].run is not None}
+            results = {}
+            for name, future in futures.items():
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    results[name] = e
+        return results
+
+    @staticmethod
+    def _run_one(spec, inputs):
+        with METRICS.time(f"model:{spec.name}"):
+            return spec.run(inputs)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+def classifier_spec(model, name="arrhythmia"):
+    """
+    ModelSpec for ml.runner.predictor (or anything with the same fields and a tensor
+    predict_proba, e.g. CascadeClassifier). The result is (batch, n_classes) probabilities.
+    """
+    import torch
+
+    base = getattr(model, "full", model)
+    fold = base.inference_fold_index
+    normalization = (base.train_means[fold], base.train_stds[fold])
+
+    def run(prepared):
+        x = torch.from_numpy(prepared.signal[:, np.newaxis, :]).to(base.device)
+        return model.predict_proba(x)
+
+    return ModelSpec(name, run, seq_length=base.seq_length, normalization=normalization)
+
+
+def main():
+    """Compares the shared pipeline against each model preprocessing its own copy of the window."""
+    from ml.runner import predictor
+
+    full = predictor(None)
+    rng = np.random.default_rng(0)
+    windows = 950 + 60 * rng.standard_normal((16, 720))
+
+    pipeline = Pipeline(input_hz=TARGET_HZ)
+    pipeline.register(classifier_spec(full, "arrhythmia"))
+    pipeline.register(ModelSpec("rhythm", lambda p: [rr.mean() if rr.size else np.nan for rr in p.rr_intervals()],
+                                seq_length=171, sample_rate_hz=TARGET_HZ, filter_config={}, beats=True))
+    pipeline.register(ModelSpec("morphology", lambda p: p.signal.std(axis=1), seq_length=171,
+                                sample_rate_hz=TARGET_HZ, filter_config={}))
+
+    repeats = 20
+    start = time.perf_counter()
+    for _ in range(repeats):
+        pipeline.run(windows)
+    shared = (time.perf_counter() - start) / repeats
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        for name in pipeline.specs:
+            solo = Pipeline(input_hz=TARGET_HZ, max_workers=1)
+            solo.register(pipeline.specs[name])
+            solo.run(windows)
+            solo.close()
+    separate = (time.perf_counter() - start) / repeats
+    pipeline.close()
+    print(f"shared preprocessing: {shared * 1e3:.1f} ms/batch, separate: {separate * 1e3:.1f} ms/batch")
+    print(f"stage runs per batch: {({k: v // repeats for k, v in pipeline.stage_runs.items()})}")
+
+
+if __name__ == "__main__":
+    main()
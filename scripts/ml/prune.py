@@ -0,0 +1,275 @@
+"""
+Structured pruning of CNNBiLSTM into slimmer variants, with fine-tuning and a
+latency / accuracy report.
+
+prune_model() removes whole units from trained weights instead of zeroing them,
+so the result is a smaller dense CNNBiLSTM that runs faster on any CPU:
+
+    conv blocks   output channels ranked by |BN gamma| / sqrt(var) * L1(filter)
+    LSTM          hidden units ranked by the L1 norm of their gate weights, chosen
+                  per attention head so the heads keep their original dims
+    attention     sliced to the surviving LSTM outputs; queries are rescaled so
+                  the softmax temperature of each head is unchanged
+    fc layers     units ranked by the L1 norm of their incoming weights
+    depth         upper LSTM layers can be dropped (the shapes still line up)
+
+Width 1.0 with all layers reproduces the original model exactly. Each variant
+is optionally fine-tuned on a window cache (ml.train) and then measured: per
+class F1 on the held-out fold, CPU latency at batch 1 and batch 64, weight size
+and the memory allocated by one forward pass. The report is written as
+<out>/report.md and report.json next to the variant weights.
+
+Usage:
+    python -m ml.prune --widths 1 0.75 0.5 0.25 --lstm-layers 2 1
+    python -m ml.prune data/mitdb --widths 0.5 --epochs 3 --bundles
+"""
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+import torch
+
+from ml.BILSTM import CNNBiLSTM
+from ml.bundle import DEFAULT_CLASSES, DEFAULT_INPUT_SPEC, pack_bundle
+from ml.scores import confusion_matrix, per_class_scores
+
+# === Configuration ===
+DEFAULT_OUT_DIR = "ml/variants"
+DEFAULT_WIDTHS = (1.0, 0.75, 0.5, 0.25)
+LATENCY_BATCHES = (1, 64)
+LATENCY_REPEATS = 30
+FINE_TUNE_LR = 3e-4
+
+
+def _top(scores, n):
+    """Indices of the n largest scores, in their original order."""
+    return torch.sort(torch.argsort(scores, descending=True)[:n]).values
+
+
+def _scaled(n, width, multiple=1):
+    return max(multiple, int(round(n * width / multiple)) * multiple)
+
+
+def _conv_importance(state, i):
+    weight = state[f"conv{i}.weight"]
+    bn_scale = state[f"bn{i}.weight"].abs() / torch.sqrt(state[f"bn{i}.running_var"] + 1e-5)
+    return bn_scale * weight.abs().sum(dim=(1, 2))
+
+
+def prune_model(model, width=1.0, lstm_layers=None):
+    """
+    Builds a narrower (and optionally shallower) CNNBiLSTM from a trained one.
+
+    Args:
+        model (CNNBiLSTM): Trained model; left untouched.
+        width (float): Share of conv channels, LSTM units and fc units to keep.
+        lstm_layers (int | None): LSTM layers to keep (the lowest ones); default all.
+
+    Returns:
+        CNNBiLSTM: The pruned model in eval mode.
+    """
+    config = model.config
+    state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+    new = {}
+
+    # Conv blocks: keep channels, slice the next block's inputs accordingly.
+    keep = torch.arange(config["input_channels"])
+    conv_channels = []
+    for i, channels in enumerate(config["conv_channels"], start=1):
+        out_keep = _top(_conv_importance(state, i), _scaled(channels, width))
+        new[f"conv{i}.weight"] = state[f"conv{i}.weight"][out_keep][:, keep]
+        new[f"conv{i}.bias"] = state[f"conv{i}.bias"][out_keep]
+        for name in ("weight", "bias", "running_mean", "running_var"):
+            new[f"bn{i}.{name}"] = state[f"bn{i}.{name}"][out_keep]
+        new[f"bn{i}.num_batches_tracked"] = state[f"bn{i}.num_batches_tracked"]
+        conv_channels.append(len(out_keep))
+        keep = out_keep
+
+    # LSTM: units are chosen per block of d = 2H / heads units, so every attention head
+    # still sees only the dims it was trained on.
+    hidden, heads = config["lstm_hidden"], config["attention_heads"]
+    blocks = heads // 2 if heads % 2 == 0 and hidden % (heads // 2) == 0 else 1
+    block = hidden // blocks
+    kept_per_block = _scaled(block, width)
+    layers = lstm_layers or config["lstm_layers"]
+    inputs = keep
+    for layer in range(layers):
+        outputs = []
+        for suffix in ("", "_reverse"):
+            name = f"l{layer}{suffix}"
+            w_ih, w_hh = state[f"lstm.weight_ih_{name}"], state[f"lstm.weight_hh_{name}"]
+            gates = lambda w: w.abs().sum(dim=1).reshape(4, hidden).sum(dim=0)
+            importance = (gates(w_ih) + gates(w_hh)).reshape(blocks, block)
+            units = torch.cat([b * block + _top(importance[b], kept_per_block) for b in range(blocks)])
+            rows = torch.cat([g * hidden + units for g in range(4)])
+            new[f"lstm.weight_ih_{name}"] = w_ih[rows][:, inputs]
+            new[f"lstm.weight_hh_{name}"] = w_hh[rows][:, units]
+            new[f"lstm.bias_ih_{name}"] = state[f"lstm.bias_ih_{name}"][rows]
+            new[f"lstm.bias_hh_{name}"] = state[f"lstm.bias_hh_{name}"][rows]
+            outputs.append(units)
+        inputs = torch.cat([outputs[0], hidden + outputs[1]])
+    embed = 2 * hidden
+    kept_embed = inputs
+    new_hidden = blocks * kept_per_block
+
+    # Attention: q/k/v rows and input columns follow the surviving LSTM outputs.
+    in_rows = torch.cat([part * embed + kept_embed for part in range(3)])
+    in_weight = state["attention.in_proj_weight"][in_rows][:, kept_embed]
+    in_bias = state["attention.in_proj_bias"][in_rows]
+    query_scale = math.sqrt((2 * new_hidden / heads) / (embed / heads))
+    in_weight[:len(kept_embed)] *= query_scale
+    in_bias[:len(kept_embed)] *= query_scale
+    new["attention.in_proj_weight"], new["attention.in_proj_bias"] = in_weight, in_bias
+    new["attention.out_proj.weight"] = state["attention.out_proj.weight"][kept_embed][:, kept_embed]
+    new["attention.out_proj.bias"] = state["attention.out_proj.bias"][kept_embed]
+
+    # Fully connected layers; the output layer keeps every class.
+    keep = kept_embed
+    fc_sizes = []
+    n_fc = len(config["fc_sizes"]) + 1
+    for i in range(1, n_fc + 1):
+        weight, bias = state[f"fc{i}.weight"][:, keep], state[f"fc{i}.bias"]
+        if i < n_fc:
+            out_keep = _top(weight.abs().sum(dim=1), _scaled(weight.shape[0], width))
+            weight, bias = weight[out_keep], bias[out_keep]
+            fc_sizes.append(len(out_keep))
+            keep = out_keep
+        new[f"fc{i}.weight"], new[f"fc{i}.bias"] = weight, bias
+
+    config.update(conv_channels=conv_channels, lstm_hidden=new_hidden, lstm_layers=layers, fc_sizes=fc_sizes)
+    pruned = CNNBiLSTM(**config)
+    pruned.load_state_dict({k: v.contiguous() for k, v in new.items()})
+    return pruned.eval()
+
+
+def measure_latency(model, batch, repeats=LATENCY_REPEATS):
+    """Median wall time of one forward pass in ms."""
+    x = torch.randn(batch, 1, model.seq_length)
+    times = []
+    with torch.no_grad():
+        for i in range(repeats + 3):
+            start = time.perf_counter()
+            model(x)
+            if i >= 3:                  # warm-up passes are not counted
+                times.append(time.perf_counter() - start)
+    return float(np.median(times) * 1e3)
+
+
+def measure_memory(model, batch=1):
+    """(weight MB, MB allocated during one forward pass)."""
+    weights = sum(t.numel() * t.element_size() for t in model.state_dict().values())
+    x = torch.randn(batch, 1, model.seq_length)
+    with torch.no_grad(), torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],
+                                                 profile_memory=True) as profile:
+        model(x)
+    allocated = sum(max(event.self_cpu_memory_usage, 0) for event in profile.key_averages())
+    return weights / 1e6, allocated / 1e6
+
+
+def evaluate(model, cache, folds, fold, mean, std, batch_size=1024):
+    """Per-class scores of the model on the windows of one fold."""
+    from ml.train import WindowDataset, make_loader, predict
+    loader = make_loader(WindowDataset(cache, np.flatnonzero(folds == fold), mean, std), batch_size, shuffle=False)
+    true, predicted = predict(model, loader)
+    return per_class_scores(confusion_matrix(true, predicted, len(cache.classes)), cache.classes)
+
+
+def format_report(rows, classes):
+    """Markdown table, one row per variant, relative to the first (reference) row."""
+    reference = rows[0]
+    has_scores = reference.get("scores") is not None
+    header = ["variant", "params", "weights MB", "alloc MB", "b1 ms", "b64 ms/window", "speedup"]
+    if has_scores:
+        header += ["macro F1", "Δ F1"] + [f"F1 {c}" for c in classes]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * len(header)]
+    for row in rows:
+        cells = [row["name"], f"{row['params']:,}", f"{row['weights_mb']:.2f}", f"{row['allocated_mb']:.2f}",
+                 f"{row['latency_ms'][1]:.2f}", f"{row['latency_ms'][64] / 64:.3f}",
+                 f"{reference['latency_ms'][1] / row['latency_ms'][1]:.2f}x"]
+        if has_scores:
+            scores = row["scores"]
+            cells += [f"{scores['macro_f1']:.4f}", f"{scores['macro_f1'] - reference['scores']['macro_f1']:+.4f}"]
+            cells += [f"{scores['classes'][c]['f1']:.4f}" for c in classes]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prune CNNBiLSTM into slimmer variants and report F1 against CPU cost.")
+    parser.add_argument("records", nargs="*", help="Labelled records for fine-tuning and F1 (see ml.train); omit for a latency-only report.")
+    parser.add_argument("--weights", default="ml/best_model{fold}.pth")
+    parser.add_argument("--fold", type=int, default=DEFAULT_INPUT_SPEC["fold_index"])
+    parser.add_argument("--means", default="ml/train_means.npy")
+    parser.add_argument("--stds", default="ml/train_stds.npy")
+    parser.add_argument("--widths", type=float, nargs="+", default=list(DEFAULT_WIDTHS))
+    parser.add_argument("--lstm-layers", type=int, nargs="+", default=[2])
+    parser.add_argument("--epochs", type=int, default=0, help="Fine-tuning epochs per variant.")
+    parser.add_argument("--lr", type=float, default=FINE_TUNE_LR)
+    parser.add_argument("--n-folds", type=int, default=5)
+    parser.add_argument("--cache-dir", default=None)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads for fine-tuning and latency.")
+    parser.add_argument("--bundles", action="store_true", help="Also pack each variant into <out>/<variant>.arxb.")
+    parser.add_argument("--out-dir", default=DEFAULT_OUT_DIR)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    means, stds = np.load(args.means), np.load(args.stds)
+    mean, std = float(means[args.fold]), float(stds[args.fold])
+    base = CNNBiLSTM(input_channels=1, seq_length=DEFAULT_INPUT_SPEC["seq_length"], n_classes=len(DEFAULT_CLASSES))
+    base.load_state_dict(torch.load(args.weights.format(fold=args.fold), map_location="cpu"))
+    base.eval()
+
+    cache = folds = None
+    if args.records:
+        from ml.train import DEFAULT_CACHE_DIR, assign_folds, build_cache
+        cache = build_cache(args.records, args.cache_dir or DEFAULT_CACHE_DIR)
+        folds = assign_folds(cache, args.n_folds)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    rows = []
+    variants = [(1.0, base.lstm.num_layers)]            # the unpruned model is always the reference row
+    variants += [(w, n) for n in args.lstm_layers for w in args.widths if (w, n) != variants[0]]
+    for width, layers in variants:
+        name = f"w{width:g}-l{layers}"
+        model = prune_model(base, width, layers)
+        if cache is not None and args.epochs and (width, layers) != variants[0]:
+            from ml.train import train_fold
+            print(f"Fine-tuning {name}")
+            state, _ = train_fold(cache, folds, args.fold, mean, std, init_state=model.state_dict(),
+                                  epochs=args.epochs, lr=args.lr, workers=args.workers, model_config=model.config)
+            model.load_state_dict(state)
+            model.eval()
+        weights_mb, allocated_mb = measure_memory(model)
+        row = {
+            "name": name, "width": width, "lstm_layers": layers, "config": model.config,
+            "params": sum(p.numel() for p in model.parameters()),
+            "weights_mb": weights_mb, "allocated_mb": allocated_mb,
+            "latency_ms": {batch: measure_latency(model, batch) for batch in LATENCY_BATCHES},
+            "scores": evaluate(model, cache, folds, args.fold, mean, std) if cache is not None else None,
+        }
+        rows.append(row)
+        torch.save(model.state_dict(), os.path.join(args.out_dir, f"{name}.pth"))
+        with open(os.path.join(args.out_dir, f"{name}.json"), "w") as f:
+            json.dump(model.config, f, indent=2)
+        if args.bundles:
+            input_spec = dict(DEFAULT_INPUT_SPEC, fold_index=args.fold)
+            pack_bundle(os.path.join(args.out_dir, f"{name}.arxb"), {args.fold: model.state_dict()}, means, stds,
+                        input_spec=input_spec, model_config=model.config)
+        print(f"{name}: {row['params']:,} params, {row['latency_ms'][1]:.2f} ms at batch 1"
+              + (f", macro F1 {row['scores']['macro_f1']:.4f}" if row["scores"] else ""))
+
+    report = format_report(rows, DEFAULT_CLASSES)
+    with open(os.path.join(args.out_dir, "report.md"), "w") as f:
+        f.write(f"# CNNBiLSTM variants (fold {args.fold}, {torch.get_num_threads()} threads)\n\n{report}\n")
+    with open(os.path.join(args.out_dir, "report.json"), "w") as f:
+        json.dump(rows, f, indent=2)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Chunked readers for reference ECG formats.
+
+    WFDBRecord   PhysioNet WFDB records (.hea + .dat in format 212, 16 or 80),
+                 e.g. the MIT-BIH Arrhythmia Database the classifier was trained on
+    read_annotations   WFDB annotation files (.atr and friends)
+    EDFRecord    EDF / EDF+ files (the annotation channel is skipped)
+
+Signal files are memory-mapped and decoded one chunk at a time, so a 24 h
+Holter record is never loaded whole. iter_blocks() yields 1-D arrays of raw ADC
+counts of the same shape live ingest hands to Session.on_frame() (FRAME_SAMPLES
+per block by default); to_physical() converts counts to the signal's units.
+open_record() also accepts Recorder .raw files and compressed .arxc files.
+"""
+import os
+
+import numpy as np
+
+from ml.timing import FRAME_SAMPLES, NOMINAL_DEVICE_HZ
+
+# === Configuration ===
+CHUNK_SAMPLES = 1 << 16         # samples decoded per read while iterating
+ANNOTATION_EXTENSION = "atr"
+WFDB_DEFAULT_GAIN = 200.0       # ADC units per physical unit when the header leaves it out
+
+# WFDB annotation codes (ecgcodes.h) -> MIT-BIH symbols.
+ANNOTATION_SYMBOLS = {
+    0: " ", 1: "N", 2: "L", 3: "R", 4: "a", 5: "V", 6: "F", 7: "J", 8: "A", 9: "S", 10: "E",
+    11: "j", 12: "/", 13: "Q", 14: "~", 16: "|", 18: "s", 19: "T", 20: "*", 21: "D", 22: '"',
+    23: "=", 24: "p", 25: "B", 26: "^", 27: "t", 28: "+", 29: "u", 30: "?", 31: "!", 32: "[",
+    33: "]", 34: "e", 35: "n", 36: "@", 37: "x", 38: "f", 39: "(", 40: ")", 41: "r",
+}
+_SKIP, _NUM, _SUB, _CHN, _AUX = 59, 60, 61, 62, 63
+
+
+class RecordError(ValueError):
+    """Raised for unsupported or malformed record files."""
+
+
+class _Channel():
+    __slots__ = ("name", "file", "format", "gain", "baseline", "units", "byte_offset", "index_in_file",
+                 "signals_in_file", "sample_rate_hz", "columns")
+
+
+class WFDBRecord():
+    """
+    A WFDB record. `path` may name the .hea file, the .dat file or the record without extension.
+
+    Only single-segment records with one sample per frame are supported, which covers
+    MIT-BIH and most PhysioNet ECG databases.
+    """
+
+    def __init__(self, path):
+        base = os.path.splitext(path)[0] if path.endswith((".hea", ".dat")) else path
+        self.directory = os.path.dirname(base)
+        self.name = os.path.basename(base)
+        self.header_path = base + ".hea"
+        self.channels = []
+        self._maps = {}
+        self._parse_header()
+
+    def _parse_header(self):
+        with open(self.header_path, "r") as f:
+            lines = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+        if not lines:
+            raise RecordError(f"{self.header_path} is empty.")
+        record = lines[0].split()
+        if "/" in record[0]:
+            raise RecordError("Multi-segment WFDB records are not supported.")
+        n_signals = int(record[1])
+        fs = float(record[2].split("/")[0].split("(")[0]) if len(record) > 2 else 250.0
+        self.sample_rate_hz = fs
+        self.length = int(record[3]) if len(record) > 3 else None
+
+        per_file = {}
+        for line in lines[1:1 + n_signals]:
+            fields = line.split()
+            channel = _Channel()
+            channel.file = fields[0]
+            fmt = fields[1]
+            channel.byte_offset = 0
+            if "+" in fmt:
+                fmt, offset = fmt.split("+")
+                channel.byte_offset = int(offset)
+            if ":" in fmt:
+                fmt = fmt.split(":")[0]
+            if "x" in fmt:
+                fmt, per_frame = fmt.split("x")
+                if int(per_frame) != 1:
+                    raise RecordError("Multi-frequency WFDB records are not supported.")
+            channel.format = int(fmt)
+            if channel.format not in (212, 16, 80):
+                raise RecordError(f"WFDB format {channel.format} is not supported (212, 16, 80 are).")
+            gain_field = fields[2] if len(fields) > 2 else ""
+            units = "mV"
+            if "/" in gain_field:
+                gain_field, units = gain_field.split("/", 1)
+            baseline = None
+            if "(" in gain_field:
+                gain_field, baseline = gain_field.rstrip(")").split("(")
+            channel.gain = float(gain_field) if gain_field and float(gain_field) != 0 else WFDB_DEFAULT_GAIN
+            channel.units = units
+            adc_zero = int(fields[4]) if len(fields) > 4 else 0
+            channel.baseline = int(baseline) if baseline is not None else adc_zero
+            channel.name = " ".join(fields[8:]) if len(fields) > 8 else f"signal {len(self.channels)}"
+            channel.sample_rate_hz = fs
+            channel.index_in_file = len(per_file.setdefault(channel.file, []))
+            per_file[channel.file].append(channel)
+            self.channels.append(channel)
+        for group in per_file.values():
+            if len({c.format for c in group}) != 1:
+                raise RecordError("Mixed formats within one signal file are not supported.")
+            for channel in group:
+                channel.signals_in_file = len(group)
+
+    @property
+    def channel_names(self):
+        return [channel.name for channel in self.channels]
+
+    def sample_rate(self, channel=0):
+        return self.channels[channel].sample_rate_hz
+
+    def _map(self, channel):
+        data = self._maps.get(channel.file)
+        if data is None:
+            path = os.path.join(self.directory, channel.file)
+            data = self._maps[channel.file] = np.memmap(path, dtype=np.uint8, mode="r")
+        return data
+
+    def n_samples(self, channel=0):
+        c = self.channels[channel]
+        data_bytes = self._map(c).size - c.byte_offset
+        if c.format == 212:
+            stored = data_bytes // 3 * 2 + (1 if data_bytes % 3 == 2 else 0)
+        else:
+            stored = data_bytes // (2 if c.format == 16 else 1)
+        available = stored // c.signals_in_file
+        return min(self.length, available) if self.length else available
+
+    def read(self, start=0, stop=None, channel=0):
+        """Raw ADC values of samples [start, stop) of one channel as int32."""
+        c = self.channels[channel]
+        stop = self.n_samples(channel) if stop is None else min(stop, self.n_samples(channel))
+        if start >= stop:
+            return np.zeros(0, dtype=np.int32)
+        k = c.signals_in_file
+        first, last = start * k, stop * k           # interleaved sample indices in the file
+        data = self._map(c)[c.byte_offset:]
+        if c.format == 16:
+            values = data[2 * first:2 * last].view("<i2").astype(np.int32)
+            offset = 0
+        elif c.format == 80:
+            values = data[first:last].astype(np.int32) - 128
+            offset = 0
+        else:
+            pair_first, pair_last = first // 2, (last + 1) // 2
+            raw = data[3 * pair_first:3 * pair_last]
+            if raw.size % 3:
+                # An odd number of samples ends the file with a 2-byte half pair.
+                raw = np.concatenate([raw, np.zeros(3 - raw.size % 3, dtype=np.uint8)])
+            triplets = raw.reshape(-1, 3).astype(np.int32)
+            values = np.empty(2 * len(triplets), dtype=np.int32)
+            values[0::2] = triplets[:, 0] | ((triplets[:, 1] & 0x0F) << 8)
+            values[1::2] = triplets[:, 2] | ((triplets[:, 1] & 0xF0) << 4)
+            values[values >= 2048] -= 4096
+            offset = first - 2 * pair_first
+        values = values[offset:offset + (last - first)]
+        return values[c.index_in_file::k]
+
+    def to_physical(self, values, channel=0):
+        c = self.channels[channel]
+        return (np.asarray(values, dtype=np.float64) - c.baseline) / c.gain
+
+    def iter_blocks(self, channel=0, block_samples=FRAME_SAMPLES, start=0, stop=None, chunk_samples=CHUNK_SAMPLES):
+        return _iter_blocks(self, channel, block_samples, start, stop, chunk_samples)
+
+    def annotations(self, extension=ANNOTATION_EXTENSION):
+        return read_annotations(os.path.join(self.directory, f"{self.name}.{extension}"))
+
+
+def read_annotations(path):
+    """
+    Reads a WFDB (MIT format) annotation file.
+
+    Returns:
+        dict[str, np.ndarray]: "sample" (int64), "symbol" (str), "subtype", "chan", "num"
+        (int16) and "aux" (object, bytes or None), one entry per annotation.
+    """
+    words = np.fromfile(path, dtype="<u2")
+    samples, symbols, subtypes, chans, nums, auxes = [], [], [], [], [], []
+    time_index = 0
+    chan = num = 0
+    i = 0
+    while i < len(words):
+        word = int(words[i])
+        code, interval = word >> 10, word & 0x3FF
+        i += 1
+        if code == 0 and interval == 0:
+            break
+        if code == _SKIP:
+            high, low = int(words[i]), int(words[i + 1])
+            skip = (high << 16) | low
+            time_index += skip - (1 << 32) if skip >= 1 << 31 else skip
+            i += 2
+        elif code == _NUM:
+            num = interval - 1024 if interval >= 512 else interval
+            if nums:
+                nums[-1] = num
+        elif code == _SUB:
+            if subtypes:
+                subtypes[-1] = interval
+        elif code == _CHN:
+            chan = interval
+            if chans:
+                chans[-1] = chan
+        elif code == _AUX:
+            n_words = (interval + 1) // 2
+            raw = words[i:i + n_words].tobytes()[:interval]
+            if auxes:
+                auxes[-1] = raw.rstrip(b"\x00")
+            i += n_words
+        else:
+            time_index += interval
+            samples.append(time_index)
+            symbols.append(ANNOTATION_SYMBOLS.get(code, "?"))
+            subtypes.append(0)
+            chans.append(chan)
+            nums.append(num)
+            auxes.append(None)
+    return {
+        "sample": np.array(samples, dtype=np.int64),
+        "symbol": np.array(symbols, dtype="<U1"),
+        "subtype": np.array(subtypes, dtype=np.int16),
+        "chan": np.array(chans, dtype=np.int16),
+        "num": np.array(nums, dtype=np.int16),
+        "aux": np.array(auxes, dtype=object),
+    }
+
+
+class EDFRecord():
+    """An EDF or EDF+ file. Signals are read record by record from a memory map."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            fixed = f.read(256)
+            if len(fixed) < 256:
+                raise RecordError(f"{path} is too short to be an EDF file.")
+            header_bytes = int(fixed[184:192])
+            n_signals = int(fixed[252:256])
+            signal_header = f.read(n_signals * 256)
+        self.reserved = fixed[192:236].decode("ascii", "replace").strip()
+        self.record_duration_s = float(fixed[244:252]) or 1.0
+
+        def fields(width, offset):
+            start = offset * n_signals
+            return [signal_header[start + i * width:start + (i + 1) * width].decode("latin-1").strip()
+                    for i in range(n_signals)]
+
+        offsets = np.cumsum([0, 16, 80, 8, 8, 8, 8, 8, 80])
+        labels = fields(16, 0)
+        units = fields(8, offsets[2])
+        physical_min = [float(v) for v in fields(8, offsets[3])]
+        physical_max = [float(v) for v in fields(8, offsets[4])]
+        digital_min = [float(v) for v in fields(8, offsets[5])]
+        digital_max = [float(v) for v in fields(8, offsets[6])]
+        per_record = [int(v) for v in fields(8, offsets[8])]
+
+        record_samples = sum(per_record)
+        data_bytes = os.path.getsize(path) - header_bytes
+        n_records = int(fixed[236:244])
+        if n_records < 0:
+            n_records = data_bytes // (2 * record_samples)
+        self._data = np.memmap(path, dtype="<i2", mode="r", offset=header_bytes,
+                               shape=(n_records, record_samples))
+        column_starts = np.concatenate([[0], np.cumsum(per_record)])
+
+        self.channels = []
+        for i, label in enumerate(labels):
+            if label == "EDF Annotations":
+                continue
+            channel = _Channel()
+            channel.name = label
+            channel.units = units[i]
+            scale = (physical_max[i] - physical_min[i]) / ((digital_max[i] - digital_min[i]) or 1.0)
+            channel.gain = 1.0 / scale if scale else 1.0
+            channel.baseline = digital_min[i] - physical_min[i] / scale if scale else 0.0
+            channel.sample_rate_hz = per_record[i] / self.record_duration_s
+            channel.columns = (int(column_starts[i]), per_record[i])
+            self.channels.append(channel)
+        self.n_records = n_records
+
+    @property
+    def channel_names(self):
+        return [channel.name for channel in self.channels]
+
+    def sample_rate(self, channel=0):
+        return self.channels[channel].sample_rate_hz
+
+    def n_samples(self, channel=0):
+        return self.n_records * self.channels[channel].columns[1]
+
+    def read(self, start=0, stop=None, channel=0):
+        """Digital values of samples [start, stop) of one channel as int32."""
+        column, per_record = self.channels[channel].columns
+        stop = self.n_samples(channel) if stop is None else min(stop, self.n_samples(channel))
+        if start >= stop:
+            return np.zeros(0, dtype=np.int32)
+        first_record, last_record = start // per_record, (stop - 1) // per_record
+        block = self._data[first_record:last_record + 1, column:column + per_record].astype(np.int32).ravel()
+        offset = start - first_record * per_record
+        return block[offset:offset + (stop - start)]
+
+    def to_physical(self, values, channel=0):
+        c = self.channels[channel]
+        return (np.asarray(values, dtype=np.float64) - c.baseline) / c.gain
+
+    def iter_blocks(self, channel=0, block_samples=FRAME_SAMPLES, start=0, stop=None, chunk_samples=CHUNK_SAMPLES):
+        return _iter_blocks(self, channel, block_samples, start, stop, chunk_samples)
+
+
+class RawRecord():
+    """Recorder .raw files and compressed .arxc files behind the same interface (one channel)."""
+
+    def __init__(self, path):
+        if path.endswith(".arxc"):
+            from ml.codec import CompressedRecording
+            self._source = CompressedRecording(path)
+            self.meta = self._source.meta
+        else:
+            from ml.recordings import open_recording
+            self._source, self.meta = open_recording(path)
+        self.channel_names = ["ecg"]
+
+    def sample_rate(self, channel=0):
+        return self.meta.get("sample_rate_hz") or NOMINAL_DEVICE_HZ
+
+    def n_samples(self, channel=0):
+        return len(self._source)
+
+    def read(self, start=0, stop=None, channel=0):
+        stop = len(self._source) if stop is None else min(stop, len(self._source))
+        return np.asarray(self._source[start:stop])
+
+    def to_physical(self, values, channel=0):
+        return np.asarray(values, dtype=np.float64)
+
+    def iter_blocks(self, channel=0, block_samples=FRAME_SAMPLES, start=0, stop=None, chunk_samples=CHUNK_SAMPLES):
+        return _iter_blocks(self, channel, block_samples, start, stop, chunk_samples)
+
+
+def _iter_blocks(record, channel, block_samples, start, stop, chunk_samples):
+    """Yields consecutive blocks of block_samples (the last one may be shorter)."""
+    stop = record.n_samples(channel) if stop is None else min(stop, record.n_samples(channel))
+    chunk_samples = max(block_samples, chunk_samples // block_samples * block_samples)
+    for chunk_start in range(start, stop, chunk_samples):
+        chunk = record.read(chunk_start, min(chunk_start + chunk_samples, stop), channel)
+        for offset in range(0, chunk.size, block_samples):
+            yield chunk[offset:offset + block_samples]
+
+
+def open_record(path):
+    """Opens a WFDB record (.hea/.dat), an EDF file, a Recorder .raw file or a compressed .arxc file."""
+    lower = path.lower()
+    if lower.endswith((".edf", ".rec")):
+        return EDFRecord(path)
+    if lower.endswith(".raw") or lower.endswith(".arxc"):
+        return RawRecord(path)
+    if lower.endswith((".hea", ".dat")) or os.path.exists(path + ".hea"):
+        return WFDBRecord(path)
+    raise RecordError(f"Cannot tell the format of {path}.")
+
+
+def beat_windows(record, annotations, channel=0, before=90, after=81, symbols=None, chunk_beats=4096):
+    """
+    Windows of raw ADC counts centred on annotated beats, in chunks of up to chunk_beats.
+
+    Args:
+        record: WFDBRecord (or any reader above).
+        annotations (dict): read_annotations() output.
+        before, after (int): Samples kept before / from the annotated sample (171 by default,
+            the classifier's window at 360 Hz).
+        symbols (Iterable[str] | None): Beat symbols to keep, e.g. ml.bundle.DEFAULT_CLASSES.
+
+    Yields:
+        tuple[np.ndarray, np.ndarray]: ((n, before + after) int32 windows, (n,) symbols).
+    """
+    positions = annotations["sample"]
+    labels = annotations["symbol"]
+    keep = (positions >= before) & (positions + after <= record.n_samples(channel))
+    if symbols is not None:
+        keep &= np.isin(labels, list(symbols))
+    positions, labels = positions[keep], labels[keep]
+    offsets = np.arange(-before, after)
+    for i in range(0, len(positions), chunk_beats):
+        chunk = positions[i:i + chunk_beats]
+        lo, hi = int(chunk[0]) - before, int(chunk[-1]) + after
+        signal = record.read(lo, hi, channel)
+        yield signal[chunk[:, None] - lo + offsets], labels[i:i + chunk_beats]
@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+def parse_data_from_file(filename):
+    """Parses ECG data from a text file."""
+    try:
+        with open(filename, 'r') as f:
+            content = f.read().strip()
+    except FileNotFoundError:
+        print(f"Error: {filename} not found.")
+        return []
+
+    # Try parsing as JSON first
+    try:
+        json_data = json.loads(content)
+        if 'data' in json_data and isinstance(json_data['data'], list):
+            return json_data['data']
+    except json.JSONDecodeError:
+        # Not a JSON file, proceed to other formats
+        pass
+
+    # Expected format is like: deque([0.1, 0.2, 0.3])
+    if content.startswith('deque(['):
+        content = content[len('deque(['):-2] # Remove deque wrapper
+
+    try:
+        data = [float(x) for x in content.split(',')]
+        return data
+    except ValueError:
+        print("Could not parse data. Ensure it's a comma-separated list of numbers, a deque representation, or a JSON object with a 'data' key.")
+        return []
+
+
+class Recorder():
+    """
+    Appends raw samples of one stream to a flat binary file.
+
+    `<path>` holds the samples back to back in `dtype`; `<path>.json` holds the
+    metadata needed to read them back (dtype, sample rate, start time, source).
+    With `pyramid` the min/max/mean index of ml.pyramid is kept up to date in
+    `<path>.pyr/`, so viewers can zoom over the recording without reading it.
+    """
+
+    def __init__(self, path, dtype="<u2", sample_rate_hz=None, source=None, pyramid=True):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.samples_written = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "ab")
+        self.samples_written = self._file.tell() // self.dtype.itemsize
+        self.meta = {
+            "dtype": self.dtype.str,
+            "sample_rate_hz": sample_rate_hz,
+            "start_time": time.time(),
+            "source": source,
+        }
+        meta_path = path + ".json"
+        if os.path.exists(meta_path):
+            with open(meta_path, "r") as f:
+                self.meta = json.load(f)
+        else:
+            with open(meta_path, "w") as f:
+                json.dump(self.meta, f, indent=2)
+        self.pyramid = None
+        if pyramid:
+            from ml.pyramid import PyramidWriter
+            self._file.flush()              # the writer re-reads samples it has not indexed yet
+            self.pyramid = PyramidWriter(path, self.dtype, self.meta.get("sample_rate_hz"), self.samples_written)
+
+    def append(self, samples):
+        samples = np.asarray(samples, dtype=self.dtype)
+        with self._lock:
+            self._file.write(samples.tobytes())
+            self.samples_written += samples.size
+            if self.pyramid is not None:
+                self.pyramid.append(samples)
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+            if self.pyramid is not None:
+                self.pyramid.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            if self.pyramid is not None:
+                self.pyramid.close()
+
+
+def open_recording(path):
+    """Returns (samples as a read-only memmap, metadata) for a file written by Recorder."""
+    with open(path + ".json", "r") as f:
+        meta = json.load(f)
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=meta["dtype"]), meta
+    return np.memmap(path, dtype=meta["dtype"], mode="r"), meta
@@ -1,18 +1,31 @@
+import os
+
 import torch
 import numpy as np
 from scipy.signal import resample_poly
 
 from ml.BILSTM import CNNBiLSTM
+from ml.bundle import DEFAULT_BUNDLE_PATH, DEFAULT_CLASSES, DEFAULT_MEANINGS, load_bundle
+from ml.metrics import METRICS
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = CNNBiLSTM(
-    input_channels=1,
-    seq_length=171,  # This should match the resampled sequence length
-    n_classes=6
-).to(device)
-
-model_path = 'ml/best_model4.pth'
-model.load_state_dict(torch.load(model_path, map_location=device))
-model.eval()
+
+# Prefer the single-file bundle (weights + normalization + classes, memory-mapped and
+# shared between processes); fall back to the loose legacy artifacts.
+bundle_path = os.environ.get("ARRYTHMIX_BUNDLE", DEFAULT_BUNDLE_PATH)
+if os.path.exists(bundle_path):
+    bundle = load_bundle(bundle_path)
+    model = bundle.build_model(device=device)
+else:
+    bundle = None
+    model = CNNBiLSTM(
+        input_channels=1,
+        seq_length=171,  # This should match the resampled sequence length
+        n_classes=6
+    ).to(device)
+
+    model_path = 'ml/best_model4.pth'
+    model.load_state_dict(torch.load(model_path, map_location=device))
+    model.eval()
 def preprocess_live_chunk(chunk, train_means, train_stds, fold_index, target_length=171):
     if chunk.ndim == 1:
         chunk = chunk[np.newaxis, :] # Add batch dimension if missing
@@ -37,31 +50,46 @@ def preprocess_live_chunk(chunk, train_means, train_stds, fold_index, target_len
     return preprocessed_tensor
 class predictor():
     def __init__(self, window_size):
-        self.train_means = np.load("ml/train_means.npy")
-        self.train_stds = np.load("ml/train_stds.npy")
-        self.classes = ['N', 'L', 'R', 'A', 'V', '/']
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu") # Get device from the loaded model
-        self.inference_fold_index = 4
-        self.meanings ={
-            "N": "Normal beat",
-            "L" :"Left bundle branch block beat",
-            "R" :"Right bundle branch block beat",
-            "A" :"Atrial premature beat",
-            "V" :"Premature ventricular contraction",
-            "/" :"Paced beat"}
+        if bundle is not None:
+            self.train_means = bundle.train_means
+            self.train_stds = bundle.train_stds
+            self.classes = bundle.classes
+            self.inference_fold_index = bundle.fold_index
+            self.seq_length = bundle.seq_length
+            self.meanings = bundle.meanings
+        else:
+            self.train_means = np.load("ml/train_means.npy")
+            self.train_stds = np.load("ml/train_stds.npy")
+            self.classes = DEFAULT_CLASSES
+            self.inference_fold_index = 4
+            self.seq_length = 171
+            self.meanings = DEFAULT_MEANINGS
+        self.last_probabilities = None
+
+
+    def preprocess(self, data):
+        data_chunk = np.array(data)
+        preprocessed_chunk = preprocess_live_chunk(data_chunk, self.train_means, self.train_stds, fold_index=self.inference_fold_index, target_length=self.seq_length)
+        return preprocessed_chunk.to(device)
 
+    def predict_proba(self, preprocessed_chunk):
+        """Class probabilities (batch, n_classes) for already preprocessed windows."""
+        with torch.no_grad():
+            outputs = model(preprocessed_chunk)
+        return torch.softmax(outputs, dim=1).cpu().numpy()
 
     def get_prediction(self, data):
-            data_chunk = np.array(data)
-            preprocessed_chunk = preprocess_live_chunk(data_chunk, self.train_means, self.train_stds, fold_index=self.inference_fold_index)
-            preprocessed_chunk = preprocessed_chunk.to(device)
-            with torch.no_grad():
-                outputs = model(preprocessed_chunk)
-                _, predicted_class_index = torch.max(outputs, 1)
-
-            predicted_class = self.classes[predicted_class_index.item()]
+            with METRICS.time("preprocess"):
+                preprocessed_chunk = self.preprocess(data)
+            with METRICS.time("forward"):
+                probabilities = self.predict_proba(preprocessed_chunk)
+            with METRICS.time("postprocess"):
+                self.last_probabilities = probabilities[0]
+                predicted_class = self.classes[int(probabilities[0].argmax())]
             return self.meanings[predicted_class]
-prediction = predictor(100)
-sample_data = [1.8694261294261294, 1.817020757020757, 1.9055677655677654, 1.9977289377289378, 2.037484737484738, 2.145006105006105, 2.341074481074481, 2.4169719169719173, 2.616654456654457, 2.4639560439560437, 2.136874236874237, 1.912796092796093, 1.8206349206349206, 1.780879120879121, 1.8603907203907204, 1.8016605616605617, 1.8504517704517705, 1.8314774114774117, 1.798949938949939, 1.8025641025641026, 1.8007570207570207, 1.7212454212454213, 1.8215384615384618, 1.7682295482295485, 1.781782661782662, 1.9263492063492065, 2.0176068376068375, 1.9200244200244203, 1.8061782661782662, 1.8233455433455434, 1.8396092796092798, 1.6019780219780222, 3.7, 0.730964590964591, 2.0654945054945055, 1.9082783882783885, 1.9200244200244203, 1.9155067155067158, 2.0483272283272287, 2.1459096459096463, 2.2145787545787545, 2.276019536019536, 2.3952869352869355, 2.6121367521367524, 2.694358974358974, 2.568766788766789, 2.3654700854700854, 2.091697191697192, 2.0031501831501832, 1.9453235653235654, 2.033870573870574, 2.042905982905983, 2.1106715506715505, 2.042905982905983, 2.0103785103785103, 1.9453235653235654, 2.060976800976801, 2.0456166056166056, 2.0121855921855922, 2.0420024420024423, 2.1215140415140414, 2.2624664224664226, 2.33023199023199, 2.2145787545787545, 2.091697191697192, 2.0546520146520146, 2.1359706959706957, 2.0636874236874236, 3.7, 0.8673992673992674, 2.2543345543345543, 2.1793406593406597, 2.175726495726496, 2.2055433455433455, 2.2326495726495725, 2.2236141636141635, 2.237167277167277, 2.3844444444444446, 2.4820268620268617, 2.6744810744810747, 2.6555067155067156, 2.523589743589744, 2.1603663003663005, 1.9886935286935288, 1.9146031746031749, 1.8694261294261294, 1.9164102564102568, 1.9516483516483518, 1.9272527472527474, 1.8856898656898657, 1.9073748473748473, 1.8441269841269843, 1.8567765567765568, 1.8260561660561663, 1.7754578754578756, 1.8043711843711845, 1.7745543345543346, 1.8838827838827839, 1.9886935286935288, 1.931770451770452, 1.8143101343101342, 1.7582905982905983, 1.7555799755799757, 1.6742612942612944, 2.9428327228327227, 1.864004884004884, 1.4095238095238096, 1.6543833943833945, 1.7971428571428572, 1.873943833943834, 1.8423199023199024, 1.9055677655677654, 2.0031501831501832, 2.0745299145299145, 2.204639804639805, 2.312161172161172, 2.353724053724054, 2.4151648351648354, 2.2335531135531137, 1.8874969474969474, 1.7104029304029307, 1.686910866910867, 1.7411233211233212, 1.7131135531135533, 1.771843711843712, 1.7230525030525032, 1.751965811965812, 1.7447374847374848, 1.7221489621489623, 1.7384126984126984, 1.7537728937728938, 1.6173382173382174, 1.7619047619047619, 1.789010989010989, 1.8350915750915753, 1.9877899877899878, 1.9037606837606837, 1.7673260073260075, 1.6354090354090354, 1.5423443223443225, 1.7600976800976802, 3.58976800976801, 1.451990231990232, 1.7483516483516484, 1.912796092796093, 2.05013431013431, 2.10976800976801, 2.2245177045177047, 2.270598290598291, 2.323003663003663, 2.3022222222222224, 2.4079365079365083, 2.554310134310134, 2.7178510378510383, 2.7286935286935288, 2.374505494505495, 2.091697191697192, 1.8856898656898657, 1.798949938949939, 1.8134065934065935, 1.8043711843711845, 1.8206349206349206, 1.7465445665445667, 1.7971428571428572, 1.781782661782662, 1.7239560439560442, 1.7176312576312578, 1.657997557997558, 1.7122100122100123, 1.7375091575091577, 1.5947496947496949, 1.8106959706959707, 1.9516483516483518, 1.817924297924298, 1.66974358974359, 1.6055921855921857, 1.5676434676434676, 1.583003663003663, 3.7, 0.48339438339438345, 1.7447374847374848, 1.7058852258852262, 1.6408302808302808, 1.8215384615384618, 1.780879120879121, 1.8585836385836387, 1.9073748473748473, 2.005860805860806, 2.0935042735042737, 2.2949938949938953, 2.3564346764346764, 2.2651770451770457, 1.9724297924297924, 1.7420268620268622, 1.6290842490842492, 1.6905250305250306, 1.7293772893772894, 1.7926251526251527, 1.7555799755799757, 1.7483516483516484]
+if __name__ == "__main__":
+    prediction = predictor(100)
+    sample_data = [1.8694261294261294, 1.817020757020757, 1.9055677655677654, 1.9977289377289378, 2.037484737484738, 2.145006105006105, 2.341074481074481, 2.4169719169719173, 2.616654456654457, 2.4639560439560437, 2.136874236874237, 1.912796092796093, 1.8206349206349206, 1.780879120879121, 1.8603907203907204, 1.8016605616605617, 1.8504517704517705, 1.8314774114774117, 1.798949938949939, 1.8025641025641026, 1.8007570207570207, 1.7212454212454213, 1.8215384615384618, 1.7682295482295485, 1.781782661782662, 1.9263492063492065, 2.0176068376068375, 1.9200244200244203, 1.8061782661782662, 1.8233455433455434, 1.8396092796092798, 1.6019780219780222, 3.7, 0.730964590964591, 2.0654945054945055, 1.9082783882783885, 1.9200244200244203, 1.9155067155067158, 2.0483272283272287, 2.1459096459096463, 2.2145787545787545, 2.276019536019536, 2.3952869352869355, 2.6121367521367524, 2.694358974358974, 2.568766788766789, 2.3654700854700854, 2.091697191697192, 2.0031501831501832, 1.9453235653235654, 2.033870573870574, 2.042905982905983, 2.1106715506715505, 2.042905982905983, 2.0103785103785103, 1.9453235653235654, 2.060976800976801, 2.0456166056166056, 2.0121855921855922, 2.0420024420024423, 2.1215140415140414, 2.2624664224664226, 2.33023199023199, 2.2145787545787545, 2.091697191697192, 2.0546520146520146, 2.1359706959706957, 2.0636874236874236, 3.7, 0.8673992673992674, 2.2543345543345543, 2.1793406593406597, 2.175726495726496, 2.2055433455433455, 2.2326495726495725, 2.2236141636141635, 2.237167277167277, 2.3844444444444446, 2.4820268620268617, 2.6744810744810747, 2.6555067155067156, 2.523589743589744, 2.1603663003663005, 1.9886935286935288, 1.9146031746031749, 1.8694261294261294, 1.9164102564102568, 1.9516483516483518, 1.9272527472527474, 1.8856898656898657, 1.9073748473748473, 1.8441269841269843, 1.8567765567765568, 1.8260561660561663, 1.7754578754578756, 1.8043711843711845, 1.7745543345543346, 1.8838827838827839, 1.9886935286935288, 1.931770451770452, 1.8143101343101342, 1.7582905982905983, 1.7555799755799757, 1.6742612942612944, 2.9428327228327227, 1.864004884004884, 1.4095238095238096, 1.6543833943833945, 1.7971428571428572, 1.873943833943834, 1.8423199023199024, 1.9055677655677654, 2.0031501831501832, 2.0745299145299145, 2.204639804639805, 2.312161172161172, 2.353724053724054, 2.4151648351648354, 2.2335531135531137, 1.8874969474969474, 1.7104029304029307, 1.686910866910867, 1.7411233211233212, 1.7131135531135533, 1.771843711843712, 1.7230525030525032, 1.751965811965812, 1.7447374847374848, 1.7221489621489623, 1.7384126984126984, 1.7537728937728938, 1.6173382173382174, 1.7619047619047619, 1.789010989010989, 1.8350915750915753, 1.9877899877899878, 1.9037606837606837, 1.7673260073260075, 1.6354090354090354, 1.5423443223443225, 1.7600976800976802, 3.58976800976801, 1.451990231990232, 1.7483516483516484, 1.912796092796093, 2.05013431013431, 2.10976800976801, 2.2245177045177047, 2.270598290598291, 2.323003663003663, 2.3022222222222224, 2.4079365079365083, 2.554310134310134, 2.7178510378510383, 2.7286935286935288, 2.374505494505495, 2.091697191697192, 1.8856898656898657, 1.798949938949939, 1.8134065934065935, 1.8043711843711845, 1.8206349206349206, 1.7465445665445667, 1.7971428571428572, 1.781782661782662, 1.7239560439560442, 1.7176312576312578, 1.657997557997558, 1.7122100122100123, 1.7375091575091577, 1.5947496947496949, 1.8106959706959707, 1.9516483516483518, 1.817924297924298, 1.66974358974359, 1.6055921855921857, 1.5676434676434676, 1.583003663003663, 3.7, 0.48339438339438345, 1.7447374847374848, 1.7058852258852262, 1.6408302808302808, 1.8215384615384618, 1.780879120879121, 1.8585836385836387, 1.9073748473748473, 2.005860805860806, 2.0935042735042737, 2.2949938949938953, 2.3564346764346764, 2.2651770451770457, 1.9724297924297924, 1.7420268620268622, 1.6290842490842492, 1.6905250305250306, 1.7293772893772894, 1.7926251526251527, 1.7555799755799757, 1.7483516483516484]
 
-prediction.get_prediction(sample_data[0:30])
\ No newline at end of file
+    print(prediction.get_prediction(sample_data[0:30]))
\ No newline at end of file
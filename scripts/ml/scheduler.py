@@ -0,0 +1,215 @@
+"""
+Deadline- and priority-aware scheduling of inference windows across sessions.
+
+Every window gets a deadline when it is submitted (DEADLINE_S, shorter for
+urgent sessions) and a priority:
+
+    HIGH    the session's recent windows were abnormal (ABNORMAL_CLASSES), or its
+            signal quality just recovered (leads back on / reconnected)
+    NORMAL  everything else
+
+Workers always take the window with the earliest deadline (EDF). When the CPU
+cannot keep up, NORMAL windows are shed first:
+
+    - a session's queued NORMAL window is replaced by its newer one; windows
+      overlap by far more than the trigger interval, so the newest covers it
+    - a NORMAL window that is already past its deadline is dropped, not run
+    - when the estimated backlog exceeds the deadline, new NORMAL windows are
+      shed, and a full queue evicts the NORMAL window with the latest deadline
+
+HIGH windows are never shed for load; they only run late. Misses, sheds and
+queue wait are counted per priority and exported through ml.metrics. Every
+window is counted once: "shed" windows were dropped without running
+(including NORMAL windows that went stale in the queue), "missed" windows ran
+but completed after their deadline.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+from ml.metrics import METRICS
+
+# === Configuration ===
+HIGH, NORMAL = 0, 1
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal"}
+DEADLINE_S = 0.5                # a window should be classified within this after it is complete
+HIGH_DEADLINE_FACTOR = 0.5      # urgent sessions get half the deadline, so EDF serves them first
+ABNORMAL_CLASSES = ("V", "A")
+ELEVATED_HOLD_S = 30.0          # stay HIGH this long after the last abnormal window
+RECOVERY_HOLD_S = 5.0           # stay HIGH this long after signal quality recovered
+QUEUE_SIZE = 64
+SERVICE_SMOOTHING = 0.1         # EWMA weight of the newest service time
+
+
+class Job():
+    __slots__ = ("session", "payload", "priority", "submitted", "deadline", "cancelled")
+
+    def __init__(self, session, payload, priority, submitted, deadline):
+        self.session = session
+        self.payload = payload
+        self.priority = priority
+        self.submitted = submitted
+        self.deadline = deadline
+        self.cancelled = False
+
+
+class InferenceScheduler():
+    """
+    Usage (`workers` threads call next()):
+        scheduler.submit("bed-1", window, recovered_at=session.quality_recovered_at)
+        job = scheduler.next(timeout=1.0)
+        label = model.classify(job.payload)
+        scheduler.complete(job, label)
+    """
+
+    def __init__(self, deadline_s=DEADLINE_S, queue_size=QUEUE_SIZE, abnormal_classes=ABNORMAL_CLASSES,
+                 elevated_hold_s=ELEVATED_HOLD_S, recovery_hold_s=RECOVERY_HOLD_S, workers=1, clock=time.monotonic):
+        self.deadline_s = deadline_s
+        self.queue_size = queue_size
+        self.workers = max(1, workers)          # the backlog drains this many windows at a time
+        self.abnormal_classes = set(abnormal_classes)
+        self.elevated_hold_s = elevated_hold_s
+        self.recovery_hold_s = recovery_hold_s
+        self.clock = clock
+        self.service_s = 0.0                    # EWMA of the time one window takes
+        self.last_abnormal = {}                 # session -> clock time of its last abnormal window
+        self._heap = []
+        self._queued = {}                       # session -> its queued NORMAL job (for coalescing)
+        self._size = 0
+        self._order = itertools.count()
+        self._closed = False
+        self._cond = threading.Condition()
+        self.stats = {name: {"submitted": 0, "completed": 0, "missed": 0, "shed": 0}
+                      for name in PRIORITY_NAMES.values()}
+        self.session_misses = {}
+
+    def __len__(self):
+        return self._size
+
+    def priority_for(self, session, recovered_at=None, now=None):
+        now = self.clock() if now is None else now
+        abnormal = self.last_abnormal.get(session)
+        if abnormal is not None and now - abnormal <= self.elevated_hold_s:
+            return HIGH
+        if recovered_at is not None and now - recovered_at <= self.recovery_hold_s:
+            return HIGH
+        return NORMAL
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.deadline, next(self._order), job))
+        self._size += 1
+        if job.priority == NORMAL:
+            self._queued[job.session] = job
+
+    def _shed(self, job):
+        job.cancelled = True
+        self._size -= 1
+        if self._queued.get(job.session) is job:
+            del self._queued[job.session]
+        self.stats[PRIORITY_NAMES[job.priority]]["shed"] += 1
+
+    def submit(self, session, payload, recovered_at=None):
+        """
+        Queues one window. `recovered_at` is the clock time the session's signal last recovered.
+
+        Returns:
+            bool: False if the window was shed on arrival.
+        """
+        with self._cond:
+            now = self.clock()
+            priority = self.priority_for(session, recovered_at, now)
+            deadline = now + self.deadline_s * (HIGH_DEADLINE_FACTOR if priority == HIGH else 1.0)
+            job = Job(session, payload, priority, now, deadline)
+            self.stats[PRIORITY_NAMES[priority]]["submitted"] += 1
+
+            if priority == NORMAL:
+                previous = self._queued.get(session)
+                if previous is not None:
+                    self._shed(previous)        # superseded by the newer, overlapping window
+                elif self._size * self.service_s / self.workers > self.deadline_s:
+                    # The backlog already cannot be cleared in time; let urgent work through.
+                    self.stats["normal"]["shed"] += 1
+                    self._publish()
+                    return False
+            if self._size >= self.queue_size:
+                victim = self._latest_normal()
+                if victim is None or priority == NORMAL and victim.deadline <= deadline:
+                    self.stats[PRIORITY_NAMES[priority]]["shed"] += 1
+                    self._publish()
+                    return False
+                self._shed(victim)
+            self._push(job)
+            self._publish()
+            self._cond.notify()
+            return True
+
+    def _latest_normal(self):
+        candidates = [job for _, _, job in self._heap if not job.cancelled and job.priority == NORMAL]
+        return max(candidates, key=lambda job: job.deadline) if candidates else None
+
+    def next(self, timeout=None):
+        """
+        The pending window with the earliest deadline, or None on timeout or close.
+        NORMAL windows already past their deadline are shed on the way.
+        """
+        end = None if timeout is None else self.clock() + timeout
+        with self._cond:
+            while True:
+                while self._heap:
+                    _, _, job = heapq.heappop(self._heap)
+                    if job.cancelled:
+                        continue
+                    self._size -= 1
+                    if self._queued.get(job.session) is job:
+                        del self._queued[job.session]
+                    if job.priority == NORMAL and self.clock() > job.deadline:
+                        self.stats["normal"]["shed"] += 1
+                        continue
+                    self._publish()
+                    METRICS.observe("queue_wait", self.clock() - job.submitted)
+                    job.cancelled = True        # taken; a later _shed must not count it
+                    return job
+                if self._closed:
+                    return None
+                remaining = None if end is None else end - self.clock()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+    def complete(self, job, label=None, started=None):
+        """Marks a job done; `label` (class code) updates the session's priority for future windows."""
+        now = self.clock()
+        with self._cond:
+            if started is not None:
+                service = now - started
+                self.service_s += SERVICE_SMOOTHING * (service - self.service_s) if self.service_s else service
+            self.stats[PRIORITY_NAMES[job.priority]]["completed"] += 1
+            if now > job.deadline:
+                self._miss(job)
+            if label in self.abnormal_classes:
+                self.last_abnormal[job.session] = now
+
+    def _miss(self, job):
+        self.stats[PRIORITY_NAMES[job.priority]]["missed"] += 1
+        self.session_misses[job.session] = self.session_misses.get(job.session, 0) + 1
+        METRICS.set_gauge("inference_deadline_misses", self.session_misses[job.session], session=job.session)
+
+    def _publish(self):
+        METRICS.set_queue_depth("inference", self._size)
+
+    def close(self):
+        """Wakes every waiting worker; next() returns None once the queue is drained."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def snapshot(self):
+        with self._cond:
+            return {
+                "queued": self._size,
+                "service_ms": self.service_s * 1e3,
+                "priorities": {name: dict(counts) for name, counts in self.stats.items()},
+                "deadline_misses": dict(self.session_misses),
+                "elevated": sorted(s for s in self.last_abnormal if self.priority_for(s) == HIGH),
+            }
@@ -0,0 +1,317 @@
+"""
+CPU thread budget for inference.
+
+Left alone, every inference thread runs PyTorch with one intra-op thread per
+core and numpy/BLAS does the same, so a daemon with several workers (or a UI
+with a prediction thread next to Gradio's) runs cores x threads busy threads
+and the tail latency of a batch-1 CNNBiLSTM forward pass jumps. A ThreadBudget
+splits the cores instead:
+
+    reserved    cores left to ingest, BLE, HTTP and the UI (RESERVED_CORES)
+    workers     inference threads, enough for the configured number of streams
+    intra_op    torch threads per worker; a batch-1 forward stops scaling at a few
+    pin         optionally, each worker (and the OpenMP threads it starts) is
+                bound to its own cores with sched_setaffinity (Linux)
+
+plan() derives a budget from the core count and the number of streams.
+autotune() measures instead: it sweeps (workers, intra_op) over the real
+forward pass at the streams' window rate and keeps the setting with the
+lowest p99 latency that still keeps up. The result is saved per host in
+TUNED_PATH and preferred by load_budget() on that machine.
+
+Usage:
+    python -m ml.threads plan --streams 8
+    python -m ml.threads autotune --streams 8 --seconds 3
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import threading
+import time
+
+import numpy as np
+import torch
+
+# === Configuration ===
+RESERVED_CORES = 1              # kept free for ingest / API / UI threads on machines with more than 2 cores
+MAX_INTRA_OP = 4                # a batch-1 CNNBiLSTM forward gains little beyond this
+STREAMS_PER_WORKER = 8          # one worker keeps up with this many streams at the default trigger rate
+WINDOWS_PER_STREAM_S = 360.0 / 40   # TARGET_HZ / INFERENCE_TRIGGER_COUNT
+HEADROOM = 1.5                  # a tuned setting must sustain this multiple of the required window rate
+TUNED_PATH = os.path.join(os.path.expanduser("~"), ".arrythmix", "threads.json")
+
+
+class ThreadBudget():
+    """
+    How inference threads share the CPU.
+
+    Args:
+        workers (int): Inference threads.
+        intra_op (int): torch intra-op threads per worker.
+        interop (int): torch inter-op threads (the model has no parallel branches, so 1).
+        pin (bool): Bind each worker to its own cores.
+        cores (list[int] | None): Cores available to the process (default: its affinity mask).
+        reserved (int): Leading cores kept for non-inference threads.
+    """
+
+    def __init__(self, workers=1, intra_op=1, interop=1, pin=False, cores=None, reserved=0):
+        self.workers = max(1, int(workers))
+        self.intra_op = max(1, int(intra_op))
+        self.interop = max(1, int(interop))
+        self.pin = bool(pin)
+        self.cores = sorted(cores) if cores is not None else available_cores()
+        self.reserved = reserved
+
+    def worker_cores(self, index):
+        """The cores worker `index` is pinned to, or None without pinning."""
+        if not self.pin:
+            return None
+        pool = self.cores[self.reserved:] or self.cores
+        start = index * self.intra_op
+        return [pool[(start + k) % len(pool)] for k in range(self.intra_op)]
+
+    def to_dict(self):
+        return {"workers": self.workers, "intra_op": self.intra_op, "interop": self.interop, "pin": self.pin,
+                "reserved": self.reserved}
+
+    def __repr__(self):
+        return (f"ThreadBudget(workers={self.workers}, intra_op={self.intra_op}, interop={self.interop}, "
+                f"pin={self.pin}, reserved={self.reserved}, cores={len(self.cores)})")
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan(streams=1, cores=None, pin=False, streams_per_worker=STREAMS_PER_WORKER):
+    """
+    A budget from the core count alone: one worker per STREAMS_PER_WORKER streams,
+    never more workers than inference cores, and the remaining cores shared out as
+    intra-op threads up to MAX_INTRA_OP.
+    """
+    cores = sorted(cores) if cores is not None else available_cores()
+    reserved = RESERVED_CORES if len(cores) > 2 else 0
+    inference_cores = len(cores) - reserved
+    workers = min(inference_cores, max(1, math.ceil(streams / streams_per_worker)))
+    intra_op = min(MAX_INTRA_OP, max(1, inference_cores // workers))
+    return ThreadBudget(workers, intra_op, pin=pin, cores=cores, reserved=reserved)
+
+
+def host_key():
+    """Identifies the machine a tuned budget is valid for."""
+    return f"{platform.node()}/{platform.machine()}/{len(available_cores())}cores/torch-{torch.__version__}"
+
+
+def load_budget(streams=1, overrides=None, path=TUNED_PATH):
+    """
+    The budget for this process: the tuned one for this host and stream count if
+    autotune has been run here, plan() otherwise, with `overrides` (ThreadBudget
+    keyword arguments, e.g. from the daemon config) applied on top.
+    """
+    budget = plan(streams)
+    tuned = None
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            entries = json.load(f).get(host_key(), {})
+        # The entry tuned for the smallest stream count that covers this one.
+        fitting = sorted((int(n), entry) for n, entry in entries.items() if int(n) >= streams)
+        tuned = fitting[0][1] if fitting else None
+    if tuned is not None:
+        budget = ThreadBudget(**{k: tuned[k] for k in ("workers", "intra_op", "interop", "pin", "reserved")})
+    if overrides:
+        settings = dict(budget.to_dict(), **overrides)
+        budget = ThreadBudget(cores=budget.cores, **settings)
+    return budget
+
+
+def limit_blas(threads):
+    """Caps numpy's BLAS / OpenMP pools if threadpoolctl is installed; returns whether it was applied."""
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return False
+    threadpool_limits(limits=threads)
+    return True
+
+
+def apply(budget):
+    """Process-wide settings; call once at startup, before the first forward pass."""
+    torch.set_num_threads(budget.intra_op)
+    try:
+        torch.set_num_interop_threads(budget.interop)
+    except RuntimeError:
+        pass                        # already fixed by earlier parallel work in this process
+    limit_blas(budget.intra_op)
+
+
+def configure_thread(budget, index=0):
+    """
+    Per-thread settings; call at the start of every inference thread. OpenMP
+    thread counts and affinity are per thread, and the pool a worker starts
+    inherits the affinity it has at that point.
+    """
+    torch.set_num_threads(budget.intra_op)
+    cores = budget.worker_cores(index)
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)          # 0 is the calling thread on Linux
+
+
+# --- Autotuning ---
+
+def _tune_model(bundle_path=None, model_config=None):
+    """The deployed network shape; weights do not change the timing, so a fresh init is used without a bundle."""
+    from ml.BILSTM import CNNBiLSTM
+    from ml.bundle import DEFAULT_BUNDLE_PATH, load_bundle
+    bundle_path = bundle_path or DEFAULT_BUNDLE_PATH
+    if model_config is None and os.path.exists(bundle_path):
+        model_config = load_bundle(bundle_path).model_config
+    config = {"input_channels": 1, "seq_length": 171, "n_classes": 6}
+    config.update(model_config or {})
+    return CNNBiLSTM(**config).eval()
+
+
+def measure(model, budget, streams, seconds=3.0, warmup_s=0.5):
+    """
+    Runs `budget.workers` threads classifying batch-1 windows that arrive at the
+    streams' window rate (open loop, so queueing shows up in the latency).
+
+    Returns:
+        dict: Sustained windows/s, required windows/s and latency percentiles in ms.
+    """
+    required = streams * WINDOWS_PER_STREAM_S
+    interval = 1.0 / (required * HEADROOM)
+    x = torch.randn(1, 1, model.seq_length)
+    lock = threading.Lock()
+    state = {"next": 0}
+    latencies = []
+    start = time.perf_counter() + 0.05
+    end = start + warmup_s + seconds
+
+    def worker(index):
+        configure_thread(budget, index)
+        with torch.no_grad():
+            while True:
+                with lock:
+                    n = state["next"]
+                    state["next"] += 1
+                arrival = start + n * interval
+                if arrival >= end:
+                    return
+                delay = arrival - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                model(x)
+                done = time.perf_counter()
+                if arrival >= start + warmup_s:
+                    with lock:
+                        latencies.append(done - arrival)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(budget.workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start - warmup_s
+    latencies = np.array(latencies) * 1e3
+    return {
+        "required_per_s": required,
+        "windows_per_s": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) if latencies.size else None,
+        "p99_ms": float(np.percentile(latencies, 99)) if latencies.size else None,
+    }
+
+
+def _format_ms(value):
+    """Latency for printing; measure() has none when no window completed after the warmup."""
+    return "n/a" if value is None else f"{value:.2f} ms"
+
+
+def candidates(cores=None, pin_options=(False, True)):
+    """Every (workers, intra_op, pin) that fits the inference cores without oversubscribing them."""
+    cores = sorted(cores) if cores is not None else available_cores()
+    reserved = RESERVED_CORES if len(cores) > 2 else 0
+    inference_cores = len(cores) - reserved
+    pins = pin_options if hasattr(os, "sched_setaffinity") else (False,)
+    for workers, intra_op in itertools.product(range(1, inference_cores + 1), range(1, MAX_INTRA_OP + 1)):
+        if workers * intra_op <= inference_cores:
+            for pin in pins:
+                yield ThreadBudget(workers, intra_op, pin=pin, cores=cores, reserved=reserved)
+
+
+def autotune(streams, seconds=3.0, model=None, budgets=None, verbose=True):
+    """
+    Measures every candidate budget and returns (best, results). The best budget keeps
+    up with the window rate and has the lowest p99 latency; if none keeps up, the one
+    with the highest throughput wins.
+    """
+    model = model if model is not None else _tune_model()
+    results = []
+    for budget in budgets if budgets is not None else candidates():
+        result = measure(model, budget, streams, seconds)
+        results.append((budget, result))
+        if verbose:
+            print(f"{budget!r}: {result['windows_per_s']:.0f}/{result['required_per_s']:.0f} windows/s, "
+                  f"p50 {_format_ms(result['p50_ms'])}, p99 {_format_ms(result['p99_ms'])}")
+    # With HEADROOM the offered load is above the requirement, so "keeps up" allows a little slack.
+    keeping_up = [(b, r) for b, r in results if r["windows_per_s"] >= 0.95 * r["required_per_s"] * HEADROOM]
+    if keeping_up:
+        best = min(keeping_up, key=lambda item: item[1]["p99_ms"])
+    else:
+        best = max(results, key=lambda item: item[1]["windows_per_s"])
+    return best[0], results
+
+
+def save_budget(budget, streams, result=None, path=TUNED_PATH):
+    entries = {}
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            entries = json.load(f)
+    entry = dict(budget.to_dict(), tuned_at=time.time(), result=result)
+    entries.setdefault(host_key(), {})[str(streams)] = entry
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(entries, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plan or autotune inference threads for this machine.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    show = sub.add_parser("plan", help="Print the budget load_budget() would use.")
+    show.add_argument("--streams", type=int, default=1)
+    tune = sub.add_parser("autotune", help="Sweep workers x intra-op threads x pinning and save the best.")
+    tune.add_argument("--streams", type=int, default=1)
+    tune.add_argument("--seconds", type=float, default=3.0, help="Measurement time per setting.")
+    tune.add_argument("--bundle", default=None, help="Model bundle whose architecture is timed (default: deployed).")
+    tune.add_argument("--model-config", default=None, help="JSON file with CNNBiLSTM kwargs, e.g. a pruned variant.")
+    tune.add_argument("--no-pin", action="store_true", help="Do not try core pinning.")
+    tune.add_argument("--out", default=TUNED_PATH)
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        budget = load_budget(args.streams)
+        print(budget)
+        for i in range(budget.workers):
+            print(f"  worker {i}: {budget.intra_op} intra-op threads, cores {budget.worker_cores(i) or 'any'}")
+        return
+
+    model_config = None
+    if args.model_config:
+        with open(args.model_config, "r") as f:
+            model_config = json.load(f)
+    model = _tune_model(args.bundle, model_config)
+    pins = (False,) if args.no_pin else (False, True)
+    best, results = autotune(args.streams, args.seconds, model, list(candidates(pin_options=pins)))
+    result = dict(results)[best]
+    save_budget(best, args.streams, result, args.out)
+    print(f"Best for {args.streams} streams on {host_key()}: {best!r} (p99 {_format_ms(result['p99_ms'])}), saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import time
+
+import numpy as np
+from scipy.signal import firwin
+
+# === Firmware timing (src/main.c) ===
+TIMER_PERIOD_S = 2300e-6    # k_timer period
+FRAME_SAMPLES = 20          # uint16 ecg_data[DATA_LENGTH]
+TICKS_PER_FRAME = FRAME_SAMPLES + 1  # the tick that sends the notification takes no sample
+NOMINAL_DEVICE_HZ = FRAME_SAMPLES / (TICKS_PER_FRAME * TIMER_PERIOD_S)  # ~414 Hz before crystal drift
+
+# === Host side ===
+TARGET_HZ = 360.0           # rate the model was trained at (MIT-BIH)
+RATE_WINDOW_FRAMES = 2000   # effective memory of the rate estimator (~100 s)
+WARMUP_FRAMES = 20          # frames before the estimate replaces the nominal rate
+GAP_THRESHOLD_FRAMES = 0.75 # lateness (in frames) that counts as a dropped notification
+MAX_FILL_SAMPLES = 2000     # longer gaps reset the stream instead of being filled
+
+
+class StreamClock():
+    """
+    Timestamps incoming frames and estimates the true device sample rate online.
+
+    Arrival times are jittered by BLE connection events, so the rate is taken
+    from an exponentially weighted least-squares fit of arrival time against
+    device sample index rather than from individual inter-arrival gaps. The
+    fit also predicts when the next frame is due, which is how dropped
+    notifications are detected.
+    """
+
+    def __init__(self, nominal_hz=NOMINAL_DEVICE_HZ, frame_samples=FRAME_SAMPLES, window_frames=RATE_WINDOW_FRAMES):
+        self.nominal_hz = nominal_hz
+        self.frame_samples = frame_samples
+        self.window_frames = window_frames
+        self.reset()
+
+    def reset(self):
+        self.next_index = 0         # device sample index of the next expected sample
+        self.frames = 0
+        self.dropped_frames = 0
+        self._mean_n = 0.0
+        self._mean_t = 0.0
+        self._var_n = 0.0
+        self._cov_nt = 0.0
+        self._t0 = None
+
+    @property
+    def sample_rate_hz(self):
+        if self.frames < WARMUP_FRAMES or self._var_n <= 0.0 or self._cov_nt <= 0.0:
+            return self.nominal_hz
+        return self._var_n / self._cov_nt
+
+    @property
+    def drift_ppm(self):
+        return (self.sample_rate_hz / self.nominal_hz - 1.0) * 1e6
+
+    def timestamp(self, index):
+        """Host-clock time (seconds, same clock as `arrival`) of a device sample index, drift corrected."""
+        period = 1.0 / self.sample_rate_hz
+        return self._t0 + self._mean_t + (np.asarray(index) - self._mean_n) * period
+
+    def on_frame(self, n_samples, arrival=None):
+        """
+        Registers a received frame.
+
+        Args:
+            n_samples (int): Samples in the frame.
+            arrival (float | None): Arrival time in seconds (time.monotonic()), now if None.
+
+        Returns:
+            tuple[int, int]: (device index of the frame's first sample, samples missing before it).
+        """
+        arrival = time.monotonic() if arrival is None else arrival
+        if self._t0 is None:
+            self._t0 = arrival
+        t = arrival - self._t0
+
+        missing = 0
+        if self.frames > 0:
+            # The frame completes when its last sample is taken, so compare end times.
+            expected = self._mean_t + (self.next_index + n_samples - 1 - self._mean_n) / self.sample_rate_hz
+            lateness = (t - expected) * self.sample_rate_hz / self.frame_samples
+            if lateness >= GAP_THRESHOLD_FRAMES:
+                lost_frames = int(round(lateness))
+                missing = lost_frames * self.frame_samples
+                self.dropped_frames += lost_frames
+
+        start = self.next_index + missing
+        self.next_index = start + n_samples
+        self._update_fit(self.next_index - 1, t)
+        return start, missing
+
+    def _update_fit(self, n, t):
+        self.frames += 1
+        if self.frames == 1:
+            self._mean_n, self._mean_t = float(n), t
+            return
+        alpha = max(1.0 / self.frames, 1.0 / self.window_frames)
+        dn = n - self._mean_n
+        dt = t - self._mean_t
+        self._mean_n += alpha * dn
+        self._mean_t += alpha * dt
+        self._var_n = (1.0 - alpha) * (self._var_n + alpha * dn * dn)
+        self._cov_nt = (1.0 - alpha) * (self._cov_nt + alpha * dn * dt)
+
+
+class StreamingResampler():
+    """
+    Arbitrary-ratio polyphase resampler that keeps its history between chunks.
+
+    A windowed-sinc prototype is split into `n_phases` sub-filters; each output
+    sample picks the sub-filter closest to its fractional input position. The
+    input rate can be updated at any time (drift correction) without
+    restarting the stream or losing continuity.
+    """
+
+    def __init__(self, input_hz, output_hz=TARGET_HZ, taps_per_phase=16, n_phases=256):
+        self.output_hz = output_hz
+        self.taps = taps_per_phase
+        self.n_phases = n_phases
+        self.input_hz = input_hz
+        cutoff = 0.45 * min(input_hz, output_hz)  # fixed so rate updates do not change the bank
+        prototype = firwin(taps_per_phase * n_phases + 1, cutoff, fs=input_hz * n_phases) * n_phases
+        # bank[p, k] multiplies input sample (m0 + 1 - taps/2 + k) for fractional position p / n_phases.
+        k = np.arange(taps_per_phase)
+        p = np.arange(n_phases)
+        self.bank = prototype[(taps_per_phase - 1 - k)[np.newaxis, :] * n_phases + p[:, np.newaxis]]
+        self.reset()
+
+    def reset(self):
+        self._history = np.zeros(0)
+        self._history_start = 0     # absolute input index of _history[0]
+        self._next_out = None       # absolute input position of the next output sample
+        self._step = self.input_hz / self.output_hz
+
+    def set_input_rate(self, input_hz):
+        self.input_hz = input_hz
+        self._step = input_hz / self.output_hz
+
+    def process(self, chunk):
+        """Consumes input samples and returns every output sample that is now fully determined."""
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if self._next_out is None:
+            if chunk.size == 0:
+                return np.zeros(0)
+            # Pad the past with the first sample so the stream starts without a transient.
+            pad = self.taps // 2
+            self._history = np.full(pad, chunk[0])
+            self._history_start = -pad
+            self._next_out = 0.0
+        self._history = np.concatenate([self._history, chunk])
+        last_index = self._history_start + self._history.size - 1
+
+        # Output at position t needs inputs up to floor(t) + taps/2, plus one when
+        # its phase rounds up to the next input sample.
+        available = last_index - self.taps // 2 - 1 - self._next_out
+        if available < 0:
+            return np.zeros(0)
+        n_out = int(np.floor(available / self._step)) + 1
+        positions = self._next_out + self._step * np.arange(n_out)
+        self._next_out = positions[-1] + self._step
+
+        m0 = np.floor(positions).astype(np.int64)
+        phase = np.rint((positions - m0) * self.n_phases).astype(np.int64)
+        wrapped = phase == self.n_phases
+        m0[wrapped] += 1
+        phase[wrapped] = 0
+        first = m0 + 1 - self.taps // 2 - self._history_start
+        windows = self._history[first[:, np.newaxis] + np.arange(self.taps)[np.newaxis, :]]
+        out = np.einsum("ij,ij->i", self.bank[phase], windows)
+
+        # Keep just enough history for the next output.
+        keep_from = int(np.floor(self._next_out)) + 1 - self.taps // 2 - self._history_start
+        if keep_from > 0:
+            self._history = self._history[keep_from:]
+            self._history_start += keep_from
+        return out
+
+
+class StreamTiming():
+    """
+    Per-device timing stage: timestamps frames, fills dropped notifications and
+    emits the stream at exactly `output_hz` with the drift-corrected rate.
+    """
+
+    def __init__(self, output_hz=TARGET_HZ, nominal_hz=NOMINAL_DEVICE_HZ, frame_samples=FRAME_SAMPLES):
+        self.clock = StreamClock(nominal_hz=nominal_hz, frame_samples=frame_samples)
+        self.resampler = StreamingResampler(nominal_hz, output_hz=output_hz)
+        self.output_hz = output_hz
+        self.resets = 0
+        self._last_sample = None
+
+    def process(self, frame, arrival=None):
+        """
+        Args:
+            frame (np.ndarray): Raw samples of one notification.
+            arrival (float | None): Arrival time in seconds (time.monotonic()), now if None.
+
+        Returns:
+            tuple[np.ndarray, int]: (samples at output_hz, samples missing before this frame).
+        """
+        frame = np.asarray(frame, dtype=np.float64)
+        start, missing = self.clock.on_frame(frame.size, arrival)
+        if missing > MAX_FILL_SAMPLES:
+            # Too long to bridge (reconnect, radio outage): start a fresh timeline.
+            self.clock.reset()
+            self.clock.on_frame(frame.size, arrival)
+            self.resampler.reset()
+            self.resets += 1
+        elif missing and self._last_sample is not None:
+            # Hold the last value so the output timeline stays sample-accurate.
+            frame = np.concatenate([np.full(missing, self._last_sample), frame])
+        self._last_sample = frame[-1]
+        self.resampler.set_input_rate(self.clock.sample_rate_hz)
+        return self.resampler.process(frame), missing
@@ -0,0 +1,372 @@
+"""
+K-fold CPU training and fine-tuning of CNNBiLSTM.
+
+Labelled beats are cut from the records once, resampled to the classifier's
+input length and appended to a float32 window cache on disk:
+
+    <cache>/windows.f32   (n_windows, seq_length) raw ADC counts, memory-mapped
+    <cache>/labels.npy    class index per window
+    <cache>/sources.npy   index of the record each window came from
+    <cache>/meta.json     classes, seq_length and the records (with size/mtime)
+
+Later runs reuse the cache as long as the record list is unchanged, so epochs
+never touch the records or resample_poly again. Normalization is computed per
+fold from that fold's training windows, mini-batches are gathered from the
+memory map by DataLoader workers, and every fold writes the artifacts runner.py
+and bundle.py already consume:
+
+    <out>/best_model{fold}.pth, <out>/train_means.npy, <out>/train_stds.npy
+
+Usage:
+    python -m ml.train data/mitdb --epochs 30 --workers 4
+    python -m ml.train site_records/ --init ml/best_model{fold}.pth --keep-normalization --epochs 5 --lr 1e-4
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from scipy.signal import resample_poly
+from torch.utils.data import BatchSampler, DataLoader, Dataset, RandomSampler, SequentialSampler
+
+from ml.BILSTM import CNNBiLSTM
+from ml.bundle import DEFAULT_CLASSES, DEFAULT_INPUT_SPEC, pack_bundle
+from ml.readers import ANNOTATION_EXTENSION, beat_windows, open_record, read_annotations
+from ml.scores import confusion_matrix, format_scores, per_class_scores
+
+# === Configuration ===
+DEFAULT_CACHE_DIR = "ml/window_cache"
+DEFAULT_OUT_DIR = "ml/trained"
+N_FOLDS = 5
+WINDOW_BEFORE_S = 90 / 360      # the classifier's window: 90 samples before and 81 from the R peak at 360 Hz
+WINDOW_AFTER_S = 81 / 360
+BATCH_SIZE = 256
+EPOCHS = 30
+LEARNING_RATE = 1e-3
+WEIGHT_DECAY = 1e-4
+PATIENCE = 5                    # epochs without a better validation macro F1 before a fold stops
+STATS_CHUNK = 65536             # windows per chunk when computing normalization stats
+
+
+def _record_paths(inputs):
+    """Expands directories to the records inside them (WFDB headers and EDF files)."""
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            found = sorted(glob.glob(os.path.join(path, "*.hea")) + glob.glob(os.path.join(path, "*.edf")))
+            paths.extend(found)
+        else:
+            paths.append(path)
+    return paths
+
+
+def _annotation_path(path, extension):
+    base = path if not os.path.splitext(path)[1] else os.path.splitext(path)[0]
+    return f"{base}.{extension}"
+
+
+class WindowCache():
+    """The on-disk window cache. The memory map is opened lazily so the object pickles cheaply into workers."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.classes = self.meta["classes"]
+        self.seq_length = self.meta["seq_length"]
+        self.labels = np.load(os.path.join(directory, "labels.npy"))
+        self.sources = np.load(os.path.join(directory, "sources.npy"))
+        self._windows = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_windows"] = None
+        return state
+
+    @property
+    def windows(self):
+        if self._windows is None:
+            self._windows = np.memmap(os.path.join(self.directory, "windows.f32"), dtype=np.float32, mode="r",
+                                      shape=(len(self.labels), self.seq_length))
+        return self._windows
+
+
+def _describe(paths, classes, seq_length, channel, extension):
+    return {
+        "classes": list(classes),
+        "seq_length": seq_length,
+        "channel": channel,
+        "annotation_extension": extension,
+        "window_s": [WINDOW_BEFORE_S, WINDOW_AFTER_S],
+        "records": [{"path": os.path.abspath(p), "size": os.path.getsize(p), "mtime": os.path.getmtime(p),
+                     "annotations_mtime": os.path.getmtime(_annotation_path(p, extension))} for p in paths],
+    }
+
+
+def build_cache(records, directory=DEFAULT_CACHE_DIR, classes=DEFAULT_CLASSES, seq_length=DEFAULT_INPUT_SPEC["seq_length"],
+                channel=0, extension=ANNOTATION_EXTENSION, rebuild=False):
+    """
+    Cuts, resamples and stores every labelled beat of the records, unless an identical cache exists.
+
+    Args:
+        records (list[str]): Record paths or directories of records; each needs an annotation file next to it.
+        directory (str): Cache directory.
+        classes (list[str]): Beat symbols to keep, in output-logit order.
+        seq_length (int): Classifier input length.
+        channel (int): Signal channel (0 is MLII in MIT-BIH).
+        extension (str): Annotation file extension.
+        rebuild (bool): Ignore an existing cache.
+
+    Returns:
+        WindowCache
+    """
+    paths = _record_paths(records)
+    if not paths:
+        raise ValueError("No records to build the window cache from.")
+    description = _describe(paths, classes, seq_length, channel, extension)
+    meta_path = os.path.join(directory, "meta.json")
+    if not rebuild and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            existing = json.load(f)
+        if {k: v for k, v in existing.items() if k != "count"} == description:
+            cache = WindowCache(directory)
+            print(f"Reusing window cache {directory} ({len(cache)} windows).")
+            return cache
+
+    os.makedirs(directory, exist_ok=True)
+    lookup = {symbol: i for i, symbol in enumerate(classes)}
+    labels, sources = [], []
+    start = time.perf_counter()
+    with open(os.path.join(directory, "windows.f32"), "wb") as out:
+        for index, path in enumerate(paths):
+            record = open_record(path)
+            fs = record.sample_rate(channel)
+            before, after = int(round(WINDOW_BEFORE_S * fs)), int(round(WINDOW_AFTER_S * fs))
+            annotations = read_annotations(_annotation_path(path, extension))
+            count = 0
+            for windows, symbols in beat_windows(record, annotations, channel, before, after, symbols=classes):
+                windows = windows.astype(np.float64)
+                if windows.shape[1] != seq_length:
+                    # Same resampling as runner.preprocess_live_chunk, applied to a whole chunk of beats.
+                    windows = resample_poly(windows, up=seq_length, down=windows.shape[1], axis=1)
+                out.write(windows.astype(np.float32).tobytes())
+                labels.append(np.array([lookup[s] for s in symbols], dtype=np.int8))
+                sources.append(np.full(len(symbols), index, dtype=np.int32))
+                count += len(symbols)
+            print(f"  {os.path.basename(path)}: {count} beats at {fs:g} Hz")
+    labels = np.concatenate(labels) if labels else np.zeros(0, dtype=np.int8)
+    sources = np.concatenate(sources) if sources else np.zeros(0, dtype=np.int32)
+    np.save(os.path.join(directory, "labels.npy"), labels)
+    np.save(os.path.join(directory, "sources.npy"), sources)
+    with open(meta_path, "w") as f:
+        json.dump(dict(description, count=int(len(labels))), f, indent=2)
+    print(f"Built window cache {directory}: {len(labels)} windows in {time.perf_counter() - start:.1f} s")
+    return WindowCache(directory)
+
+
+def assign_folds(cache, n_folds=N_FOLDS, by_record=False, seed=0):
+    """
+    Fold index per window.
+
+    By default folds are stratified by class (each class spread evenly over the folds). With
+    by_record, whole records go to one fold, so validation measures performance on unseen patients.
+    """
+    rng = np.random.default_rng(seed)
+    folds = np.empty(len(cache), dtype=np.int8)
+    if by_record:
+        records = rng.permutation(np.unique(cache.sources))
+        record_fold = np.empty(cache.sources.max() + 1, dtype=np.int8)
+        record_fold[records] = np.arange(len(records)) % n_folds
+        folds[:] = record_fold[cache.sources]
+        return folds
+    for cls in np.unique(cache.labels):
+        members = rng.permutation(np.flatnonzero(cache.labels == cls))
+        folds[members] = np.arange(len(members)) % n_folds
+    return folds
+
+
+def normalization_stats(cache, indices):
+    """Scalar mean and std of the given windows, accumulated in chunks straight from the memory map."""
+    total, total_sq, count = 0.0, 0.0, 0
+    for i in range(0, len(indices), STATS_CHUNK):
+        chunk = cache.windows[np.sort(indices[i:i + STATS_CHUNK])].astype(np.float64)
+        total += chunk.sum()
+        total_sq += np.square(chunk).sum()
+        count += chunk.size
+    mean = total / count
+    return mean, float(np.sqrt(max(total_sq / count - mean * mean, 0.0)))
+
+
+class WindowDataset(Dataset):
+    """
+    Normalized mini-batches of cached windows.
+
+    Indexed with a whole list of positions (see make_loader), so each batch is one sorted
+    fancy-index read from the memory map instead of batch_size small reads.
+    """
+
+    def __init__(self, cache, indices, mean, std):
+        self.cache = cache
+        self.indices = np.asarray(indices)
+        self.mean = mean
+        self.std = std
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, positions):
+        rows = np.sort(self.indices[np.asarray(positions)])
+        x = (self.cache.windows[rows] - np.float32(self.mean)) / np.float32(self.std)
+        return torch.from_numpy(x[:, np.newaxis, :]), torch.from_numpy(self.cache.labels[rows].astype(np.int64))
+
+
+def make_loader(dataset, batch_size=BATCH_SIZE, shuffle=True, workers=0):
+    sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+    return DataLoader(dataset, sampler=BatchSampler(sampler, batch_size, drop_last=False), batch_size=None,
+                      num_workers=workers, persistent_workers=workers > 0)
+
+
+def predict(model, loader):
+    """(true, predicted) class indices over a loader."""
+    model.eval()
+    true, predicted = [], []
+    with torch.no_grad():
+        for x, y in loader:
+            predicted.append(model(x).argmax(dim=1).numpy())
+            true.append(y.numpy())
+    return np.concatenate(true), np.concatenate(predicted)
+
+
+def train_fold(cache, folds, fold, mean, std, init_state=None, epochs=EPOCHS, batch_size=BATCH_SIZE,
+               lr=LEARNING_RATE, patience=PATIENCE, workers=0, balanced=False, model_config=None):
+    """
+    Trains one fold: windows of `fold` validate, all others train.
+
+    Returns:
+        tuple[dict, list[dict]]: Best state dict by validation macro F1, and per-epoch history.
+    """
+    train_idx, val_idx = np.flatnonzero(folds != fold), np.flatnonzero(folds == fold)
+    train_loader = make_loader(WindowDataset(cache, train_idx, mean, std), batch_size, True, workers)
+    val_loader = make_loader(WindowDataset(cache, val_idx, mean, std), batch_size * 4, False, workers)
+
+    n_classes = len(cache.classes)
+    config = dict(input_channels=1, seq_length=cache.seq_length, n_classes=n_classes)
+    config.update(model_config or {})
+    model = CNNBiLSTM(**config)
+    if init_state is not None:
+        model.load_state_dict(init_state)
+    weight = None
+    if balanced:
+        counts = np.bincount(cache.labels[train_idx], minlength=n_classes).astype(np.float64)
+        weight = torch.tensor(counts.sum() / np.maximum(counts, 1) / n_classes, dtype=torch.float32)
+    criterion = nn.CrossEntropyLoss(weight=weight)
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr, weight_decay=WEIGHT_DECAY)
+
+    best_state, best_f1, stale, history = copy.deepcopy(model.state_dict()), -1.0, 0, []
+    for epoch in range(epochs):
+        start = time.perf_counter()
+        model.train()
+        loss_sum, seen = 0.0, 0
+        for x, y in train_loader:
+            optimizer.zero_grad()
+            loss = criterion(model(x), y)
+            loss.backward()
+            optimizer.step()
+            loss_sum += loss.item() * len(y)
+            seen += len(y)
+        train_time = time.perf_counter() - start
+        true, predicted = predict(model, val_loader)
+        scores = per_class_scores(confusion_matrix(true, predicted, n_classes), cache.classes)
+        history.append({"epoch": epoch + 1, "loss": loss_sum / max(seen, 1), "val_macro_f1": scores["macro_f1"],
+                        "val_accuracy": scores["accuracy"], "seconds": time.perf_counter() - start})
+        print(f"  fold {fold} epoch {epoch + 1}: loss {history[-1]['loss']:.4f}, val macro F1 {scores['macro_f1']:.4f}, "
+              f"{seen / train_time:.0f} windows/s")
+        if scores["macro_f1"] > best_f1:
+            best_f1, best_state, stale = scores["macro_f1"], copy.deepcopy(model.state_dict()), 0
+        else:
+            stale += 1
+            if stale >= patience:
+                break
+
+    model.load_state_dict(best_state)
+    true, predicted = predict(model, val_loader)
+    print(format_scores(per_class_scores(confusion_matrix(true, predicted, n_classes), cache.classes)))
+    return best_state, history
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or fine-tune CNNBiLSTM with K-fold cross-validation on CPU.")
+    parser.add_argument("records", nargs="+", help="WFDB records / EDF files or directories of them, with annotation files.")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--rebuild-cache", action="store_true")
+    parser.add_argument("--channel", type=int, default=0)
+    parser.add_argument("--annotations", default=ANNOTATION_EXTENSION, help="Annotation file extension.")
+    parser.add_argument("--folds", type=int, default=N_FOLDS)
+    parser.add_argument("--train-folds", type=int, nargs="+", help="Only train these folds (default: all).")
+    parser.add_argument("--by-record", action="store_true", help="Split folds by record instead of by beat.")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--lr", type=float, default=LEARNING_RATE)
+    parser.add_argument("--patience", type=int, default=PATIENCE)
+    parser.add_argument("--balanced", action="store_true", help="Weight the loss by inverse class frequency.")
+    parser.add_argument("--workers", type=int, default=2, help="DataLoader worker processes.")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads (default: torch's choice).")
+    parser.add_argument("--init", help="Fine-tune from these weights; path pattern, {fold} is replaced by the fold index.")
+    parser.add_argument("--keep-normalization", action="store_true",
+                        help="Reuse --means/--stds instead of recomputing them (use with --init).")
+    parser.add_argument("--means", default="ml/train_means.npy")
+    parser.add_argument("--stds", default="ml/train_stds.npy")
+    parser.add_argument("--out-dir", default=DEFAULT_OUT_DIR)
+    parser.add_argument("--bundle", help="Also pack the trained folds into this .arxb bundle.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    cache = build_cache(args.records, args.cache_dir, channel=args.channel, extension=args.annotations,
+                        rebuild=args.rebuild_cache)
+    folds = assign_folds(cache, args.folds, args.by_record, args.seed)
+    print(f"{len(cache)} windows, class counts {dict(zip(cache.classes, np.bincount(cache.labels, minlength=len(cache.classes)).tolist()))}")
+
+    if args.keep_normalization:
+        means, stds = np.load(args.means).astype(np.float64), np.load(args.stds).astype(np.float64)
+        if len(means) != args.folds:
+            raise ValueError(f"{args.means} has {len(means)} folds, expected {args.folds}.")
+    else:
+        stats = [normalization_stats(cache, np.flatnonzero(folds != fold)) for fold in range(args.folds)]
+        means, stds = np.array([m for m, _ in stats]), np.array([s for _, s in stats])
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    fold_weights, history = {}, {}
+    start = time.perf_counter()
+    for fold in args.train_folds or range(args.folds):
+        init_state = torch.load(args.init.format(fold=fold), map_location="cpu") if args.init else None
+        print(f"Fold {fold}: mean {means[fold]:.3f}, std {stds[fold]:.3f}")
+        state, history[fold] = train_fold(cache, folds, fold, means[fold], stds[fold], init_state, args.epochs,
+                                          args.batch_size, args.lr, args.patience, args.workers, args.balanced)
+        torch.save(state, os.path.join(args.out_dir, f"best_model{fold}.pth"))
+        fold_weights[fold] = state
+    np.save(os.path.join(args.out_dir, "train_means.npy"), means)
+    np.save(os.path.join(args.out_dir, "train_stds.npy"), stds)
+    with open(os.path.join(args.out_dir, "history.json"), "w") as f:
+        json.dump(history, f, indent=2)
+    print(f"Wrote {args.out_dir} in {(time.perf_counter() - start) / 60:.1f} min")
+
+    if args.bundle:
+        default_fold = max(fold_weights)
+        input_spec = dict(DEFAULT_INPUT_SPEC, fold_index=default_fold)
+        pack_bundle(args.bundle, fold_weights, means, stds, classes=cache.classes, input_spec=input_spec)
+        print(f"Wrote {args.bundle} (default fold {default_fold}).")
+
+
+if __name__ == "__main__":
+    main()
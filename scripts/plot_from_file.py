@@ -1,56 +1,33 @@
+import argparse
+import os
+
 import matplotlib.pyplot as plt
 import numpy as np
-import json
 from matplotlib.animation import FuncAnimation
 from collections import deque
 
+from ml.recordings import parse_data_from_file
+
 # Configuration
 ECG_HZ = 360.0
 DATA_FILE = 'data.text'
 MAX_POINTS = 500  # Number of points to display on the plot at once
 PLOT_RANGE = (0, 4) # Y-axis range
-
-def parse_data_from_file(filename):
-    """Parses ECG data from a text file."""
-    try:
-        with open(filename, 'r') as f:
-            content = f.read().strip()
-    except FileNotFoundError:
-        print(f"Error: {filename} not found.")
-        return []
-
-    # Try parsing as JSON first
-    try:
-        json_data = json.loads(content)
-        if 'data' in json_data and isinstance(json_data['data'], list):
-            return json_data['data']
-    except json.JSONDecodeError:
-        # Not a JSON file, proceed to other formats
-        pass
-
-    # Expected format is like: deque([0.1, 0.2, 0.3])
-    if content.startswith('deque(['):
-        content = content[len('deque(['):-2] # Remove deque wrapper
-
-    try:
-        data = [float(x) for x in content.split(',')]
-        return data
-    except ValueError:
-        print("Could not parse data. Ensure it's a comma-separated list of numbers, a deque representation, or a JSON object with a 'data' key.")
-        return []
+RECORD_EXTENSIONS = (".raw", ".arxc", ".hea", ".dat", ".edf", ".rec")  # browsed through the ml.pyramid index
 
 
-if __name__ == "__main__":
-    all_ecg_data = parse_data_from_file(DATA_FILE)
+def animate_text_file(path):
+    """Replays a text dump (comma-separated values, deque repr or JSON) one point per frame."""
+    all_ecg_data = parse_data_from_file(path)
     if not all_ecg_data:
-        print(f"Could not read or parse data from {DATA_FILE}")
+        print(f"Could not read or parse data from {path}")
         exit()
 
     data_iterator = iter(all_ecg_data)
-    
+
     # Setup Data and Plot
     plot_data = deque([0.0] * MAX_POINTS, maxlen=MAX_POINTS)
-    
+
     fig, ax = plt.subplots()
     line, = ax.plot(plot_data)
     ax.set_ylim(PLOT_RANGE)
@@ -59,7 +36,7 @@ if __name__ == "__main__":
     ax.set_ylabel("Voltage (V)")
 
     def update(frame):
-        global data_iterator
+        nonlocal data_iterator
         try:
             # Get the next data point
             next_val = next(data_iterator)
@@ -75,3 +52,64 @@ if __name__ == "__main__":
     # The interval should be 1000ms / 360Hz ~= 2.77 ms.
     ani = FuncAnimation(fig, update, interval=1000/ECG_HZ, blit=True)
     plt.show()
+
+
+def browse_recording(path, channel=0):
+    """
+    Zoomable view of a whole recording. Every pan / zoom asks the pyramid index for the
+    visible range at the axes' pixel width, so even a 24 h Holter file redraws in milliseconds.
+    """
+    from ml.pyramid import PyramidReader, build_pyramid, pyramid_path
+
+    if not os.path.exists(os.path.join(pyramid_path(path), "meta.json")):
+        print(f"Indexing {path} (once)...")
+        build_pyramid(path, channel)
+    reader = PyramidReader(path, channel)
+
+    fig, ax = plt.subplots(figsize=(12, 4))
+    ax.set_title(os.path.basename(path))
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Sample value")
+    mean_line, = ax.plot([], [], linewidth=0.8)
+    state = {"band": None, "range": None}
+
+    def draw(start, stop):
+        width = max(1, int(ax.get_window_extent().width))
+        view = reader.view(max(0.0, start), stop, width)
+        if state["band"] is not None:
+            state["band"].remove()
+        state["band"] = ax.fill_between(view["t"], view["min"], view["max"], step="post", alpha=0.4, linewidth=0)
+        mean_line.set_data(view["t"], view["mean"])
+        return view
+
+    def on_xlim_changed(axes):
+        limits = axes.get_xlim()
+        if limits == state["range"]:
+            return
+        state["range"] = limits
+        draw(*limits)
+        fig.canvas.draw_idle()
+
+    overview = draw(0.0, reader.duration_s)
+    ax.set_autoscale_on(False)
+    if len(overview["t"]):
+        low, high = float(np.min(overview["min"])), float(np.max(overview["max"]))
+        margin = 0.05 * (high - low or 1.0)
+        ax.set_ylim(low - margin, high + margin)
+    state["range"] = (0.0, reader.duration_s)
+    ax.set_xlim(*state["range"])
+    ax.callbacks.connect("xlim_changed", on_xlim_changed)
+    plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a text dump or browse a recording.")
+    parser.add_argument("path", nargs="?", default=DATA_FILE,
+                        help="Text dump to animate, or a recording (.raw, .arxc, WFDB, EDF) to browse.")
+    parser.add_argument("--channel", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.path.lower().endswith(RECORD_EXTENSIONS):
+        browse_recording(args.path, args.channel)
+    else:
+        animate_text_file(args.path)
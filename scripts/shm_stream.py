@@ -0,0 +1,339 @@
+"""
+Shared-memory stream between the ingest process and any number of viewers.
+
+The ingest process (daemon.py with "shm" configured) owns one shared-memory
+segment per session and is the only writer. UI processes (gui.py, gradio_vc.py,
+`python shm_stream.py watch`) map the segment read-only and poll it, so a slow
+redraw or a GC pause in a viewer never touches BLE callbacks or inference.
+
+Segment layout (all little-endian):
+
+    0     magic "ARXSHM\\0\\0", version u32, JSON header length u32
+    16    control block: samples_written, predictions_written (u64 counters),
+          connected, leads_off, sample_rate_hz, updated (wall time), writer pid
+    128   JSON header: name, classes, capacities
+    ...   samples ring, float32[capacity], samples at TARGET_HZ after filtering
+    ...   predictions ring, PREDICTION records
+
+The counters only grow. The writer fills ring slots first and bumps the counter
+afterwards; a reader copies the range it wants and then re-reads the counter,
+discarding whatever the writer lapped in the meantime. Prediction records carry
+their own sequence number, written last, for the same purpose.
+
+Usage:
+    python shm_stream.py list
+    python shm_stream.py watch bed-1
+"""
+import argparse
+import glob
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from ml.bundle import DEFAULT_CLASSES
+from ml.timing import TARGET_HZ
+
+# === Configuration ===
+MAGIC = b"ARXSHM\x00\x00"
+FORMAT_VERSION = 1
+SEGMENT_PREFIX = "arrythmix-"
+SAMPLE_CAPACITY_S = 120             # seconds of samples kept in the ring
+PREDICTION_CAPACITY = 1024
+MAX_CLASSES = 8
+HEADER_BYTES = 4096                 # room reserved for the JSON header
+STALE_AFTER_S = 5.0                 # a writer silent this long is reported as stale
+
+_PREAMBLE = struct.Struct("<8sII")
+_CONTROL_OFFSET = 16
+_JSON_OFFSET = 128
+CONTROL = np.dtype([
+    ("samples_written", "<u8"), ("predictions_written", "<u8"),
+    ("connected", "u1"), ("leads_off", "u1"), ("_pad", "u1", 6),
+    ("sample_rate_hz", "<f8"), ("updated", "<f8"), ("writer_pid", "<u8"),
+])
+PREDICTION = np.dtype([
+    ("seq", "<u8"), ("time", "<f8"), ("sample_index", "<u8"),
+    ("class_index", "<i4"), ("n_classes", "<i4"), ("probabilities", "<f4", (MAX_CLASSES,)),
+])
+
+
+def segment_name(stream):
+    """Shared-memory name of a stream; gateway stream names contain '/' and ':'."""
+    return SEGMENT_PREFIX + re.sub(r"[^A-Za-z0-9._-]", "_", stream)
+
+
+def _align(offset, alignment=64):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _layout(capacity, prediction_capacity):
+    samples_offset = _align(_JSON_OFFSET + HEADER_BYTES)
+    predictions_offset = _align(samples_offset + 4 * capacity)
+    size = predictions_offset + PREDICTION.itemsize * prediction_capacity
+    return samples_offset, predictions_offset, size
+
+
+class _Views():
+    """Numpy views of a mapped segment."""
+
+    def __init__(self, buffer):
+        magic, version, json_length = _PREAMBLE.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not an ArrythmiX stream segment.")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Stream segment version {version}, expected {FORMAT_VERSION}.")
+        self.header = json.loads(bytes(buffer[_JSON_OFFSET:_JSON_OFFSET + json_length]).decode("utf-8"))
+        self.capacity = self.header["capacity"]
+        self.prediction_capacity = self.header["prediction_capacity"]
+        samples_offset, predictions_offset, _ = _layout(self.capacity, self.prediction_capacity)
+        self.control = np.ndarray((), dtype=CONTROL, buffer=buffer, offset=_CONTROL_OFFSET)
+        self.samples = np.ndarray((self.capacity,), dtype=np.float32, buffer=buffer, offset=samples_offset)
+        self.predictions = np.ndarray((self.prediction_capacity,), dtype=PREDICTION, buffer=buffer,
+                                      offset=predictions_offset)
+
+
+class StreamWriter():
+    """
+    The ingest side of one session's stream. Not thread-safe across writers: each
+    session's samples come from one source thread and its predictions from the
+    inference thread, and the two rings are independent.
+    """
+
+    def __init__(self, name, capacity_s=SAMPLE_CAPACITY_S, sample_rate_hz=TARGET_HZ, classes=DEFAULT_CLASSES,
+                 prediction_capacity=PREDICTION_CAPACITY):
+        if len(classes) > MAX_CLASSES:
+            raise ValueError(f"At most {MAX_CLASSES} classes fit in a prediction record.")
+        self.name = name
+        self.segment = segment_name(name)
+        capacity = int(capacity_s * sample_rate_hz)
+        _, _, size = _layout(capacity, prediction_capacity)
+        try:
+            self._shm = shared_memory.SharedMemory(self.segment, create=True, size=size)
+        except FileExistsError:
+            # Left behind by an ingest process that died; nobody else writes under this name.
+            stale = shared_memory.SharedMemory(self.segment)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(self.segment, create=True, size=size)
+        header = json.dumps({"name": name, "classes": list(classes), "capacity": capacity,
+                             "prediction_capacity": prediction_capacity, "created": time.time()}).encode("utf-8")
+        if len(header) > HEADER_BYTES:
+            raise ValueError("Stream header too large.")
+        buffer = self._shm.buf
+        buffer[_JSON_OFFSET:_JSON_OFFSET + len(header)] = header
+        _PREAMBLE.pack_into(buffer, 0, MAGIC, FORMAT_VERSION, len(header))
+        self._views = _Views(buffer)
+        control = self._views.control
+        control["sample_rate_hz"] = sample_rate_hz
+        control["writer_pid"] = os.getpid()
+        control["updated"] = time.time()
+        self.classes = list(classes)
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float32).ravel()
+        views = self._views
+        capacity = views.capacity
+        if samples.size > capacity:
+            samples = samples[-capacity:]
+        written = int(views.control["samples_written"])
+        start = written % capacity
+        first = min(samples.size, capacity - start)
+        views.samples[start:start + first] = samples[:first]
+        views.samples[:samples.size - first] = samples[first:]
+        views.control["samples_written"] = written + samples.size
+        views.control["updated"] = time.time()
+
+    def set_status(self, connected=None, leads_off=None):
+        control = self._views.control
+        if connected is not None:
+            control["connected"] = bool(connected)
+        if leads_off is not None:
+            control["leads_off"] = bool(leads_off)
+        control["updated"] = time.time()
+
+    def publish_prediction(self, class_code, probabilities=None, sample_index=None, timestamp=None):
+        """One classification. class_code is e.g. "V"; sample_index defaults to the newest sample."""
+        views = self._views
+        n = int(views.control["predictions_written"])
+        record = views.predictions[n % views.prediction_capacity]
+        record["seq"] = 0                       # invalid while being rewritten
+        record["time"] = time.time() if timestamp is None else timestamp
+        record["sample_index"] = views.control["samples_written"] if sample_index is None else sample_index
+        record["class_index"] = self.classes.index(class_code) if class_code in self.classes else -1
+        record["probabilities"] = 0.0
+        if probabilities is not None:
+            probabilities = np.asarray(probabilities, dtype=np.float32)[:MAX_CLASSES]
+            record["probabilities"][:probabilities.size] = probabilities
+            record["n_classes"] = probabilities.size
+        else:
+            record["n_classes"] = 0
+        record["seq"] = n + 1
+        views.control["predictions_written"] = n + 1
+
+    def close(self, unlink=True):
+        self.set_status(connected=False)
+        self._views = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+
+class StreamReader():
+    """
+    A read-only view of a stream. On Linux the segment is mapped from /dev/shm with
+    PROT_READ, so a viewer cannot corrupt it; elsewhere it falls back to SharedMemory.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.segment = segment_name(name)
+        path = os.path.join("/dev/shm", self.segment)
+        self._shm = None
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            buffer = memoryview(self._mmap)
+        else:
+            self._shm = shared_memory.SharedMemory(self.segment)
+            buffer = self._shm.buf
+        self._views = _Views(buffer)
+        self.header = self._views.header
+        self.classes = self.header["classes"]
+        self.capacity = self._views.capacity
+
+    @property
+    def samples_written(self):
+        return int(self._views.control["samples_written"])
+
+    def status(self):
+        control = self._views.control
+        updated = float(control["updated"])
+        return {
+            "connected": bool(control["connected"]),
+            "leads_off": bool(control["leads_off"]),
+            "sample_rate_hz": float(control["sample_rate_hz"]),
+            "samples_written": int(control["samples_written"]),
+            "predictions_written": int(control["predictions_written"]),
+            "updated": updated,
+            "stale": time.time() - updated > STALE_AFTER_S,
+            "writer_pid": int(control["writer_pid"]),
+        }
+
+    def read(self, since, max_samples=None):
+        """
+        Samples written after sequence number `since`.
+
+        Returns:
+            tuple[np.ndarray, int, int]: (samples, next `since`, samples lost because the writer lapped us).
+        """
+        views = self._views
+        end = int(views.control["samples_written"])
+        start = max(since, end - self.capacity)
+        if max_samples is not None:
+            start = max(start, end - max_samples)
+        indices = np.arange(start, end) % self.capacity
+        samples = views.samples[indices]                # fancy indexing copies
+        # Anything the writer overwrote while we copied is dropped from the front.
+        valid_from = int(views.control["samples_written"]) - self.capacity
+        if valid_from > start:
+            samples = samples[valid_from - start:]
+            start = valid_from
+        lost = max(0, start - since) if max_samples is None else 0
+        return samples, end, lost
+
+    def latest(self, n):
+        """The newest n samples (fewer right after start-up)."""
+        return self.read(0, max_samples=n)[0]
+
+    def predictions(self, since=0):
+        """
+        Predictions after sequence number `since`, oldest first.
+
+        Returns:
+            tuple[list[dict], int]: (predictions, next `since`).
+        """
+        views = self._views
+        end = int(views.control["predictions_written"])
+        result = []
+        for n in range(max(since, end - self.prediction_capacity), end):
+            record = views.predictions[n % self.prediction_capacity].copy()
+            if int(record["seq"]) != n + 1:
+                continue                                # rewritten while we looked
+            index = int(record["class_index"])
+            result.append({
+                "time": float(record["time"]),
+                "sample_index": int(record["sample_index"]),
+                "class": self.classes[index] if 0 <= index < len(self.classes) else None,
+                "probabilities": record["probabilities"][:int(record["n_classes"])].tolist(),
+            })
+        return result, end
+
+    @property
+    def prediction_capacity(self):
+        return self._views.prediction_capacity
+
+    def close(self):
+        self._views = None
+        if self._shm is not None:
+            self._shm.close()
+        else:
+            self._mmap.close()
+
+
+def list_streams():
+    """Stream names with a segment in /dev/shm (Linux only)."""
+    names = []
+    for path in sorted(glob.glob(os.path.join("/dev/shm", SEGMENT_PREFIX + "*"))):
+        try:
+            reader = StreamReader(os.path.basename(path)[len(SEGMENT_PREFIX):])
+        except (ValueError, OSError):
+            continue
+        names.append(reader.header["name"])
+        reader.close()
+    return names
+
+
+def watch(name, interval=1.0):
+    """Headless viewer: prints rate, lag and the latest prediction once per interval."""
+    reader = StreamReader(name)
+    since, predictions_since = reader.samples_written, 0
+    last = time.monotonic()
+    while True:
+        time.sleep(interval)
+        samples, since, lost = reader.read(since)
+        predictions, predictions_since = reader.predictions(predictions_since)
+        now = time.monotonic()
+        status = reader.status()
+        latest = predictions[-1]["class"] if predictions else "-"
+        print(f"[{name}] {samples.size / (now - last):7.1f} samples/s, lost {lost}, "
+              f"{'leads off' if status['leads_off'] else 'ok'}{' (stale)' if status['stale'] else ''}, "
+              f"{len(predictions)} predictions, latest {latest}", flush=True)
+        last = now
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect ArrythmiX shared-memory streams.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List the streams published on this machine.")
+    watch_parser = sub.add_parser("watch", help="Print a stream's rate and predictions.")
+    watch_parser.add_argument("name")
+    watch_parser.add_argument("--interval", type=float, default=1.0)
+    args = parser.parse_args()
+    if args.command == "list":
+        print("\n".join(list_streams()) or "No streams.")
+    else:
+        try:
+            watch(args.name, args.interval)
+        except KeyboardInterrupt:
+            sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()